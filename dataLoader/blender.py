@@ -8,6 +8,7 @@ from torchvision import transforms as T
 from .data_utils import *
 
 from .ray_utils import *
+from .image_io import load_images, to_chw
 
 
 class BlenderDataset(Dataset):
@@ -17,6 +18,8 @@ class BlenderDataset(Dataset):
         self.root_dir = datadir
         self.split = split
         self.is_stack = is_stack
+        self.stream_rays = not is_stack and getattr(args, "stream_rays", 0) > 0
+        self.load_workers = getattr(args, "load_workers", 0)
         self.img_wh = (int(800/downsample),int(800/downsample))
         self.define_transforms()
 
@@ -73,7 +76,10 @@ class BlenderDataset(Dataset):
         self.raw_poses = []
         img_eval_interval = 1 if self.N_vis < 0 else len(self.meta['frames']) // self.N_vis
         idxs = list(range(0, len(self.meta['frames']), img_eval_interval))
-        for i in tqdm(idxs, desc=f'Loading data {self.split} ({len(idxs)})'):#img_list:#
+        self.image_paths = [os.path.join(self.root_dir, f"{self.meta['frames'][i]['file_path']}.png") for i in idxs]
+        images = load_images(self.image_paths, img_wh=self.img_wh if self.downsample != 1.0 else None, mode='RGBA',
+                             workers=self.load_workers, desc=f'Loading data {self.split} ({len(idxs)})')
+        for n, i in enumerate(idxs):
 
             frame = self.meta['frames'][i]
             pose = np.array(frame['transform_matrix']) @ self.blender2opencv
@@ -82,14 +88,9 @@ class BlenderDataset(Dataset):
             self.poses += [c2w]
             self.raw_poses += [torch.FloatTensor(raw_poses)]
 
-            image_path = os.path.join(self.root_dir, f"{frame['file_path']}.png")
-            self.image_paths += [image_path]
-            img = Image.open(image_path)
-            
-            if self.downsample!=1.0:
-                img = img.resize(self.img_wh, Image.Resampling.LANCZOS)
-            img = self.transform(img)  # (4, h, w)
-            img = img.view(4, -1).permute(1, 0)  # (h*w, 4) RGBA
+            if self.stream_rays:
+                continue
+            img = images[n].view(-1, 4).float().div(255)  # (h*w, 4) RGBA
             alpha_img = img[:, -1:]
             img = img[:, :3] * alpha_img + (1 - alpha_img)  # blend A to RGB
             if self.rnd_ray > 0:
@@ -103,7 +104,12 @@ class BlenderDataset(Dataset):
 
         self.poses = torch.stack(self.poses)
         self.raw_poses = torch.stack(self.raw_poses)
-        if not self.is_stack:
+        if self.stream_rays:
+            self.all_rays = RayStream(images, self.poses, self.directions, ij=self.ij, rnd_ray=self.rnd_ray > 0)
+            self.all_rgbs = self.all_rays.rgbs
+            if self.rnd_ray > 0:
+                self.all_alpha, self.ijs, self.c2ws = self.all_rays.alphas, self.all_rays.ijs, self.all_rays.rots
+        elif not self.is_stack:
             self.all_rays = torch.cat(self.all_rays, 0)  # (len(self.meta['frames])*h*w, 3)
             self.all_rgbs = torch.cat(self.all_rgbs, 0)  # (len(self.meta['frames])*h*w, 3)
             if self.rnd_ray > 0:
@@ -180,9 +186,10 @@ class BlenderDataset(Dataset):
 
 class BlenderMVSDataset(Dataset):
 
-    def __init__(self, datadir, split='train', downsample=1.0, is_stack=False, N_vis=-1):
+    def __init__(self, datadir, split='train', downsample=1.0, is_stack=False, N_vis=-1, args=None):
         self.data_dir = datadir
         self.split = split
+        self.load_workers = getattr(args, "load_workers", 0)
 
         self.img_wh = (int(800 * downsample), int(800 * downsample))
         self.downsample = downsample
@@ -304,14 +311,10 @@ class BlenderMVSDataset(Dataset):
         self.directions = get_ray_directions(h, w, [self.focal, self.focal])  # (h, w, 3)
 
         count = 0
+        self.image_paths = [os.path.join(self.data_dir, f"{self.meta['frames'][idx]['file_path']}.png") for idx in self.id_list]
+        images = load_images(self.image_paths, img_wh=self.img_wh, workers=self.load_workers)
         for i, idx in enumerate(self.id_list):
-            frame = self.meta['frames'][idx]
-
-            image_path = os.path.join(self.data_dir,  f"{frame['file_path']}.png")
-            self.image_paths += [image_path]
-            img = Image.open(image_path)
-            img = img.resize(self.img_wh, Image.Resampling.LANCZOS)
-            img = self.transform(img)  # (4, h, w)
+            img = to_chw(images[i])  # (4, h, w)
             self.depths += [(img[-1:, ...] > 0.1).numpy().astype(np.float32)]
             self.alphas += [img[-1:].numpy().astype(np.float32)]
             self.blackimgs += [img[:3] * img[-1:]]
@@ -0,0 +1,76 @@
+import os
+import numpy as np
+import cv2
+from concurrent.futures import ProcessPoolExecutor
+
+''' Frame quality for video-like indoor captures (ScanNet exported/ layout)
+blur_scores: variance of the Laplacian of every frame (higher is sharper), computed by a process pool and cached in
+    exported/blur_scores.npz with each image's size and mtime, so only new or changed frames are scored again; entries of
+    frames outside the current ids are kept. Frames are read in color and converted with cvtColor, as the original
+    detect_blurry did (cv2's IMREAD_GRAYSCALE decode rounds differently).
+select_frames: keeps the sharpest frame of every window of `step` consecutive frames (instead of every step-th frame),
+    then drops frames whose camera is within min_dist and min_angle of an already selected, sharper frame
+    (a threshold of 0 leaves that axis unconstrained).
+'''
+CACHE_NAME = "blur_scores.npz"
+
+
+def variance_of_laplacian(path):
+    image = cv2.cvtColor(cv2.imread(path), cv2.COLOR_BGR2GRAY)
+    return cv2.Laplacian(image, cv2.CV_64F).var()
+
+
+def _stat(path):
+    stat = os.stat(path)
+    return stat.st_size, stat.st_mtime_ns
+
+
+def blur_scores(root_dir, ids, workers=0):
+    # {id: score} for ids, scoring only what the cache doesn't hold
+    paths = {i: os.path.join(root_dir, "exported/color/{}.jpg".format(i)) for i in ids}
+    stats = {i: _stat(path) for i, path in paths.items()}
+    cache_path = os.path.join(root_dir, "exported", CACHE_NAME)
+    # cached {id: (score, size, mtime)}, entries of other frames are written back untouched
+    cache = {}
+    if os.path.exists(cache_path):
+        with np.load(cache_path) as f:
+            cache = {i: (score, size, mtime) for i, score, size, mtime in zip(f["ids"].tolist(), f["scores"].tolist(), f["sizes"].tolist(), f["mtimes"].tolist())}
+    scores = {i: cache[i][0] for i in ids if i in cache and cache[i][1:] == stats[i]}
+    missing = [i for i in ids if i not in scores]
+    if len(missing) > 0:
+        workers = workers if workers > 0 else os.cpu_count()
+        print("scoring {} frames for blur with {} processes".format(len(missing), workers))
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            for i, score in zip(missing, pool.map(variance_of_laplacian, [paths[i] for i in missing], chunksize=max(1, len(missing) // (4 * workers)))):
+                scores[i] = score
+                cache[i] = (score, *stats[i])
+        keys = sorted(cache)
+        tmp = cache_path + ".{}.tmp.npz".format(os.getpid())
+        np.savez(tmp, ids=np.asarray(keys), scores=np.asarray([cache[i][0] for i in keys]),
+                 sizes=np.asarray([cache[i][1] for i in keys]), mtimes=np.asarray([cache[i][2] for i in keys]))
+        os.replace(tmp, cache_path)
+    return {i: scores[i] for i in ids}
+
+
+def select_frames(ids, scores, c2ws, step, min_dist=0.0, min_angle=0.0):
+    # ids: candidate frames in capture order, scores: {id: score}, c2ws: {id: [4, 4] camera to world}
+    windows = [ids[i:i + step] for i in range(0, len(ids), step)]
+    picked = [max(window, key=lambda i: scores[i]) for window in windows]
+    if min_dist <= 0 and min_angle <= 0:
+        return picked
+    cos_min = np.cos(np.deg2rad(min_angle))
+    kept, centers, axes = set(), [], []
+    for i in sorted(picked, key=lambda i: -scores[i]):
+        center, axis = c2ws[i][:3, 3], c2ws[i][:3, 2]
+        if len(centers) > 0:
+            close = np.ones(len(centers), dtype=bool)
+            if min_dist > 0:
+                close &= np.linalg.norm(np.asarray(centers) - center, axis=-1) < min_dist
+            if min_angle > 0:
+                close &= np.asarray(axes) @ axis > cos_min
+            if close.any():
+                continue
+        kept.add(i)
+        centers.append(center)
+        axes.append(axis)
+    return [i for i in picked if i in kept]
@@ -0,0 +1,64 @@
+import os
+import numpy as np
+import torch
+from PIL import Image
+from tqdm import tqdm
+from concurrent.futures import ThreadPoolExecutor
+
+''' Parallel image loading for the dataset loaders
+PIL releases the GIL while decoding and resampling, so a thread pool decodes and resizes the frames concurrently.
+Every frame is written into one preallocated uint8 buffer [N, h, w, C] at its own index, the order of paths is kept.
+images[i].float() / 255 equals T.ToTensor()(img).permute(1, 2, 0) of the same frame.
+'''
+
+
+def default_workers():
+    return min(32, (os.cpu_count() or 1) + 4)
+
+
+def load_image(path, img_wh=None, mode=None, resample=Image.Resampling.LANCZOS):
+    img = Image.open(path)
+    if mode is not None and img.mode != mode:
+        img = img.convert(mode)
+    if img_wh is not None and img.size != tuple(img_wh):
+        img = img.resize(tuple(img_wh), resample)
+    return np.asarray(img)
+
+
+def _run(fn, n, workers, desc):
+    workers = workers if workers > 0 else default_workers()
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        for _ in tqdm(pool.map(fn, range(n)), total=n, desc=desc, disable=desc is None):
+            pass
+
+
+def load_images(paths, img_wh=None, mode=None, resample=Image.Resampling.LANCZOS, workers=0, desc=None):
+    # uint8 [N, h, w, C] (C = 1 for single channel modes). All frames must share the size after img_wh
+    first = load_image(paths[0], img_wh, mode, resample)
+    first = first[..., None] if first.ndim == 2 else first
+    images = torch.empty((len(paths),) + first.shape, dtype=torch.uint8)
+    buffer = images.numpy()
+
+    def fill(i):
+        img = first if i == 0 else load_image(paths[i], img_wh, mode, resample)
+        buffer[i] = img[..., None] if img.ndim == 2 else img
+
+    _run(fill, len(paths), workers, desc)
+    return images
+
+
+def load_image_list(paths, img_wh=None, mode=None, resample=Image.Resampling.LANCZOS, workers=0, desc=None):
+    # list of uint8 [h, w, C] tensors, for frames of different sizes
+    images = [None] * len(paths)
+
+    def fill(i):
+        img = load_image(paths[i], img_wh, mode, resample)
+        images[i] = torch.from_numpy(np.array(img[..., None] if img.ndim == 2 else img))
+
+    _run(fill, len(paths), workers, desc)
+    return images
+
+
+def to_chw(image):
+    # float [C, h, w] in [0, 1], what T.ToTensor returns for the PIL image
+    return image.permute(2, 0, 1).float().div(255)
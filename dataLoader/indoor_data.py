@@ -6,11 +6,9 @@ import os
 from PIL import Image
 from torchvision import transforms as T
 from .data_utils import *
-import sys
-models_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), "../models")
-sys.path.append(models_dir)
-from apparatus import draw_ray
+from models.apparatus import draw_ray
 from .ray_utils import *
+from .image_io import load_images, load_image_list, to_chw
 from plyfile import PlyData
 
 class IndoorDataset(Dataset):
@@ -21,6 +19,7 @@ class IndoorDataset(Dataset):
         self.split = split
         self.is_stack = is_stack
         self.downsample = downsample
+        self.load_workers = getattr(args, "load_workers", 0)
         self.define_transforms()
 
         self.scene_bbox = torch.tensor([[-30.0, -30.0, -30.0], [20.0, 20.0, 20.0]])  # 10
@@ -125,19 +124,18 @@ class IndoorDataset(Dataset):
         #img_eval_interval = 1 if self.N_vis < 0 else len(self.meta['frames']) // self.N_vis
         img_eval_interval = 1 if self.N_vis < 0 else len(meta_raw) // self.N_vis
         idxs = list(range(0, len(meta_raw), img_eval_interval))
-        for i in tqdm(idxs, desc=f'Loading data {self.split} ({len(meta_raw)})'):#img_list:#
+        self.image_paths = [os.path.join(self.root_dir, f"images/{img_idx[i]}") for i in idxs]
+        images = load_image_list(self.image_paths, workers=self.load_workers, desc=f'Loading data {self.split} ({len(meta_raw)})')
+        for n, i in enumerate(idxs):
  
             pose = np.array(transform_matrix[i]) # @ self.blender2opencv
             c2w = torch.FloatTensor(pose)
             self.poses += [c2w]
             self.raw_poses += [torch.FloatTensor(np.array(transform_matrix[i]))]
 
-            image_path = os.path.join(self.root_dir, f"images/{img_idx[i]}")
-            self.image_paths += [image_path]
-            img = Image.open(image_path)
             #if self.downsample!=1.0:
             #    img = img.resize([img_w[i], img_h[i]], Image.LANCZOS)
-            img = self.transform(img)  # (4, h, w)
+            img = to_chw(images[n])  # (4, h, w)
             self.img_wh += [[img_w[i], img_h[i]]]
             ####### when we have RGBA images
             #img = img.view(-1, img_w[i]*img_h[i]).permute(1, 0)  # (h*w, 4) RGBA
@@ -224,9 +222,10 @@ class IndoorDataset(Dataset):
 
 class IndoorMVSDataset(Dataset):
 
-    def __init__(self, datadir, split='train', downsample=1.0, is_stack=False, N_vis=-1):
+    def __init__(self, datadir, split='train', downsample=1.0, is_stack=False, N_vis=-1, args=None):
         self.data_dir = datadir
         self.split = split
+        self.load_workers = getattr(args, "load_workers", 0)
 
         #self.img_wh = (int(800 * downsample), int(800 * downsample))
         self.downsample = downsample
@@ -384,14 +383,10 @@ class IndoorMVSDataset(Dataset):
         self.directions = get_ray_directions(h, w, [self.focal, self.focal])  # (h, w, 3)
 
         count = 0
+        self.image_paths = [os.path.join(self.data_dir, f"{self.meta['frames'][idx]['file_path']}.png") for idx in self.id_list]
+        images = load_images(self.image_paths, img_wh=self.img_wh, workers=self.load_workers)
         for i, idx in enumerate(self.id_list):
-            frame = self.meta['frames'][idx]
-
-            image_path = os.path.join(self.data_dir,  f"{frame['file_path']}.png")
-            self.image_paths += [image_path]
-            img = Image.open(image_path)
-            img = img.resize(self.img_wh, Image.LANCZOS)
-            img = self.transform(img)  # (4, h, w)
+            img = to_chw(images[i])  # (4, h, w)
             self.depths += [(img[-1:, ...] > 0.1).numpy().astype(np.float32)]
             self.alphas += [img[-1:].numpy().astype(np.float32)]
             self.blackimgs += [img[:3] * img[-1:]]
@@ -7,6 +7,7 @@ from PIL import Image
 from torchvision import transforms as T
 
 from .ray_utils import *
+from .image_io import load_images
 from tqdm import tqdm
 import scipy
 
@@ -281,6 +282,8 @@ class LLFFDataset(Dataset):
         self.split = split
         self.hold_every = hold_every
         self.is_stack = is_stack
+        self.stream_rays = not is_stack and getattr(args, "stream_rays", 0) > 0
+        self.load_workers = getattr(args, "load_workers", 0)
         self.downsample = args.downsample_train  # downsample
         self.define_transforms()
 
@@ -389,17 +392,15 @@ class LLFFDataset(Dataset):
 
         xyz_min = torch.Tensor([np.inf, np.inf, np.inf])
         xyz_max = -xyz_min
+        images = load_images([self.image_paths[i] for i in img_list], img_wh=self.img_wh if self.downsample != 1.0 else None, mode='RGB',
+                             workers=self.load_workers, desc=f'Loading data {self.split} ({len(img_list)})')
 
-        for i in tqdm(img_list):
-            image_path = self.image_paths[i]
+        for n, i in enumerate(img_list):
             c2w = torch.FloatTensor(self.poses[i])
 
-            img = Image.open(image_path).convert('RGB')
-            if self.downsample != 1.0:
-                img = img.resize(self.img_wh, Image.LANCZOS)
-            img = self.transform(img)  # (3, h, w)
-      
-            img = img.view(3, -1).permute(1, 0)  # (h*w, 3) RGB
+            if self.stream_rays:
+                continue
+            img = images[n].view(-1, 3).float().div(255)  # (h*w, 3) RGB
             self.all_rgbs += [img]
 
             if args.ub360 != 1:
@@ -437,7 +438,11 @@ class LLFFDataset(Dataset):
         #self.scene_bbox = torch.stack((xyz_min, xyz_max))
         #import pdb;pdb.set_trace()
 
-        if not self.is_stack:
+        if self.stream_rays:
+            ndc = (H, W, self.focal[0], 1.0) if args.ub360 != 1 else None
+            self.all_rays = RayStream(images, torch.FloatTensor(self.poses[img_list]), self.directions, ndc=ndc)
+            self.all_rgbs = self.all_rays.rgbs
+        elif not self.is_stack:
             self.all_rays = torch.cat(self.all_rays, 0) # (len(self.meta['frames])*h*w, 3)
             self.all_rgbs = torch.cat(self.all_rgbs, 0) # (len(self.meta['frames])*h*w,3)
         else:
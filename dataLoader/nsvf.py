@@ -6,6 +6,7 @@ from PIL import Image
 from torchvision import transforms as T
 
 from .ray_utils import *
+from .image_io import load_images, to_chw
 
 trans_t = lambda t : torch.Tensor([
     [1,0,0,0],
@@ -35,8 +36,9 @@ def pose_spherical(theta, phi, radius):
 
 class NSVF(Dataset):
     """NSVF Generic Dataset."""
-    def __init__(self, datadir, split='train', downsample=1.0, wh=[800,800], is_stack=False):
+    def __init__(self, datadir, split='train', downsample=1.0, wh=[800,800], is_stack=False, args=None):
         self.root_dir = datadir
+        self.load_workers = getattr(args, "load_workers", 0)
         self.split = split
         self.is_stack = is_stack
         self.downsample = downsample
@@ -96,12 +98,10 @@ class NSVF(Dataset):
         self.all_rgbs = []
 
         assert len(img_files) == len(pose_files)
-        for img_fname, pose_fname in tqdm(zip(img_files, pose_files), desc=f'Loading data {self.split} ({len(img_files)})'):
-            image_path = os.path.join(self.root_dir, 'rgb', img_fname)
-            img = Image.open(image_path)
-            if self.downsample!=1.0:
-                img = img.resize(self.img_wh, Image.LANCZOS)
-            img = self.transform(img)  # (4, h, w)
+        images = load_images([os.path.join(self.root_dir, 'rgb', img_fname) for img_fname in img_files], img_wh=self.img_wh if self.downsample!=1.0 else None,
+                             workers=self.load_workers, desc=f'Loading data {self.split} ({len(img_files)})')
+        for n, (img_fname, pose_fname) in enumerate(zip(img_files, pose_files)):
+            img = to_chw(images[n])  # (4, h, w)
             img = img.view(img.shape[0], -1).permute(1, 0)  # (h*w, 4) RGBA
             if img.shape[-1]==4:
                 img = img[:, :3] * img[:, -1:] + (1 - img[:, -1:])  # blend A to RGB
@@ -19,6 +19,171 @@ class SimpleSampler:
             self.curr = 0
         return self.ids[self.curr:self.curr+self.batch]
 
+
+class SumTree:
+    # priorities of n leaves in a binary segment tree (float64, cpu): draws and updates of k leaves cost O(k log n)
+    def __init__(self, n, value=1.0):
+        self.n = n
+        self.size = 1 << max(0, n - 1).bit_length()
+        self.depth = self.size.bit_length() - 1
+        self.tree = torch.zeros(2 * self.size, dtype=torch.float64)
+        self.tree[self.size:self.size + n] = value
+        for level in range(self.depth - 1, -1, -1):
+            node = torch.arange(1 << level, 2 << level)
+            self.tree[node] = self.tree[2 * node] + self.tree[2 * node + 1]
+
+    def total(self):
+        return self.tree[1].item()
+
+    def set(self, leaf, value):
+        node = leaf + self.size
+        self.tree[node] = value.to(self.tree.dtype)
+        for _ in range(self.depth):
+            node = torch.unique(node // 2)
+            self.tree[node] = self.tree[2 * node] + self.tree[2 * node + 1]
+
+    def sample(self, k):
+        # k leaves drawn proportionally to their priority
+        u = torch.rand(k, dtype=torch.float64) * self.tree[1]
+        node = torch.ones(k, dtype=torch.int64)
+        for _ in range(self.depth):
+            left = self.tree[2 * node]
+            right = u >= left
+            u = torch.where(right, u - left, u)
+            node = 2 * node + right.long()
+        return torch.clamp(node - self.size, max=self.n - 1)
+
+
+class ImportanceSampler:
+    ''' Error driven replacement of SimpleSampler (--importance_sampling 1)
+    The rays are grouped in tiles of --importance_tile consecutive ids (pixel runs of one image). Every tile keeps an
+    exponential moving average (--importance_decay) of the squared error of its rays, fed by update() with the per-ray
+    errors of each training step, and a SumTree over those priorities draws the tiles of the next batch, a ray uniformly
+    inside each. A --importance_uniform share of every batch is drawn uniformly over all rays, and unseen tiles start at
+    the largest possible error, so every tile keeps being visited. Drawing and updating a batch cost O(batch log tiles).
+    '''
+    def __init__(self, total, batch, tile=64, uniform=0.25, decay=0.9):
+        self.total = total
+        self.batch = batch
+        self.tile = max(1, tile)
+        self.n_uniform = int(round(batch * uniform))
+        self.decay = decay
+        n_tiles = (total + self.tile - 1) // self.tile
+        self.tile_len = torch.full([n_tiles], self.tile, dtype=torch.int64)
+        self.tile_len[-1] = total - (n_tiles - 1) * self.tile
+        self.error = torch.ones(n_tiles, dtype=torch.float64)
+        self.tree = SumTree(n_tiles, value=1.0)
+
+    def nextids(self):
+        tiles = self.tree.sample(self.batch - self.n_uniform)
+        ids = tiles * self.tile + (torch.rand(len(tiles)) * self.tile_len[tiles]).long()
+        return torch.cat([ids, torch.randint(0, self.total, (self.n_uniform,))])
+
+    @torch.no_grad()
+    def update(self, ids, ray_error):
+        # ids: the batch nextids returned, ray_error: [batch] squared error of each ray
+        tiles, inv = torch.unique(ids.cpu() // self.tile, return_inverse=True)
+        tile_error = torch.zeros(len(tiles), dtype=torch.float64).index_add_(0, inv, ray_error.detach().cpu().double())
+        tile_error /= torch.bincount(inv, minlength=len(tiles))
+        self.error[tiles] = self.decay * self.error[tiles] + (1 - self.decay) * tile_error
+        # floor keeps converged tiles drawable
+        self.tree.set(tiles, torch.clamp(self.error[tiles], min=1e-6))
+
+
+class RayStream:
+    ''' Out-of-core replacement of all_rays / all_rgbs
+    Keeps the decoded images as uint8 [n_img, h, w, 3 or 4 (RGBA, blended on a white background)] plus one pose per image,
+    and generates rays for a batch of flat pixel ids (img * h * w + pix) on the fly.
+    Indexing with a bool mask (as after filtering_rays) returns a stream over the kept pixels, with int32 ids.
+    stream[idx] -> rays [B, 6]; stream.rgbs[idx] -> [B, 3] ([B, 3, 3, 3] patches with rnd_ray)
+    '''
+    def __init__(self, images, c2ws, directions, ij=None, ndc=None, rnd_ray=False, pix_ids=None):
+        self.images = images
+        self.c2ws = c2ws[:, :3, :4].float()
+        self.directions = directions.reshape(-1, 3).float()
+        self.ij = None if ij is None else ij.reshape(-1, 2).float()
+        self.ndc = ndc  # (H, W, focal, near) for ndc_rays_blender
+        self.rnd_ray = rnd_ray
+        self.h, self.w = images.shape[1], images.shape[2]
+        self.pix_ids = pix_ids
+        self.rgbs = _StreamView(self, self.get_rgbs, (3, 3, 3) if rnd_ray else (3,))
+        if rnd_ray:
+            self.alphas = _StreamView(self, self.get_alphas, (2, 2))
+            self.ijs = _StreamView(self, lambda idx: self.ij[self._locate(idx)[1]], (2,))
+            self.rots = _StreamView(self, lambda idx: self.c2ws[self._locate(idx)[0], :3, :3].transpose(1, 2), (3, 3))
+
+    def __len__(self):
+        return len(self.images) * self.h * self.w if self.pix_ids is None else len(self.pix_ids)
+
+    @property
+    def shape(self):
+        return torch.Size([len(self), 6])
+
+    def _locate(self, idx):
+        ids = torch.as_tensor(idx, dtype=torch.int64) if self.pix_ids is None else self.pix_ids[idx].long()
+        return torch.div(ids, self.h * self.w, rounding_mode='floor'), ids % (self.h * self.w)
+
+    def subset(self, mask):
+        ids = torch.nonzero(mask.cpu(), as_tuple=True)[0] if self.pix_ids is None else self.pix_ids[mask.cpu()]
+        ids = ids.int() if len(self.images) * self.h * self.w < 2 ** 31 else ids.long()
+        return RayStream(self.images, self.c2ws, self.directions, ij=self.ij, ndc=self.ndc, rnd_ray=self.rnd_ray, pix_ids=ids)
+
+    def __getitem__(self, idx):
+        if torch.is_tensor(idx) and idx.dtype == torch.bool:
+            return self.subset(idx)
+        img_ids, pix = self._locate(idx)
+        c2w = self.c2ws[img_ids]
+        rays_d = (c2w[:, :3, :3] @ self.directions[pix][..., None])[..., 0]
+        rays_o = c2w[:, :3, 3]
+        if self.ndc is not None:
+            rays_o, rays_d = ndc_rays_blender(*self.ndc, rays_o, rays_d)
+        return torch.cat([rays_o, rays_d], 1)
+
+    def _gather(self, img_ids, y, x):
+        # float [..., C] in [0, 1], zero outside of the image like the padding of pix_2_patch
+        inside = (y >= 0) & (y < self.h) & (x >= 0) & (x < self.w)
+        pix = self.images[img_ids, y.clamp(0, self.h - 1), x.clamp(0, self.w - 1)].float() / 255.
+        if pix.shape[-1] == 4:
+            pix = torch.cat([pix[..., :3] * pix[..., 3:] + (1 - pix[..., 3:]), pix[..., 3:]], dim=-1)
+        return pix * inside[..., None]
+
+    def _patch(self, idx):
+        # 3x3 neighbourhood of every pixel, in (dy, dx) row-major order like pix_2_patch
+        img_ids, pix = self._locate(idx)
+        y, x = torch.div(pix, self.w, rounding_mode='floor'), pix % self.w
+        dy, dx = torch.meshgrid(torch.arange(-1, 2), torch.arange(-1, 2), indexing='ij')
+        return self._gather(img_ids[:, None], y[:, None] + dy.reshape(1, 9), x[:, None] + dx.reshape(1, 9))
+
+    def get_rgbs(self, idx):
+        if not self.rnd_ray:
+            img_ids, pix = self._locate(idx)
+            return self._gather(img_ids, torch.div(pix, self.w, rounding_mode='floor'), pix % self.w)[..., :3]
+        return self._patch(idx)[..., :3].permute(0, 2, 1).reshape(-1, 3, 3, 3)
+
+    def get_alphas(self, idx, thresh=0.01):
+        # same corner flags as pix_2_patch: does alpha vary within each 2x2 corner of the 3x3 patch
+        alpha = self._patch(idx)[..., -1].reshape(-1, 3, 3)
+        corners = [alpha[:, :2, :2], alpha[:, :2, 1:], alpha[:, 1:, :2], alpha[:, 1:, 1:]]
+        flags = [(c.reshape(-1, 4).max(-1)[0] - c.reshape(-1, 4).min(-1)[0]) > thresh for c in corners]
+        return torch.stack(flags, dim=-1).reshape(-1, 2, 2)
+
+
+class _StreamView:
+    # the per-ray tensors of a RayStream, indexed like the in-memory ones
+    def __init__(self, stream, fetch, item_shape):
+        self.stream, self.fetch, self.item_shape = stream, fetch, item_shape
+
+    @property
+    def shape(self):
+        return torch.Size([len(self.stream), *self.item_shape])
+
+    def __len__(self):
+        return len(self.stream)
+
+    def __getitem__(self, idx):
+        return self.fetch(idx)
+
+
 def depth2dist(z_vals, cos_angle):
     # z_vals: [N_ray N_sample]
     device = z_vals.device
@@ -16,6 +16,8 @@ import h5py
 import mvs.mvs_utils as mvs_utils
 import configparser
 from .ray_utils import *
+from . import frame_quality
+from .image_io import load_images
 
 from os.path import join
 import cv2
@@ -91,6 +93,7 @@ class ScannetDataset(Dataset):
         self.root_dir = datadir
         self.split = split
         self.is_stack = is_stack
+        self.stream_rays = not is_stack and getattr(args, "stream_rays", 0) > 0
         self.img_wh = (int(img_wh[0] * downsample), int(img_wh[1] * downsample))
         self.margin = self.args.margin if self.split=="train" else self.args.test_margin # self.opt.edge_filter
 
@@ -132,14 +135,8 @@ class ScannetDataset(Dataset):
         return cv2.Laplacian(image, cv2.CV_64F).var()
 
     def detect_blurry(self, list):
-        blur_score = []
-        for id in list:
-            image_path = os.path.join(self.root_dir, "exported/color/{}.jpg".format(id))
-            image = cv2.imread(image_path)
-            gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
-            fm = self.variance_of_laplacian(gray)
-            blur_score.append(fm)
-        blur_score = np.asarray(blur_score)
+        scores = frame_quality.blur_scores(self.root_dir, list, workers=getattr(self.args, "frame_workers", 0))
+        blur_score = np.asarray([scores[id] for id in list])
         ids = blur_score.argsort()[:150]
         allind = np.asarray(list)
         print("most blurry images", allind[ids])
@@ -147,13 +144,10 @@ class ScannetDataset(Dataset):
     def remove_blurry(self, list):
         blur_path = os.path.join(self.root_dir, "exported/blur_list.txt")
         if os.path.exists(blur_path):
-            blur_lst = []
             with open(blur_path) as f:
                 lines = f.readlines()
                 print("blur files", len(lines))
-                for line in lines:
-                    info = line.strip()
-                    blur_lst.append(int(info))
+                blur_lst = set(int(line.strip()) for line in lines if line.strip())
             return [i for i in list if i not in blur_lst]
         else:
             print("no blur list detected, use all training frames!")
@@ -171,7 +165,13 @@ class ScannetDataset(Dataset):
         #     self.train_id_list = [self.all_id_list[i] for i in range(len(self.all_id_list)) if (((i % 100) > 19) and ((i % 100) < 81 or (i//100+1)*100>=len(self.all_id_list)))]
         # else:  # nsvf configuration
         step = 5
-        if self.split == "train":
+        if self.split == "train" and getattr(self.args, "frame_select", 0) > 0:
+            # sharpest frame of every step frames, near duplicate poses dropped
+            candidates = self.remove_blurry(self.all_id_list)
+            scores = frame_quality.blur_scores(self.root_dir, candidates, workers=getattr(self.args, "frame_workers", 0))
+            c2ws = {id: np.loadtxt(os.path.join(self.root_dir, "exported/pose", "{}.txt".format(id))) for id in candidates}
+            self.id_list = frame_quality.select_frames(candidates, scores, c2ws, step, min_dist=getattr(self.args, "frame_min_dist", 0.0), min_angle=getattr(self.args, "frame_min_angle", 0.0))
+        elif self.split == "train":
             self.id_list = self.all_id_list[::step]
             self.id_list = self.remove_blurry(self.id_list)
         else:
@@ -203,26 +203,31 @@ class ScannetDataset(Dataset):
 
             img_eval_interval = 1 if self.N_vis < 0 else len(self.meta['frames']) // self.N_vis
             idxs = list(range(0, len(self.id_list), img_eval_interval))
-            for i in tqdm(idxs, desc=f'Loading data {self.split} ({len(idxs)})'):  # img_list:#
+            images = load_images([os.path.join(self.root_dir, "exported/color/{}.jpg".format(self.id_list[i])) for i in idxs], img_wh=self.img_wh, mode='RGB',
+                                 workers=getattr(self.args, "load_workers", 0), desc=f'Loading data {self.split} ({len(idxs)})')
+            if self.margin != 0:
+                images = images[:, self.margin:h - self.margin, self.margin:w - self.margin].contiguous()
+            poses = []
+            for n, i in enumerate(idxs):
 
                 # print("vid",vid)
                 vid = self.id_list[i]
                 c2w = np.loadtxt(os.path.join(self.root_dir, "exported/pose", "{}.txt".format(vid))).astype(np.float32)
                 c2w = torch.FloatTensor(c2w)
 
-                image_path = os.path.join(self.root_dir, "exported/color/{}.jpg".format(vid))
-                img = Image.open(image_path)
-                img = img.resize(self.img_wh, Image.Resampling.LANCZOS)
-                img = self.transform(img)
-                if self.margin != 0:
-                    img = img[:, self.margin:-self.margin, self.margin:-self.margin]
-                img = img.reshape(3, -1).permute(1, 0)  # (4, h, w)
+                if self.stream_rays:
+                    poses += [c2w]
+                    continue
+                img = images[n].reshape(-1, 3).float().div(255)  # (h*w, 3)
                 self.all_rgbs += [img]
 
                 rays_o, rays_d = get_rays(self.directions, c2w)  # both (h*w, 3)
                 self.all_rays += [torch.cat([rays_o, rays_d], 1)]  # (h*w, 6)
 
-            if not self.is_stack:
+            if self.stream_rays:
+                self.all_rays = RayStream(images, torch.stack(poses), self.directions, ij=self.ij)
+                self.all_rgbs = self.all_rays.rgbs
+            elif not self.is_stack:
                 self.all_rays = torch.cat(self.all_rays, 0)  # (len(self.meta['frames])*h*w, 3)
                 self.all_rgbs = torch.cat(self.all_rgbs, 0)  # (len(self.meta['frames])*h*w, 3)
                     # print("!!!!!!!!!!!!!!!!!!!!!!!!!self.all_alpha", self.all_alpha.shape)
@@ -6,6 +6,7 @@ from PIL import Image
 from torchvision import transforms as T
 
 from .ray_utils import *
+from .image_io import load_images, to_chw
 
 
 def circle(radius=3.5, h=0.0, axis='z', t0=0, r=1):
@@ -145,12 +146,10 @@ class TanksTempleDatasetBG(Dataset):
         self.all_rgbs = []
 
         assert len(img_files) == len(pose_files)
-        for img_fname, pose_fname in tqdm(zip(img_files, pose_files), desc=f'Loading data {self.split} ({len(img_files)})'):
-            image_path = os.path.join(self.root_dir, 'rgb', img_fname)
-            img = Image.open(image_path)
-            if self.downsample!=1.0:
-                img = img.resize(self.img_wh, Image.LANCZOS)
-            img = self.transform(img)  # (4, h, w)
+        images = load_images([os.path.join(self.root_dir, 'rgb', img_fname) for img_fname in img_files], img_wh=self.img_wh if self.downsample!=1.0 else None,
+                             workers=getattr(self.args, "load_workers", 0), desc=f'Loading data {self.split} ({len(img_files)})')
+        for n, (img_fname, pose_fname) in enumerate(zip(img_files, pose_files)):
+            img = to_chw(images[n])  # (4, h, w)
             img = img.view(img.shape[0], -1).permute(1, 0)  # (h*w, 4) RGBA
             self.all_rgbs.append(img)
 
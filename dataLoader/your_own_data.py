@@ -8,12 +8,14 @@ from torchvision import transforms as T
 
 
 from .ray_utils import *
+from .image_io import load_images, to_chw
 
 
 class YourOwnDataset(Dataset):
-    def __init__(self, datadir, split='train', downsample=1.0, is_stack=False, N_vis=-1):
+    def __init__(self, datadir, split='train', downsample=1.0, is_stack=False, N_vis=-1, args=None):
 
         self.N_vis = N_vis
+        self.load_workers = getattr(args, "load_workers", 0)
         self.root_dir = datadir
         self.split = split
         self.is_stack = is_stack
@@ -63,20 +65,17 @@ class YourOwnDataset(Dataset):
 
         img_eval_interval = 1 if self.N_vis < 0 else len(self.meta['frames']) // self.N_vis
         idxs = list(range(0, len(self.meta['frames']), img_eval_interval))
-        for i in tqdm(idxs, desc=f'Loading data {self.split} ({len(idxs)})'):#img_list:#
+        self.image_paths = [os.path.join(self.root_dir, f"{self.meta['frames'][i]['file_path']}.png") for i in idxs]
+        images = load_images(self.image_paths, img_wh=self.img_wh if self.downsample!=1.0 else None,
+                             workers=self.load_workers, desc=f'Loading data {self.split} ({len(idxs)})')
+        for n, i in enumerate(idxs):
 
             frame = self.meta['frames'][i]
             pose = np.array(frame['transform_matrix']) @ self.blender2opencv
             c2w = torch.FloatTensor(pose)
             self.poses += [c2w]
 
-            image_path = os.path.join(self.root_dir, f"{frame['file_path']}.png")
-            self.image_paths += [image_path]
-            img = Image.open(image_path)
-            
-            if self.downsample!=1.0:
-                img = img.resize(self.img_wh, Image.LANCZOS)
-            img = self.transform(img)  # (4, h, w)
+            img = to_chw(images[n])  # (4, h, w)
             img = img.view(-1, w*h).permute(1, 0)  # (h*w, 4) RGBA
             if img.shape[-1]==4:
                 img = img[:, :3] * img[:, -1:] + (1 - img[:, -1:])  # blend A to RGB
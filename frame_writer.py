@@ -0,0 +1,57 @@
+import numpy as np
+import imageio
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+''' Background writing of the rendered test / path frames
+PNGs (<prtx><idx>.png and rgbd/<prtx><idx>.png) are encoded by a thread pool, the rgb and depth videos by one
+thread each, fed frame by frame through streaming imageio writers, so no frame is kept once it is written.
+At most max_pending frames wait for encoding; add blocks beyond that, which bounds memory when rendering outruns
+the encoders.
+'''
+
+
+class FrameWriter:
+    def __init__(self, savePath, prtx='', video=True, fps=30, quality=10, workers=4, max_pending=16):
+        self.savePath = savePath
+        self.prtx = prtx
+        self.video_args = dict(fps=fps, quality=quality) if video else None
+        self.videos = {}
+        self.png_pool = ThreadPoolExecutor(max_workers=max(1, workers)) if savePath is not None else None
+        # one thread per video keeps its frames in order
+        self.video_pools = {name: ThreadPoolExecutor(max_workers=1) for name in ["video", "depthvideo"]} if video else {}
+        self.max_pending = max_pending
+        self.pending = deque()
+
+    def add(self, idx, rgb_map, depth_map):
+        # rgb_map, depth_map: uint8 [H, W, 3]
+        if self.png_pool is not None:
+            self.pending.append(self.png_pool.submit(self._write_png, idx, rgb_map, depth_map))
+        for name, frame in [("video", rgb_map), ("depthvideo", depth_map)]:
+            if name in self.video_pools:
+                self.pending.append(self.video_pools[name].submit(self._append, name, frame))
+        while len(self.pending) > self.max_pending:
+            self.pending.popleft().result()
+
+    def _write_png(self, idx, rgb_map, depth_map):
+        imageio.imwrite(f'{self.savePath}/{self.prtx}{idx:03d}.png', rgb_map)
+        imageio.imwrite(f'{self.savePath}/rgbd/{self.prtx}{idx:03d}.png', np.concatenate((rgb_map, depth_map), axis=1))
+
+    def _append(self, name, frame):
+        if name not in self.videos:
+            self.videos[name] = imageio.get_writer(f'{self.savePath}/{self.prtx}{name}.mp4', **self.video_args)
+        self.videos[name].append_data(frame)
+
+    def close(self):
+        # waits for every frame, raises the first encoding error; the pools and video writers are closed either way
+        try:
+            while len(self.pending) > 0:
+                self.pending.popleft().result()
+        finally:
+            self.pending.clear()
+            for pool in [self.png_pool] + list(self.video_pools.values()):
+                if pool is not None:
+                    pool.shutdown(wait=True)
+            for writer in self.videos.values():
+                writer.close()
+            self.videos = {}
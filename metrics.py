@@ -0,0 +1,133 @@
+import json
+import queue
+import threading
+import numpy as np
+import torch
+import torch.nn.functional as F
+from utils import init_lpips, __LPIPS__
+
+''' Image metrics of the test renders
+ssim: utils.rgb_ssim (mip-NeRF's ssim) on torch tensors, the 11x11 gaussian blur as two separable grouped convolutions
+    over a batch of images, on any device.
+MetricsEngine: evaluation hands every rendered frame to a worker thread (--metrics_async 1), which computes ssim and
+    lpips (alex, vgg) on the device in batches of --metrics_batch same sized frames while the next frame renders.
+    results() returns the per-image metrics in submission order, save() writes them and their mean as json.
+'''
+LPIPS_NETS = ["alex", "vgg"]
+
+
+def gaussian_filter(filter_size=11, filter_sigma=1.5, dtype=torch.float32, device="cpu"):
+    hw = filter_size // 2
+    shift = (2 * hw - filter_size + 1) / 2
+    filt = torch.exp(-0.5 * ((torch.arange(filter_size, dtype=torch.float64) - hw + shift) / filter_sigma) ** 2)
+    return (filt / filt.sum()).to(dtype=dtype, device=device)
+
+
+def ssim(img0, img1, max_val=1.0, filter_size=11, filter_sigma=1.5, k1=0.01, k2=0.03, return_map=False):
+    # img0, img1: [B, H, W, C]; ssim of every image [B] (or the [B, H - 10, W - 10, C] maps)
+    B, H, W, C = img0.shape
+    filt = gaussian_filter(filter_size, filter_sigma, img0.dtype, img0.device)
+    filt_y, filt_x = filt.view(1, 1, -1, 1).expand(C, -1, -1, -1), filt.view(1, 1, 1, -1).expand(C, -1, -1, -1)
+
+    def filt_fn(z):
+        # valid mode blur of [B, C, H, W], y then x
+        return F.conv2d(F.conv2d(z, filt_y, groups=C), filt_x, groups=C)
+
+    img0, img1 = img0.permute(0, 3, 1, 2), img1.permute(0, 3, 1, 2)
+    # one pass over the five blurred maps
+    blurred = filt_fn(torch.cat([img0, img1, img0 * img0, img1 * img1, img0 * img1], dim=0))
+    mu0, mu1, sq0, sq1, prod = torch.split(blurred, B, dim=0)
+    mu00, mu11, mu01 = mu0 * mu0, mu1 * mu1, mu0 * mu1
+    sigma00 = torch.clamp(sq0 - mu00, min=0)
+    sigma11 = torch.clamp(sq1 - mu11, min=0)
+    sigma01 = prod - mu01
+    sigma01 = torch.sign(sigma01) * torch.minimum(torch.sqrt(sigma00 * sigma11), torch.abs(sigma01))
+    c1 = (k1 * max_val) ** 2
+    c2 = (k2 * max_val) ** 2
+    numer = (2 * mu01 + c1) * (2 * sigma01 + c2)
+    denom = (mu00 + mu11 + c1) * (sigma00 + sigma11 + c2)
+    ssim_map = (numer / denom).permute(0, 2, 3, 1)
+    return ssim_map if return_map else ssim_map.mean(dim=(1, 2, 3))
+
+
+class MetricsEngine:
+    def __init__(self, device, batch=8, asynchronous=True, lpips_nets=LPIPS_NETS):
+        self.device = device
+        self.batch = max(1, batch)
+        self.lpips_nets = list(lpips_nets)
+        for net_name in self.lpips_nets:
+            if net_name not in __LPIPS__:
+                __LPIPS__[net_name] = init_lpips(net_name, device)
+        self.names, self.metrics = [], {}
+        self.pending = []
+        self.error = None
+        self.queue = queue.Queue(maxsize=2 * self.batch) if asynchronous else None
+        if self.queue is not None:
+            self.worker = threading.Thread(target=self._run, daemon=True)
+            self.worker.start()
+
+    def add(self, name, rgb_map, gt_rgb):
+        # rgb_map, gt_rgb: [H, W, 3] in [0, 1], any device
+        self.names.append(name)
+        if self.queue is None:
+            self._push(name, rgb_map, gt_rgb)
+        else:
+            self.queue.put((name, rgb_map, gt_rgb))
+
+    def _run(self):
+        # keeps draining after an error so add() never blocks; the sentinel always ends the thread
+        while True:
+            item = self.queue.get()
+            try:
+                if item is None:
+                    self._flush()
+                else:
+                    self._push(*item)
+            except Exception as e:
+                self.error = e
+            if item is None:
+                return
+
+    def _push(self, name, rgb_map, gt_rgb):
+        if len(self.pending) > 0 and self.pending[0][1].shape != rgb_map.shape:
+            self._flush()
+        self.pending.append((name, rgb_map, gt_rgb))
+        if len(self.pending) >= self.batch:
+            self._flush()
+
+    @torch.no_grad()
+    def _flush(self):
+        if len(self.pending) == 0:
+            return
+        names = [name for name, _, _ in self.pending]
+        im = torch.stack([rgb_map for _, rgb_map, _ in self.pending]).to(self.device, torch.float32)
+        gt = torch.stack([gt_rgb for _, _, gt_rgb in self.pending]).to(self.device, torch.float32)
+        self.pending = []
+        values = {"ssim": ssim(im, gt, 1)}
+        for net_name in self.lpips_nets:
+            values["lpips_" + net_name] = __LPIPS__[net_name](gt.permute(0, 3, 1, 2), im.permute(0, 3, 1, 2), normalize=True).view(-1)
+        values = {key: value.tolist() for key, value in values.items()}
+        for i, name in enumerate(names):
+            self.metrics[name] = {key: value[i] for key, value in values.items()}
+
+    def results(self):
+        # waits for the queued frames, {metric: [value of every frame in submission order]}
+        if self.queue is not None:
+            if self.worker.is_alive():
+                self.queue.put(None)
+                self.worker.join()
+        else:
+            self._flush()
+        if self.error is not None:
+            raise self.error
+        keys = ["ssim"] + ["lpips_" + net_name for net_name in self.lpips_nets]
+        return {key: [self.metrics[name][key] for name in self.names] for key in keys}
+
+    def save(self, path, **extra):
+        # per-image metrics (and any extra per-image lists, e.g. psnr=PSNRs) and their means
+        results = dict(extra, **self.results())
+        per_image = [dict(name=name, **{key: float(values[i]) for key, values in results.items()}) for i, name in enumerate(self.names)]
+        mean = {key: float(np.mean(values)) for key, values in results.items()}
+        with open(path, "w") as f:
+            json.dump({"mean": mean, "images": per_image}, f, indent=2)
+        return mean
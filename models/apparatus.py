@@ -6,48 +6,36 @@ import time
 import os
 # from torch_scatter import segment_coo
 from torch_scatter import segment_coo
-from torch.utils.cpp_extension import load
 from plyfile import PlyData, PlyElement
+from types import SimpleNamespace
+from . import cpu_kernels
+from .cuda_ext import LazyExtension, extension_available
 parent_dir = os.path.dirname(os.path.abspath(__file__))
 
-render_utils_cuda = load(
-    name='render_utils_cuda',
-    sources=[
-        os.path.join(parent_dir, path)
-        for path in ['cuda/render_utils.cpp', 'cuda/render_utils_kernel.cu']],
-    verbose=True)
+render_utils_cuda = LazyExtension('render_utils_cuda')
+search_geo_cuda = LazyExtension('search_geo_cuda')
+search_geo_hier_cuda = LazyExtension('search_geo_hier_cuda')
+search_geo_adapt_cuda = LazyExtension('search_geo_adapt_cuda')
+grid_sample_1d = LazyExtension('grid_sample_1d')
 
-#
-search_geo_cuda = load(
-    name='search_geo_cuda',
-    sources=[
-        os.path.join(parent_dir, path)
-        for path in ['cuda/search_geo.cpp', 'cuda/search_geo.cu']],
-    verbose=True)
-
-
-search_geo_hier_cuda = load(
-    name='search_geo_hier_cuda',
-    sources=[
-        os.path.join(parent_dir, path)
-        for path in ['cuda/search_geo_hier.cpp', 'cuda/search_geo_hier.cu']],
-    verbose=True)
 
+''' Kernel backend
+"cuda": the lazily built extensions above, "cpu": the pytorch reference in cpu_kernels,
+"auto": the extensions for cuda tensors and the reference for everything else.
+A sparse coverage map (cpu_kernels.SparseCvrg) always goes through the reference, on any device.
+'''
+KERNEL_BACKEND = "auto"
 
-grid_sample_1d = load(
-    name='grid_sample_1d',
-    sources=[
-        os.path.join(parent_dir, path)
-        for path in ['cuda/grid_sample_1d.cpp', 'cuda/grid_sample_1d.cu']],
-    verbose=True)
+def set_kernel_backend(name):
+    global KERNEL_BACKEND
+    assert name in ["auto", "cuda", "cpu"], "unknown kernel backend {}".format(name)
+    KERNEL_BACKEND = name
 
 
-# search_geo_adapt_cuda = load(
-#     name='search_geo_adapt_cuda',
-#     sources=[
-#         os.path.join(parent_dir, path)
-#         for path in ['cuda/search_geo_adapt.cpp', 'cuda/search_geo_adapt.cu']],
-#     verbose=True)
+def get_kernels(device, cvrg=None):
+    if KERNEL_BACKEND == "cpu" or isinstance(cvrg, cpu_kernels.SparseCvrg) or (KERNEL_BACKEND == "auto" and (torch.device(device).type != "cuda" or not extension_available("search_geo_hier_cuda"))):
+        return SimpleNamespace(render_utils=cpu_kernels.render_utils, search_geo=cpu_kernels.search_geo, search_geo_hier=cpu_kernels.search_geo_hier)
+    return SimpleNamespace(render_utils=render_utils_cuda, search_geo=search_geo_cuda, search_geo_hier=search_geo_hier_cuda)
 
 
 def positional_encoding(positions, freqs):
@@ -106,34 +94,216 @@ def filter_ray_by_cvrg(xyz_sampled,mask_inbox, units, xyz_min, xyz_max, tensoRF_
     #                          dim=-1)  # chunksize * raysampleN * 4096
     # mask_inrange = torch.any(mask_inrange.view(mask_inrange.shape[0], -1), dim=-1)
     # rays_d has to be unit
-    tensoRF_per_ray = search_geo_cuda.filter_ray_by_cvrg(xyz_sampled.contiguous(), mask_inbox.contiguous(), units.contiguous(), xyz_min.contiguous(), xyz_max.contiguous(), tensoRF_cvrg_mask)
+    tensoRF_per_ray = get_kernels(xyz_sampled.device, tensoRF_cvrg_mask).search_geo.filter_ray_by_cvrg(xyz_sampled.contiguous(), mask_inbox.contiguous(), units.contiguous(), xyz_min.contiguous(), xyz_max.contiguous(), tensoRF_cvrg_mask)
     return tensoRF_per_ray
 
+def pack_bits(mask):
+    # bool [...] -> uint8 [ceil(n / 8)], np.packbits(mask.reshape(-1)) on any device
+    flat = mask.reshape(-1).to(torch.uint8)
+    flat = F.pad(flat, (0, (-len(flat)) % 8)).view(-1, 8)
+    return (flat << torch.arange(7, -1, -1, dtype=torch.uint8, device=flat.device)).sum(-1, dtype=torch.uint8)
+
+
+def unpack_bits(bits, n):
+    # first n bits of pack_bits' output, bool [n]
+    return ((bits[:, None] >> torch.arange(7, -1, -1, dtype=torch.uint8, device=bits.device)) & 1).view(-1)[:n].bool()
+
+
+def test_bits(bits, index):
+    return ((bits[index >> 3] >> (7 - (index & 7)).to(torch.uint8)) & 1).bool()
+
+
 class AlphaGridMask(torch.nn.Module):
+    ''' Occupancy of the binarized alpha volume [Z, Y, X] (voxels > 0), bit packed
+    bits: the voxels z-major in np.packbits order, the alphaMask.mask checkpoint field as it is.
+    cell_bits: one bit per cell between neighboring voxel planes, padded by one cell on every side, set when any of its
+        8 corner voxels is. sample_alpha looks up the cell holding each point: it is 1 exactly where the trilinear,
+        zero padded grid_sample of the volume was > 0, except on the voxel planes themselves, where it is conservative.
+    '''
     def __init__(self, device, aabb, alpha_volume, mask_cache_thres=None):
         super(AlphaGridMask, self).__init__()
         self.device = device
 
-        self.aabb = aabb.to(self.device)
+        self.aabb = torch.as_tensor(aabb).to(self.device)
         self.aabbSize = self.aabb[1] - self.aabb[0]
         self.invgridSize = 1.0 / self.aabbSize * 2
-        self.alpha_volume = alpha_volume.view(1, 1, *alpha_volume.shape[-3:])
-        self.gridSize = torch.LongTensor([alpha_volume.shape[-1], alpha_volume.shape[-2], alpha_volume.shape[-3]]).to(self.device)
-        # mask = (self.alpha_volume >= mask_cache_thres).squeeze(0).squeeze(0)
-        # self.register_buffer('mask', mask)
-        # self.register_buffer('xyz2ijk_scale', (self.gridSize - 1) / self.aabbSize)
-        # self.register_buffer('xyz2ijk_shift', -self.aabbSize[0] * self.xyz2ijk_scale)
+        volume = (alpha_volume.reshape(alpha_volume.shape[-3:]) > 0).to(self.device)
+        self.shape = tuple(volume.shape)
+        self.gridSize = torch.LongTensor([self.shape[2], self.shape[1], self.shape[0]]).to(self.device)
+        self.bits = pack_bits(volume)
+        cells = F.pad(volume.to(torch.uint8), (1, 1, 1, 1, 1, 1))
+        for dim in range(3):
+            cells = cells.narrow(dim, 0, cells.shape[dim] - 1) | cells.narrow(dim, 1, cells.shape[dim] - 1)
+        self.cell_bits = pack_bits(cells)
+        self.xyz2cell = (self.gridSize - 1).float() / self.aabbSize
+
+    @classmethod
+    def from_checkpoint(cls, device, ckpt, mask_cache_thres=None):
+        shape = tuple(ckpt['alphaMask.shape'])[-3:]
+        volume = unpack_bits(torch.as_tensor(ckpt['alphaMask.mask'], device=device), int(np.prod(shape))).view(shape)
+        return cls(device, torch.as_tensor(ckpt['alphaMask.aabb'], device=device), volume, mask_cache_thres=mask_cache_thres)
+
+    def checkpoint_fields(self):
+        # same fields and layout as np.packbits of the former float alpha_volume [1, 1, Z, Y, X]
+        return {'alphaMask.shape': (1, 1) + self.shape, 'alphaMask.mask': self.bits.cpu().numpy(), 'alphaMask.aabb': self.aabb.cpu().numpy()}
+
+    def volume(self):
+        return unpack_bits(self.bits, int(np.prod(self.shape))).view(self.shape)
+
+    @property
+    def alpha_volume(self):
+        return self.volume().float().view(1, 1, *self.shape)
 
     @torch.no_grad()
     def sample_alpha(self, xyz_sampled):
-        xyz_sampled = self.normalize_coord(xyz_sampled)
-        alpha_vals = F.grid_sample(self.alpha_volume, xyz_sampled.view(1, -1, 1, 1, 3), align_corners=True).view(-1)
-        return alpha_vals
+        # 1. where the mask is set around xyz_sampled [..., 3], 0. elsewhere, [N]
+        cell = torch.floor((xyz_sampled.view(-1, 3) - self.aabb[0]) * self.xyz2cell).long() + 1
+        valid = ((cell >= 0) & (cell <= self.gridSize)).all(-1)
+        cell = torch.where(valid[..., None], cell, torch.zeros_like(cell))
+        index = (cell[..., 2] * (self.gridSize[1] + 1) + cell[..., 1]) * (self.gridSize[0] + 1) + cell[..., 0]
+        return (test_bits(self.cell_bits, index) & valid).float()
 
     def normalize_coord(self, xyz_sampled):
         return (xyz_sampled - self.aabb[0]) * self.invgridSize - 1
 
 
+@torch.no_grad()
+def covered_cells(cvrg):
+    # xyz indices [N, 3] of the covered cells of a coverage filter (dense bool [X, Y, Z] or cpu_kernels.SparseCvrg)
+    if isinstance(cvrg, cpu_kernels.SparseCvrg):
+        keys = cvrg.keys.long()
+        return torch.stack([keys // (cvrg.shape[1] * cvrg.shape[2]), keys // cvrg.shape[2] % cvrg.shape[1], keys % cvrg.shape[2]], dim=-1)
+    return torch.nonzero(cvrg.view(cvrg.shape[:3]))
+
+
+def dilate(occ, r):
+    # in place max over a (2r + 1)^3 window of a bool volume
+    for dim in range(3):
+        src = occ.clone()
+        for s in range(1, min(r, occ.shape[dim] - 1) + 1):
+            occ.narrow(dim, s, occ.shape[dim] - s).logical_or_(src.narrow(dim, 0, occ.shape[dim] - s))
+            occ.narrow(dim, 0, occ.shape[dim] - s).logical_or_(src.narrow(dim, s, occ.shape[dim] - s))
+    return occ
+
+
+def candidate_cells(aabb, gridSize, cvrg=None, units=None, prior=None, batch=1 << 22):
+    # bool [Z, Y, X] superset of the updateAlphaMask cells that can pass compute_alpha's coverage and previous mask tests,
+    # built from the covered coverage cells and the previous mask's voxels instead of testing every cell. None: all cells
+    X, Y, Z = [int(s) for s in gridSize]
+    device = aabb.device
+    dims = torch.as_tensor([X, Y, Z], device=device)
+    steps = (aabb[1] - aabb[0]) / torch.clamp(dims - 1, min=1)
+    cand = None
+    if cvrg is not None:
+        cand = torch.zeros(Z * Y * X, dtype=torch.bool, device=device)
+        ijk = covered_cells(cvrg).to(device)
+        last = torch.as_tensor(list(cvrg.shape[:3]), device=device) - 1
+        units = torch.as_tensor(units, device=device).float()
+        # grid points a with ijk * units <= a * steps < (ijk + 1) * units, with a margin against rounding; the last cell
+        # also holds the clamped points
+        lo = torch.clamp(torch.floor(ijk * units / steps - 0.01).long(), min=0)
+        hi = torch.where(ijk >= last, dims - 1, torch.clamp(torch.floor((ijk + 1) * units / steps + 0.01).long(), max=dims - 1))
+        span = int((hi - lo).max()) + 1 if len(ijk) > 0 else 0
+        offset = torch.stack(torch.meshgrid(*[torch.arange(span, device=device)] * 3, indexing="ij"), dim=-1).view(-1, 3)
+        for start in range(0, len(ijk), max(1, batch // max(1, len(offset)))):
+            end = start + max(1, batch // max(1, len(offset)))
+            pnt = lo[start:end, None] + offset[None]
+            pnt = pnt[(pnt <= hi[start:end, None]).all(-1)]
+            cand[pnt[..., 0] + X * (pnt[..., 1] + Y * pnt[..., 2])] = True
+        cand = cand.view(Z, Y, X)
+    if prior is not None and tuple(prior.shape) == (Z, Y, X) and torch.equal(prior.aabb.to(device), aabb):
+        # sample_alpha at a voxel reads a cell whose corners are within one voxel of it
+        prior = dilate(prior.volume().to(device), 1)
+        cand = prior if cand is None else cand & prior
+    return cand
+
+
+def occupancy_grid(alpha_fn, aabb, gridSize, thres, ks=3, batch=1 << 22, candidates=None):
+    # binarized alpha of the updateAlphaMask grid, bool [Z, Y, X] as AlphaGridMask stores it, and the bounds [2, 3] of
+    # its occupied cells (None if empty). Cell (x, y, z) sits at aabb[0] + (aabb[1] - aabb[0]) * (x, y, z) / (gridSize - 1)
+    # as in getDenseAlpha, but the cells are generated batch at a time from flat indices instead of a full meshgrid.
+    # Only the candidates (candidate_cells) are passed to alpha_fn, the model's compute_alpha, which still applies the
+    # exact coverage and previous mask tests; the bool volume is then dilated by ks, the same as thresholding the
+    # max pooled alpha
+    X, Y, Z = [int(s) for s in gridSize]
+    device = aabb.device
+    steps = (aabb[1] - aabb[0]) / torch.clamp(torch.as_tensor([X, Y, Z], device=device) - 1, min=1)
+    occ = torch.zeros(Z * Y * X, dtype=torch.bool, device=device)
+    cells = None if candidates is None else torch.nonzero(candidates.reshape(-1))[..., 0]
+    for start in range(0, len(occ) if cells is None else len(cells), batch):
+        flat = torch.arange(start, min(start + batch, len(occ)), device=device) if cells is None else cells[start:start + batch]
+        ijk = torch.stack([flat % X, flat // X % Y, flat // (X * Y)], dim=-1)
+        occ[flat] = alpha_fn(aabb[0] + ijk * steps) >= thres
+    occ = dilate(occ.view(Z, Y, X), ks // 2)
+    if not occ.any():
+        return occ, None
+    # occupied index range along x, y, z
+    lo, hi = [], []
+    for axes in [(0, 1), (0, 2), (1, 2)]:
+        inds = torch.nonzero(occ.any(axes[1]).any(axes[0]))[..., 0]
+        lo.append(inds[0])
+        hi.append(inds[-1])
+    return occ, torch.stack([aabb[0] + torch.stack(lo) * steps, aabb[0] + torch.stack(hi) * steps])
+
+
+class TileCuller:
+    ''' Screen tiles that can see nothing, for the tiled test renderer
+    The occupied cells of the coverage filter and of the alpha mask are pooled into at most max_cells coarse cells,
+    each bounded by a sphere. A tile whose rays share an origin is bounded by the cone around its mean direction that
+    holds all its rays; it is empty if that cone misses every coarse sphere of either set, since samples are only taken
+    in covered cells where the alpha mask is positive. Tiles with mixed origins (ndc rays) are never culled.
+    '''
+    def __init__(self, tensorf, max_cells=4096):
+        self.cells = []
+        ijk = covered_cells(tensorf.tensoRF_cvrg_filter)
+        units = tensorf.units.to(ijk.device).float()
+        # cell ijk spans [ijk, ijk + 1] * units from aabb[0]
+        groups, f = self.coarsen(ijk, max_cells)
+        self.cells.append(((groups.float() + 0.5) * f * units + tensorf.aabb[0], torch.full([len(groups)], f * 0.5 * units.norm().item(), device=ijk.device)))
+        if tensorf.alphaMask is not None:
+            mask = tensorf.alphaMask
+            # alpha voxel zyx sits at aabb[0] + xyz * spacing and is interpolated up to one spacing away
+            xyz = torch.nonzero(mask.volume()).flip(-1)
+            spacing = mask.aabbSize / (mask.gridSize - 1).float()
+            groups, f = self.coarsen(xyz, max_cells)
+            self.cells.append(((groups.float() * f + (f - 1) / 2) * spacing + mask.aabb[0], torch.full([len(groups)], ((f - 1) / 2 + 1) * spacing.norm().item(), device=xyz.device)))
+
+    @staticmethod
+    def coarsen(ijk, max_cells):
+        f = 1
+        groups = torch.unique(ijk, dim=0)
+        while len(groups) > max_cells:
+            f *= 2
+            groups = torch.unique(ijk // f, dim=0)
+        return groups, f
+
+    @torch.no_grad()
+    def visible(self, rays_o, rays_d, tile_id, n_tiles, tile_chunk=256):
+        # rays sorted by tile_id; bool [n_tiles], False for tiles that can't hit anything
+        counts = torch.bincount(tile_id, minlength=n_tiles)
+        starts = torch.cumsum(counts, 0) - counts
+        present = counts > 0
+        dirs = rays_d / rays_d.norm(dim=-1, keepdim=True)
+        axis = segment_coo(dirs, tile_id, dim_size=n_tiles, reduce="sum")
+        axis = axis / axis.norm(dim=-1, keepdim=True).clamp(min=1e-12)
+        cos_min = segment_coo((dirs * axis[tile_id]).sum(-1), tile_id, dim_size=n_tiles, reduce="min")
+        # plus a margin for float32 acos near 1
+        half_angle = torch.acos(cos_min.clamp(-1, 1)) + 1e-3
+        origin = rays_o[starts.clamp(max=len(rays_o) - 1)]
+        spread = segment_coo((rays_o - origin[tile_id]).norm(dim=-1), tile_id, dim_size=n_tiles, reduce="max")
+        visible = present.clone()
+        for centers, radius in self.cells:
+            hit = torch.zeros(n_tiles, dtype=torch.bool, device=rays_o.device)
+            for i in range(0, n_tiles, tile_chunk):
+                vec = centers[None] - origin[i:i + tile_chunk, None]
+                dist = vec.norm(dim=-1).clamp(min=1e-12)
+                angle = torch.acos(((vec * axis[i:i + tile_chunk, None]).sum(-1) / dist).clamp(-1, 1))
+                slack = torch.asin((radius[None] / dist).clamp(max=1))
+                hit[i:i + tile_chunk] = ((angle <= half_angle[i:i + tile_chunk, None] + slack) | (dist <= radius[None])).any(-1)
+            visible &= hit
+        return visible | (present & (spread > 1e-5))
+
+
 class MLPRender_Fea(torch.nn.Module):
     def __init__(self, inChanel, viewpe=6, feape=6, featureC=128):
         super(MLPRender_Fea, self).__init__()
@@ -432,7 +602,7 @@ class Raw2Alpha(torch.autograd.Function):
               = 1 - exp(log(1 + exp(density + shift)) ^ (-interval))
               = 1 - (1 + exp(density + shift)) ^ (-interval)
         '''
-        exp, alpha = render_utils_cuda.raw2alpha(density, shift, interval);
+        exp, alpha = get_kernels(density.device).render_utils.raw2alpha(density, shift, interval)
         if density.requires_grad:
             ctx.save_for_backward(exp)
             ctx.interval = interval
@@ -447,7 +617,7 @@ class Raw2Alpha(torch.autograd.Function):
         '''
         exp = ctx.saved_tensors[0]
         interval = ctx.interval
-        return render_utils_cuda.raw2alpha_backward(exp, grad_back.contiguous(), interval), None, None
+        return get_kernels(exp.device).render_utils.raw2alpha_backward(exp, grad_back.contiguous(), interval), None, None
 
 
 class Raw2Alpha_randstep(torch.autograd.Function):
@@ -459,7 +629,7 @@ class Raw2Alpha_randstep(torch.autograd.Function):
               = 1 - exp(log(1 + exp(density + shift)) ^ (-interval))
               = 1 - (1 + exp(density + shift)) ^ (-interval)
         '''
-        exp, alpha = render_utils_cuda.raw2alpha_randstep(density, shift, interval);
+        exp, alpha = get_kernels(density.device).render_utils.raw2alpha_randstep(density, shift, interval)
         if density.requires_grad:
             ctx.save_for_backward(exp)
             ctx.interval = interval
@@ -474,7 +644,7 @@ class Raw2Alpha_randstep(torch.autograd.Function):
         '''
         exp = ctx.saved_tensors[0]
         interval = ctx.interval
-        return render_utils_cuda.raw2alpha_randstep_backward(exp, grad_back.contiguous(), interval), None, None
+        return get_kernels(exp.device).render_utils.raw2alpha_randstep_backward(exp, grad_back.contiguous(), interval), None, None
 
 
 class GridSample1dVm(torch.autograd.Function):
@@ -557,7 +727,7 @@ def grid_xyz(center, local_range, local_dims):
 class Alphas2Weights(torch.autograd.Function):
     @staticmethod
     def forward(ctx, alpha, ray_id, N):
-        weights, T, alphainv_last, i_start, i_end = render_utils_cuda.alpha2weight(alpha, ray_id, N)
+        weights, T, alphainv_last, i_start, i_end = get_kernels(alpha.device).render_utils.alpha2weight(alpha, ray_id, N)
         if alpha.requires_grad:
             ctx.save_for_backward(alpha, weights, T, alphainv_last, i_start, i_end)
             ctx.n_rays = N
@@ -567,12 +737,80 @@ class Alphas2Weights(torch.autograd.Function):
     @torch.autograd.function.once_differentiable
     def backward(ctx, grad_weights, grad_last):
         alpha, weights, T, alphainv_last, i_start, i_end = ctx.saved_tensors
-        grad = render_utils_cuda.alpha2weight_backward(
+        grad = get_kernels(alpha.device).render_utils.alpha2weight_backward(
             alpha, weights, T, alphainv_last,
             i_start, i_end, ctx.n_rays, grad_weights, grad_last)
         return grad, None, None
 
 
+
+def compact_index(mask, n):
+    # positions of the n True entries of mask, without the host sync of nonzero / boolean indexing
+    pos = torch.where(mask, torch.cumsum(mask, 0) - 1, torch.full_like(mask, n, dtype=torch.int64))
+    index = torch.empty([n + 1], device=mask.device, dtype=torch.int64)
+    return index.scatter_(0, pos, torch.arange(len(mask), device=mask.device))[:n]
+
+
+def ragged_arange(counts):
+    # (segment, position in segment) of every element of the concatenation of arange(counts[i]), e.g. the rows of
+    # the per-box line segments laid out by dim_cumsum_counter
+    counts = counts.long()
+    seg = torch.repeat_interleave(torch.arange(len(counts), device=counts.device), counts)
+    starts = torch.cumsum(counts, 0) - counts
+    return seg, torch.arange(len(seg), device=counts.device) - starts[seg]
+
+
+def ragged_linspace(start, end, steps, seg, pos):
+    # torch.linspace(start[i], end[i], steps[i]) of every segment in one pass, same symmetric formula as the kernel
+    start, end, steps = start[seg], end[seg], steps[seg].long()
+    step = (end - start) / torch.clamp(steps - 1, min=1).to(start.dtype)
+    out = torch.where(pos < steps // 2, start + step * pos, end - step * (steps - 1 - pos))
+    return torch.where(steps == 1, start, out)
+
+
+class SampleRecords:
+    ''' Struct of arrays of the (sample, tensoRF) records of every level
+    Each column (agg_id, tensoRF_id, local_gindx_s, ...) holds the records of all levels back to back, level l being
+    rows bounds[l]:bounds[l+1], so pruning samples is one compaction index gathered into every column. The compaction
+    itself stays on the device (compact_index), but prune is not sync free: the pruned columns have data dependent
+    sizes, so the kept sample count and the new level bounds are read back in one .tolist() (which replaces the
+    .item() and .any() syncs of the old holder remap). The per-level lists the compute_*feature_geo functions take are
+    views of the columns.
+    '''
+    def __init__(self, columns, bounds):
+        self.columns = columns
+        self.bounds = bounds
+
+    @classmethod
+    def from_levels(cls, **levels):
+        # name -> list over levels, columns that are None (or lists of None) stay None
+        bounds = np.cumsum([0] + [len(agg_id) for agg_id in levels["agg_id"]]).tolist()
+        columns = {name: None if lst is None or any(t is None for t in lst) else torch.cat(lst) for name, lst in levels.items()}
+        return cls(columns, bounds)
+
+    def level(self, name):
+        column = self.columns[name]
+        return [None if column is None else column[self.bounds[l]:self.bounds[l+1]] for l in range(len(self.bounds) - 1)]
+
+    def levels(self, *names):
+        return [self.level(name) for name in names]
+
+    def prune(self, mask, *sample_columns):
+        # keep the samples in mask, their records, and the rows of every per-sample column (None passes through).
+        # As before, nothing is pruned when mask keeps every sample or none. One host sync, for the sizes
+        agg_id = self.columns["agg_id"]
+        keep = mask[agg_id.long()]
+        kept = F.pad(torch.cumsum(keep, 0), (1, 0))
+        sizes = torch.cat([mask.sum().view(1), kept[torch.as_tensor(self.bounds, device=kept.device)]]).tolist()
+        n_samples, bounds = sizes[0], sizes[1:]
+        if n_samples == 0 or n_samples == len(mask):
+            return self, list(sample_columns)
+        rec_index = compact_index(keep, bounds[-1])
+        sample_index = compact_index(mask, n_samples)
+        columns = {name: None if column is None else column[rec_index] for name, column in self.columns.items()}
+        columns["agg_id"] = (torch.cumsum(mask, 0) - 1)[columns["agg_id"].long()].to(agg_id.dtype)
+        return SampleRecords(columns, bounds), [None if column is None else column[sample_index] for column in sample_columns]
+
 def randomize_ray(rays_o, rgb_train, alpha, ijs, c2ws, focal, cent):
     b, _ = rays_o.shape
     xyshift = torch.rand(b, 1, 1, 2, device=rgb_train.device)
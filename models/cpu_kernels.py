@@ -0,0 +1,334 @@
+import torch
+from types import SimpleNamespace
+
+''' Reference implementations of the search_geo / search_geo_hier / render_utils / adam_upd kernels
+Pure (vectorized) pytorch, so they run on cpu-only boxes and on any device the inputs live on.
+Signatures and outputs mirror the CUDA extensions in models/cuda.
+Coverage maps may also be a SparseCvrg, which only this implementation understands.
+'''
+
+
+def _grid_ind(xyz, xyz_min, units):
+    # (int) cast of the CUDA kernels truncates toward zero
+    return torch.trunc((xyz - xyz_min) / units).long()
+
+
+def _flat_ind(ind, grid_size):
+    return (ind[..., 0] * grid_size[1] + ind[..., 1]) * grid_size[2] + ind[..., 2]
+
+
+class SparseCvrg:
+    ''' Sparse coverage map: the occupied cells of a gridSize volume as sorted flat (x-major) keys.
+    A cell's coverage id is its position in keys, i.e. the id the dense tensoRF_cvrg_inds stores,
+    so memory scales with occupied cells instead of the bounding box.
+    '''
+    def __init__(self, keys, shape):
+        self.keys = keys.contiguous()
+        self.shape = torch.Size([int(s) for s in shape])
+
+    def __len__(self):
+        return len(self.keys)
+
+    @property
+    def device(self):
+        return self.keys.device
+
+    def to(self, device):
+        return SparseCvrg(self.keys.to(device), self.shape)
+
+    def find(self, flat):
+        # coverage id of every flat cell index, -1 if not occupied
+        if len(self.keys) == 0:
+            return torch.full_like(flat, -1)
+        pos = torch.clamp(torch.searchsorted(self.keys, flat), max=len(self.keys) - 1)
+        return torch.where(self.keys[pos] == flat, pos, torch.full_like(pos, -1))
+
+    def dense(self):
+        inds = torch.full([self.shape.numel()], -1, dtype=torch.int32, device=self.keys.device)
+        inds[self.keys] = torch.arange(len(self.keys), dtype=torch.int32, device=self.keys.device)
+        return inds.view(self.shape)
+
+
+def merge_cvrg(cvrg_lst, all_lvl=False):
+    # cells covered by any (or every) level
+    keys, counts = torch.unique(torch.cat([cvrg.keys for cvrg in cvrg_lst]), return_counts=True)
+    if all_lvl:
+        keys = keys[counts == len(cvrg_lst)]
+    return SparseCvrg(keys, cvrg_lst[0].shape)
+
+
+def _cvrg_id(cvrg, flat):
+    if isinstance(cvrg, SparseCvrg):
+        return cvrg.find(flat)
+    return cvrg.view(-1)[flat].long()
+
+
+def _cvrg_mask(cvrg, flat):
+    if isinstance(cvrg, SparseCvrg):
+        return cvrg.find(flat) >= 0
+    return cvrg.view(-1)[flat]
+
+
+def _segment_pos(counts):
+    # for every element of the ragged layout: owner segment and position inside the segment
+    seg_id = torch.repeat_interleave(torch.arange(len(counts), device=counts.device), counts)
+    starts = torch.cumsum(counts, 0) - counts
+    pos = torch.arange(len(seg_id), device=counts.device) - starts[seg_id]
+    return seg_id, pos, starts
+
+
+def _window_pairs(xyz, center_ind, offsets, grid_size):
+    # candidate cells center_ind + offsets around every point, restricted to the grid
+    ox, oy, oz = offsets
+    cand = torch.stack(torch.meshgrid(ox, oy, oz, indexing="ij"), dim=-1).view(-1, 3)
+    cells = center_ind[:, None, :] + cand[None, ...]
+    inside = torch.all((cells >= 0) & (cells < grid_size), dim=-1)
+    pnt_ind, cand_ind = torch.nonzero(inside, as_tuple=True)
+    return pnt_ind, cells[pnt_ind, cand_ind]
+
+
+def _topk_per_group(group, key, value, k):
+    # keep the k smallest keys per group, ties broken by value (point index), like the CUDA buffer
+    order = torch.argsort(value, stable=True)
+    order = order[torch.argsort(key[order], stable=True)]
+    order = order[torch.argsort(group[order], stable=True)]
+    group, key, value = group[order], key[order], value[order]
+    _, counts = torch.unique_consecutive(group, return_counts=True)
+    _, pos, _ = _segment_pos(counts)
+    keep = pos < k
+    return group[keep], key[keep], value[keep]
+
+
+@torch.no_grad()
+def build_tensoRF_map_hier(pnt_xyz, gridSize, xyz_min, xyz_max, units, local_range, local_dims, max_tensoRF, chunk=4096, sparse=False):
+    device = pnt_xyz.device
+    grid_size = gridSize.to(device)
+    gx, gy, gz = [int(g) for g in gridSize.tolist()]
+    pnt_ind = _grid_ind(pnt_xyz, xyz_min, units)
+
+    # mark every cell whose faces are within local_range of a tensoRF center (get_geo_inds_cuda_kernel)
+    # the search window uses units[0] on every axis, same as the kernel
+    lx, ly, lz = [int(torch.ceil(local_range[i] / units[0]).item()) for i in range(3)]
+    offsets = [torch.arange(-l, l + 1, device=device) for l in (lx, ly, lz)]
+    # sparse: only the sorted keys of covered cells are kept, never a gridSize volume
+    keys = torch.zeros([0], dtype=torch.int64, device=device)
+    cvrg = None if sparse else torch.zeros(gx * gy * gz, dtype=torch.bool, device=device)
+    for s in range(0, len(pnt_xyz), chunk):
+        xyz = pnt_xyz[s:s + chunk]
+        p_id, cells = _window_pairs(xyz, pnt_ind[s:s + chunk], offsets, grid_size)
+        rel = xyz[p_id] - xyz_min
+        near_face = torch.minimum(torch.abs(rel - cells * units), torch.abs(rel - (cells + 1) * units))
+        valid = torch.all(near_face <= local_range, dim=-1)
+        flat = _flat_ind(cells[valid], grid_size)
+        if sparse:
+            keys = torch.unique(torch.cat([keys, flat]))
+        else:
+            cvrg[flat] = True
+
+    if sparse:
+        tensoRF_cvrg_inds = SparseCvrg(keys, (gx, gy, gz))
+        num_cvrg = len(keys)
+    else:
+        tensoRF_cvrg_inds = torch.cumsum(cvrg, 0, dtype=torch.int32) * cvrg - 1
+        num_cvrg = int(cvrg.sum().item())
+        tensoRF_cvrg_inds = tensoRF_cvrg_inds.to(torch.int32).view(gx, gy, gz)
+
+    # for every covered cell keep the max_tensoRF closest centers (fill_geo_inds_cuda_kernel)
+    lx, ly, lz = [int(torch.ceil(local_range[i] / units[i]).item()) + 1 for i in range(3)]
+    offsets = [torch.arange(-l, l + 1, device=device) for l in (lx, ly, lz)]
+    group = torch.zeros([0], dtype=torch.int64, device=device)
+    key = torch.zeros([0], dtype=pnt_xyz.dtype, device=device)
+    value = torch.zeros([0], dtype=torch.int64, device=device)
+    for s in range(0, len(pnt_xyz), chunk):
+        xyz = pnt_xyz[s:s + chunk]
+        p_id, cells = _window_pairs(xyz, pnt_ind[s:s + chunk], offsets, grid_size)
+        cvrg_id = _cvrg_id(tensoRF_cvrg_inds, _flat_ind(cells, grid_size))
+        diff = torch.abs(xyz[p_id] - (xyz_min + (cells + 0.5) * units))
+        valid = (cvrg_id >= 0) & torch.all(diff < local_range + units * 0.5, dim=-1)
+        group = torch.cat([group, cvrg_id[valid]])
+        key = torch.cat([key, torch.sum(diff[valid] * diff[valid], dim=-1)])
+        value = torch.cat([value, p_id[valid] + s])
+        group, key, value = _topk_per_group(group, key, value, max_tensoRF)
+
+    # slots are filled in point order, as when a cell is not over-subscribed in the kernel
+    order = torch.argsort(value, stable=True)
+    order = order[torch.argsort(group[order], stable=True)]
+    group, value = group[order], value[order]
+    cells, counts = torch.unique_consecutive(group, return_counts=True)
+    _, pos, _ = _segment_pos(counts)
+    tensoRF_topindx = torch.full([num_cvrg, max_tensoRF], -1, dtype=torch.int16, device=device)
+    tensoRF_topindx[group, pos] = value.to(torch.int16)
+    tensoRF_count = torch.zeros([num_cvrg], dtype=torch.int8, device=device)
+    tensoRF_count[cells] = counts.to(torch.int8)
+    return tensoRF_cvrg_inds, tensoRF_count, tensoRF_topindx
+
+
+def sample_2_tensoRF_cvrg_hier(xyz_sampled, xyz_min, xyz_max, units, lvl_units, local_range, local_dims, tensoRF_cvrg_inds, tensoRF_count, tensoRF_topindx, geo_xyz, K, KNN):
+    grid_size = torch.as_tensor(tensoRF_cvrg_inds.shape, device=xyz_sampled.device)
+    ind = torch.minimum(torch.clamp(_grid_ind(xyz_sampled, xyz_min, units), min=0), grid_size - 1)
+    cvrg_id = _cvrg_id(tensoRF_cvrg_inds, _flat_ind(ind, grid_size))
+    cvrg_count = torch.where(cvrg_id >= 0, tensoRF_count[cvrg_id.clamp(min=0)].long(), torch.zeros_like(cvrg_id))
+
+    final_agg_id, tensoRF_shift, _ = _segment_pos(cvrg_count)
+    final_tensoRF_id = tensoRF_topindx[cvrg_id[final_agg_id], tensoRF_shift].long()
+
+    rel = xyz_sampled[final_agg_id] - geo_xyz[final_tensoRF_id]
+    local_kernel_dist = torch.norm(rel, dim=-1)
+    softind = (rel + local_range) / lvl_units
+    local_gindx_s = torch.minimum(torch.clamp(torch.trunc(softind).long(), min=0), local_dims[:3] - 1)
+    local_gweight_l = softind - local_gindx_s
+    return local_gindx_s, local_gindx_s + 1, 1 - local_gweight_l, local_gweight_l, local_kernel_dist, final_tensoRF_id, final_agg_id
+
+
+def infer_t_minmax(rays_o, rays_d, xyz_min, xyz_max, near, far):
+    vec = torch.where(rays_d == 0, torch.full_like(rays_d, 1e-6), rays_d)
+    rate_a = (xyz_max - rays_o) / vec
+    rate_b = (xyz_min - rays_o) / vec
+    t_min = torch.minimum(rate_a, rate_b).amax(-1).clamp(max=far).clamp(min=near)
+    t_max = torch.maximum(rate_a, rate_b).amin(-1).clamp(max=far).clamp(min=near)
+    return t_min, t_max
+
+
+def sample_pts_on_rays_cvrg(rays_o, rays_d, tensoRF_cvrg_mask, units, xyz_min, xyz_max, near, far, stepdist):
+    grid_size = torch.as_tensor(tensoRF_cvrg_mask.shape, device=rays_o.device)
+    t_min, t_max = infer_t_minmax(rays_o, rays_d, xyz_min, xyz_max, near, far)
+    N_steps = torch.clamp(torch.ceil((t_max - t_min) / stepdist), min=1).long()
+    ray_id, step_id, _ = _segment_pos(N_steps)
+
+    rays_start = rays_o + rays_d * t_min[:, None]
+    rays_dir = rays_d / torch.norm(rays_d, dim=-1, keepdim=True)
+    rays_pts = rays_start[ray_id] + rays_dir[ray_id] * (stepdist * step_id.to(rays_o.dtype))[:, None]
+
+    in_bound = torch.all((rays_pts >= xyz_min) & (rays_pts <= xyz_max), dim=-1)
+    ind = torch.minimum(torch.clamp(_grid_ind(rays_pts, xyz_min, units), min=0), grid_size - 1)
+    mask_valid = in_bound & _cvrg_mask(tensoRF_cvrg_mask, _flat_ind(ind, grid_size))
+    return rays_pts, mask_valid, ray_id, step_id, N_steps, t_min, t_max
+
+
+def filter_xyz_cvrg(xyz_sampled, xyz_min, xyz_max, units, tensoRF_cvrg_mask):
+    grid_size = torch.as_tensor(tensoRF_cvrg_mask.shape, device=xyz_sampled.device)
+    in_bound = torch.all((xyz_sampled >= xyz_min) & (xyz_sampled <= xyz_max), dim=-1)
+    ind = torch.minimum(torch.clamp(_grid_ind(xyz_sampled, xyz_min, units), min=0), grid_size - 1)
+    return in_bound & _cvrg_mask(tensoRF_cvrg_mask, _flat_ind(ind, grid_size))
+
+
+def filter_ray_by_cvrg(xyz_sampled, mask_inbox, units, xyz_min, xyz_max, tensoRF_cvrg_mask):
+    grid_size = torch.as_tensor(tensoRF_cvrg_mask.shape, device=xyz_sampled.device)
+    ind = torch.minimum(torch.clamp(_grid_ind(xyz_sampled, xyz_min, units), min=0), grid_size - 1)
+    return mask_inbox & _cvrg_mask(tensoRF_cvrg_mask, _flat_ind(ind, grid_size))
+
+
+def raw2alpha(density, shift, interval):
+    exp_d = torch.exp(density + shift)
+    return exp_d, 1 - torch.pow(1 + exp_d, -interval)
+
+
+def raw2alpha_backward(exp_d, grad_back, interval):
+    return torch.clamp(exp_d, max=1e10) * torch.pow(1 + exp_d, -interval - 1) * interval * grad_back
+
+
+raw2alpha_randstep = raw2alpha
+raw2alpha_randstep_backward = raw2alpha_backward
+
+
+def _ray_segments(ray_id, n_rays):
+    counts = torch.bincount(ray_id, minlength=n_rays)
+    starts = torch.cumsum(counts, 0) - counts
+    pos = torch.arange(len(ray_id), device=ray_id.device) - starts[ray_id]
+    return counts, starts, pos
+
+
+def alpha2weight(alpha, ray_id, n_rays):
+    # per-ray front-to-back compositing on a [n_rays, max_steps] padded layout, stopping once T < 1e-3
+    weight = torch.zeros_like(alpha)
+    T = torch.ones_like(alpha)
+    alphainv_last = torch.ones([n_rays], dtype=alpha.dtype, device=alpha.device)
+    i_start = torch.zeros([n_rays], dtype=torch.int64, device=alpha.device)
+    i_end = torch.zeros([n_rays], dtype=torch.int64, device=alpha.device)
+    if len(alpha) == 0:
+        return weight, T, alphainv_last, i_start, i_end
+
+    counts, starts, pos = _ray_segments(ray_id, n_rays)
+    trans = torch.ones([n_rays, int(counts.max().item())], dtype=alpha.dtype, device=alpha.device)
+    trans[ray_id, pos] = 1 - alpha
+    T_incl = torch.cumprod(trans, dim=1)
+    T_excl = torch.cat([torch.ones_like(T_incl[:, :1]), T_incl[:, :-1]], dim=1)
+
+    processed = T_excl[ray_id, pos] >= 1e-3
+    n_processed = torch.bincount(ray_id[processed], minlength=n_rays)
+    T[processed] = T_excl[ray_id, pos][processed]
+    weight[processed] = T[processed] * alpha[processed]
+
+    has_pts = counts > 0
+    i_start[has_pts] = starts[has_pts]
+    i_end[has_pts] = starts[has_pts] + n_processed[has_pts]
+    last = torch.clamp(n_processed - 1, min=0)
+    alphainv_last[has_pts] = T_incl[torch.arange(n_rays, device=alpha.device), last][has_pts]
+    return weight, T, alphainv_last, i_start, i_end
+
+
+def alpha2weight_backward(alpha, weight, T, alphainv_last, i_start, i_end, n_rays, grad_weights, grad_last):
+    grad = torch.zeros_like(alpha)
+    if n_rays == 0 or len(alpha) == 0:
+        return grad
+    n_processed = i_end - i_start
+    ray_id, pos, _ = _segment_pos(n_processed)
+    pnt_id = i_start[ray_id] + pos
+
+    # suffix sum of grad_weights * weight over the later points of the same ray
+    acc = torch.zeros([n_rays, int(n_processed.max().item()) + 1], dtype=alpha.dtype, device=alpha.device)
+    acc[ray_id, pos] = grad_weights[pnt_id] * weight[pnt_id]
+    suffix = torch.flip(torch.cumsum(torch.flip(acc, [1]), dim=1), [1])
+    back_cum = grad_last * alphainv_last
+    back_cum = back_cum[ray_id] + suffix[ray_id, pos + 1]
+    grad[pnt_id] = grad_weights[pnt_id] * T[pnt_id] - back_cum / (1 - alpha[pnt_id] + 1e-10)
+    return grad
+
+
+def _adam_step_size(step, beta1, beta2, lr):
+    return lr * (1 - beta2 ** step) ** 0.5 / (1 - beta1 ** step)
+
+
+@torch.no_grad()
+def adam_upd(param, grad, exp_avg, exp_avg_sq, step, beta1, beta2, lr, eps):
+    exp_avg.mul_(beta1).add_(grad, alpha=1 - beta1)
+    exp_avg_sq.mul_(beta2).addcmul_(grad, grad, value=1 - beta2)
+    param.sub_(_adam_step_size(step, beta1, beta2, lr) * exp_avg / (torch.sqrt(exp_avg_sq) + eps))
+
+
+@torch.no_grad()
+def masked_adam_upd(param, grad, exp_avg, exp_avg_sq, step, beta1, beta2, lr, eps):
+    mask = grad != 0
+    exp_avg[mask] = beta1 * exp_avg[mask] + (1 - beta1) * grad[mask]
+    exp_avg_sq[mask] = beta2 * exp_avg_sq[mask] + (1 - beta2) * grad[mask] * grad[mask]
+    param[mask] -= _adam_step_size(step, beta1, beta2, lr) * exp_avg[mask] / (torch.sqrt(exp_avg_sq[mask]) + eps)
+
+
+@torch.no_grad()
+def adam_upd_with_perlr(param, grad, exp_avg, exp_avg_sq, perlr, step, beta1, beta2, lr, eps):
+    exp_avg.mul_(beta1).add_(grad, alpha=1 - beta1)
+    exp_avg_sq.mul_(beta2).addcmul_(grad, grad, value=1 - beta2)
+    param.sub_(_adam_step_size(step, beta1, beta2, lr) * perlr * exp_avg / (torch.sqrt(exp_avg_sq) + eps))
+
+
+search_geo_hier = SimpleNamespace(
+    build_tensoRF_map_hier=build_tensoRF_map_hier,
+    sample_2_tensoRF_cvrg_hier=sample_2_tensoRF_cvrg_hier)
+
+search_geo = SimpleNamespace(
+    sample_pts_on_rays_cvrg=sample_pts_on_rays_cvrg,
+    filter_xyz_cvrg=filter_xyz_cvrg,
+    filter_ray_by_cvrg=filter_ray_by_cvrg)
+
+render_utils = SimpleNamespace(
+    raw2alpha=raw2alpha,
+    raw2alpha_backward=raw2alpha_backward,
+    raw2alpha_randstep=raw2alpha_randstep,
+    raw2alpha_randstep_backward=raw2alpha_randstep_backward,
+    alpha2weight=alpha2weight,
+    alpha2weight_backward=alpha2weight_backward)
+
+adam = SimpleNamespace(
+    adam_upd=adam_upd,
+    masked_adam_upd=masked_adam_upd,
+    adam_upd_with_perlr=adam_upd_with_perlr)
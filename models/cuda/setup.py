@@ -0,0 +1,21 @@
+''' Ahead-of-time build of the CUDA extensions
+    cd models/cuda && python setup.py install   (or: pip wheel models/cuda, then install the wheel)
+The installed modules are picked up by models/cuda_ext.py before any JIT build.
+'''
+import os
+import sys
+from setuptools import setup
+from torch.utils.cpp_extension import BuildExtension, CUDAExtension
+
+cuda_dir = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(os.path.dirname(cuda_dir)))
+from models.cuda_ext import EXTENSIONS
+
+os.chdir(cuda_dir)
+setup(
+    name='strivec_cuda_ext',
+    ext_modules=[
+        CUDAExtension(name, [os.path.basename(path) for path in sources])
+        for name, sources in EXTENSIONS.items()
+        if all(os.path.exists(os.path.basename(path)) for path in sources)],
+    cmdclass={'build_ext': BuildExtension})
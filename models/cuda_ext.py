@@ -0,0 +1,92 @@
+import os
+import hashlib
+import importlib
+import torch
+from . import cpu_kernels
+parent_dir = os.path.dirname(os.path.abspath(__file__))
+
+''' Registry of the CUDA extensions
+Nothing is built at import time. An extension is resolved on first attribute access, in order:
+1. a prebuilt module of the same name (python models/cuda/setup.py install)
+2. a JIT build into a persistent cache keyed on torch / cuda version and the source contents
+   ($STRIVEC_EXT_DIR, default ~/.cache/strivec/torch_extensions), so cold builds happen once per toolkit
+3. the pure pytorch fallback in cpu_kernels, when the extension can't be built or loaded
+Set STRIVEC_EXT_VERBOSE=1 to see the nvcc output of a JIT build.
+'''
+EXTENSIONS = {
+    'render_utils_cuda': ['cuda/render_utils.cpp', 'cuda/render_utils_kernel.cu'],
+    'search_geo_cuda': ['cuda/search_geo.cpp', 'cuda/search_geo.cu'],
+    'search_geo_hier_cuda': ['cuda/search_geo_hier.cpp', 'cuda/search_geo_hier.cu'],
+    'search_geo_adapt_cuda': ['cuda/search_geo_adapt.cpp', 'cuda/search_geo_adapt.cu'],
+    'grid_sample_1d': ['cuda/grid_sample_1d.cpp', 'cuda/grid_sample_1d.cu'],
+    'adam_upd_cuda': ['cuda/adam_upd.cpp', 'cuda/adam_upd_kernel.cu'],
+    'total_variation_cuda': ['cuda/total_variation.cpp', 'cuda/total_variation_kernel.cu'],
+    'ub360_utils_cuda': ['cuda/ub360_utils.cpp', 'cuda/ub360_utils_kernel.cu'],
+}
+
+FALLBACKS = {
+    'render_utils_cuda': cpu_kernels.render_utils,
+    'search_geo_cuda': cpu_kernels.search_geo,
+    'search_geo_hier_cuda': cpu_kernels.search_geo_hier,
+    'adam_upd_cuda': cpu_kernels.adam,
+}
+
+_loaded = {}
+
+
+def build_dir(name):
+    sources = [os.path.join(parent_dir, path) for path in EXTENSIONS[name]]
+    digest = hashlib.sha1()
+    for path in sources:
+        with open(path, 'rb') as f:
+            digest.update(f.read())
+    version = "torch{}_cu{}_{}".format(torch.__version__, torch.version.cuda, digest.hexdigest()[:12]).replace("+", "_")
+    root = os.environ.get("STRIVEC_EXT_DIR", os.path.join(os.path.expanduser("~"), ".cache", "strivec", "torch_extensions"))
+    path = os.path.join(root, version, name)
+    os.makedirs(path, exist_ok=True)
+    return path
+
+
+def _build(name):
+    try:
+        return importlib.import_module(name)
+    except ImportError:
+        pass
+    if not torch.cuda.is_available():
+        return None
+    try:
+        from torch.utils.cpp_extension import load
+        return load(
+            name=name,
+            sources=[os.path.join(parent_dir, path) for path in EXTENSIONS[name]],
+            build_directory=build_dir(name),
+            verbose=os.environ.get("STRIVEC_EXT_VERBOSE", "0") == "1")
+    except (OSError, RuntimeError, ImportError) as e:
+        print("could not build {}: {}".format(name, e))
+        return None
+
+
+def load_extension(name):
+    if name not in _loaded:
+        _loaded[name] = _build(name)
+        if _loaded[name] is None and name in FALLBACKS:
+            print("{} unavailable, using the pytorch fallback".format(name))
+    return _loaded[name]
+
+
+def extension_available(name):
+    return load_extension(name) is not None
+
+
+class LazyExtension:
+    def __init__(self, name):
+        assert name in EXTENSIONS, "unknown extension {}".format(name)
+        self.name = name
+
+    def __getattr__(self, attr):
+        module = load_extension(self.name)
+        if module is None:
+            module = FALLBACKS.get(self.name)
+        if module is None or not hasattr(module, attr):
+            raise RuntimeError("{}.{} needs the compiled extension, build it with `python models/cuda/setup.py install` or on a machine with nvcc".format(self.name, attr))
+        return getattr(module, attr)
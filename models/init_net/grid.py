@@ -7,21 +7,10 @@ import torch
 import torch.nn as nn
 import torch.nn.functional as F
 
-from torch.utils.cpp_extension import load
-parent_dir = os.path.dirname(os.path.abspath(__file__))
-render_utils_cuda = load(
-        name='render_utils_cuda',
-        sources=[
-            os.path.join(parent_dir, path)
-            for path in ['../cuda/render_utils.cpp', '../cuda/render_utils_kernel.cu']],
-        verbose=True)
-
-total_variation_cuda = load(
-        name='total_variation_cuda',
-        sources=[
-            os.path.join(parent_dir, path)
-            for path in ['../cuda/total_variation.cpp', '../cuda/total_variation_kernel.cu']],
-        verbose=True)
+from ..cuda_ext import LazyExtension
+render_utils_cuda = LazyExtension('render_utils_cuda')
+
+total_variation_cuda = LazyExtension('total_variation_cuda')
 
 
 def create_grid(type, **kwargs):
@@ -0,0 +1,100 @@
+import torch
+
+''' Fused gather - interpolate - product of the three line factors of the local CP tensoRFs
+    out[m, c] = prod_i (line_i[t_m, c, s_mi] * ws_mi + line_i[t_m, c, l_mi] * wl_mi)
+Same result as PointTensorCP_hier.ind_intrp_line_map_batch_prod, but every tap is a torch.take of a flat offset into
+the line storage instead of an advanced-indexing gather. Autograd saves only the [M] / [M, 3, 2] indices and weights
+(not the [M, n_comp] gathered taps), backward recomputes the three factors and scatters into the line gradients with
+index_add_. Both passes still build transient int64 tap offsets, [M, n_comp, 2] per axis, so the peak memory of a
+step is not necessarily lower than eager's; eager stays the default until fused / compile are benchmarked.
+    eager:   the original advanced-indexing expression
+    fused:   the autograd Function below, any device
+    compile: the same Function with its forward / backward math compiled by torch.compile (triton kernels on cuda),
+             falls back to fused if torch.compile is missing or compiling fails (raised at the first call); runtime
+             errors such as out of memory are raised as is
+'''
+MODES = ["eager", "fused", "compile"]
+
+
+def eager_line_prod(lines, gindx_s, gindx_l, gweight_s, gweight_l, tensoRF_id):
+    return (lines[0][tensoRF_id, :, gindx_s[..., 0]] * gweight_s[:, None, 0] + lines[0][tensoRF_id, :, gindx_l[..., 0]] * gweight_l[:, None, 0]) * (lines[1][tensoRF_id, :, gindx_s[..., 1]] * gweight_s[:, None, 1] + lines[1][tensoRF_id, :, gindx_l[..., 1]] * gweight_l[:, None, 1]) * (lines[2][tensoRF_id, :, gindx_s[..., 2]] * gweight_s[:, None, 2] + lines[2][tensoRF_id, :, gindx_l[..., 2]] * gweight_l[:, None, 2])
+
+
+def _factors(line0, line1, line2, tensoRF_id, gindx, weight):
+    # interpolated value of every axis, [M, n_comp] each. gindx / weight: [M, 3, 2] (s and l tap per axis)
+    row = tensoRF_id[:, None] * line0.shape[1] + torch.arange(line0.shape[1], device=tensoRF_id.device)[None, :]
+    taps = [(row * line.shape[2])[..., None] + gindx[:, None, i, :] for i, line in enumerate([line0, line1, line2])]
+    return [(torch.take(line, tap) * weight[:, None, i, :]).sum(-1) for i, (line, tap) in enumerate(zip([line0, line1, line2], taps))], taps
+
+
+def _forward(line0, line1, line2, tensoRF_id, gindx, weight):
+    (f0, f1, f2), _ = _factors(line0, line1, line2, tensoRF_id, gindx, weight)
+    return f0 * f1 * f2
+
+
+def _backward(grad, line0, line1, line2, tensoRF_id, gindx, weight):
+    (f0, f1, f2), taps = _factors(line0, line1, line2, tensoRF_id, gindx, weight)
+    grads = []
+    for i, (line, grad_f) in enumerate(zip([line0, line1, line2], [grad * f1 * f2, grad * f0 * f2, grad * f0 * f1])):
+        grad_line = torch.zeros_like(line)
+        grad_line.view(-1).index_add_(0, taps[i].reshape(-1), (grad_f[..., None] * weight[:, None, i, :]).reshape(-1))
+        grads.append(grad_line)
+    return grads
+
+
+_kernels = {"fused": (_forward, _backward)}
+
+
+def _get_kernels(mode):
+    if mode not in _kernels:
+        try:
+            _kernels[mode] = (torch.compile(_forward, dynamic=True), torch.compile(_backward, dynamic=True))
+        except (AttributeError, ImportError, RuntimeError) as e:
+            print("torch.compile unavailable for the line gather ({}), using the fused path".format(e))
+            _kernels[mode] = _kernels["fused"]
+    return _kernels[mode]
+
+
+def _compile_errors():
+    # what a failed trace / backend compile raises; anything else (out of memory, bad indices, ...) is not a compile error
+    try:
+        from torch._dynamo.exc import TorchDynamoException
+    except ImportError:
+        return (ImportError,)
+    return (TorchDynamoException, ImportError)
+
+
+def _run(mode, which, *args):
+    # torch.compile only traces on the first call, so that is where a compile failure shows up
+    if mode == "fused" or _kernels.get(mode) is _kernels["fused"]:
+        return _kernels["fused"][which](*args)
+    try:
+        return _get_kernels(mode)[which](*args)
+    except _compile_errors() as e:
+        print("torch.compile failed for the line gather ({}), using the fused path".format(e))
+        _kernels[mode] = _kernels["fused"]
+        return _kernels["fused"][which](*args)
+
+
+class LineProd(torch.autograd.Function):
+    @staticmethod
+    def forward(ctx, mode, line0, line1, line2, tensoRF_id, gindx, weight):
+        ctx.mode = mode
+        ctx.save_for_backward(line0, line1, line2, tensoRF_id, gindx, weight)
+        return _run(mode, 0, line0, line1, line2, tensoRF_id, gindx, weight)
+
+    @staticmethod
+    def backward(ctx, grad):
+        grad_lines = _run(ctx.mode, 1, grad.contiguous(), *ctx.saved_tensors)
+        return (None, *grad_lines, None, None, None)
+
+
+def line_prod(lines, gindx_s, gindx_l, gweight_s, gweight_l, tensoRF_id, mode="fused"):
+    # lines: the 3 line parameters of one level, [n_tensoRF, n_comp, res_i]; returns [M, n_comp]
+    if mode == "eager" or gweight_s.requires_grad or gweight_l.requires_grad:
+        return eager_line_prod(lines, gindx_s, gindx_l, gweight_s, gweight_l, tensoRF_id)
+    if mode == "compile" and lines[0].device.type != "cuda":
+        mode = "fused"
+    gindx = torch.stack([gindx_s, gindx_l], dim=-1).long()
+    weight = torch.stack([gweight_s, gweight_l], dim=-1).to(lines[0].dtype)
+    return LineProd.apply(mode, *[line.contiguous() for line in lines], tensoRF_id.long(), gindx, weight)
@@ -0,0 +1,92 @@
+import torch
+from . import cpu_kernels
+
+''' Empty space skipping for the coverage sampler (--skip_empty 1)
+OccupancyPyramid: the coverage filter (dense bool or cpu_kernels.SparseCvrg) and its 2x max pooled levels up to a
+    single cell. any_in_box answers "is any fine cell in [lo, hi] covered" with at most 8 lookups, in the finest
+    level where the box spans no more than 2 cells per axis (conservative, never misses a covered cell).
+sample_pts_on_rays_pyramid: same outputs as sample_pts_on_rays_cvrg with use_mask applied. Every ray's uniform steps are
+    grouped into blocks of --skip_block steps; a block whose segment bbox hits no covered cell is dropped, the others
+    are halved and tested again one level finer, until single steps get the exact cell test of the uniform sampler.
+    Work follows the occupied part of the ray instead of its length in the aabb. The kept points, ray and step ids are
+    the ones the uniform sampler keeps (bitwise those of the cpu_kernels reference). Pure pytorch, runs on cpu and cuda.
+'''
+
+
+class OccupancyPyramid:
+    def __init__(self, cvrg):
+        self.levels = [cvrg]
+        self.dims = [torch.as_tensor(list(cvrg.shape[:3]))]
+        while (self.dims[-1] > 1).any():
+            self.levels.append(self.pool(self.levels[-1], self.dims[-1]))
+            self.dims.append((self.dims[-1] + 1) // 2)
+        self.dims = [dims.to(cvrg.device) for dims in self.dims]
+
+    @staticmethod
+    def pool(cvrg, dims):
+        # cells of the next level cover 2x2x2 cells of this one
+        new_dims = (dims + 1) // 2
+        if isinstance(cvrg, cpu_kernels.SparseCvrg):
+            keys = cvrg.keys.long()
+            ijk = torch.stack([keys // (dims[1] * dims[2]), keys // dims[2] % dims[1], keys % dims[2]], dim=-1) // 2
+            return cpu_kernels.SparseCvrg(torch.unique(cpu_kernels._flat_ind(ijk, new_dims.to(keys.device))), new_dims.tolist())
+        pad = (dims % 2).tolist()
+        occ = torch.nn.functional.pad(cvrg.view(dims.tolist()).to(torch.uint8), (0, pad[2], 0, pad[1], 0, pad[0]))
+        X, Y, Z = new_dims.tolist()
+        return occ.view(X, 2, Y, 2, Z, 2).amax(dim=(1, 3, 5)).bool().contiguous()
+
+    def any_in_box(self, lo, hi):
+        # lo, hi: [B, 3] fine cell indices, clamped to the grid
+        level = torch.full([len(lo)], len(self.levels) - 1, dtype=torch.int64, device=lo.device)
+        for l in range(len(self.levels) - 2, -1, -1):
+            level = torch.where((((hi >> l) - (lo >> l)) <= 1).all(-1), torch.full_like(level, l), level)
+        hit = torch.zeros([len(lo)], dtype=torch.bool, device=lo.device)
+        for l in range(len(self.levels)):
+            sel = torch.nonzero(level == l)[..., 0]
+            if len(sel) == 0:
+                continue
+            base, top = lo[sel] >> l, hi[sel] >> l
+            found = torch.zeros([len(sel)], dtype=torch.bool, device=lo.device)
+            for corner in range(8):
+                offset = torch.as_tensor([(corner >> 2) & 1, (corner >> 1) & 1, corner & 1], device=lo.device)
+                ijk = torch.minimum(base + offset, top)
+                found |= cpu_kernels._cvrg_mask(self.levels[l], cpu_kernels._flat_ind(ijk, self.dims[l]))
+            hit[sel] = found
+        return hit
+
+
+def sample_pts_on_rays_pyramid(rays_o, rays_d, pyramid, units, xyz_min, xyz_max, near, far, stepdist, block=64):
+    grid_size = pyramid.dims[0]
+    t_min, t_max = cpu_kernels.infer_t_minmax(rays_o, rays_d, xyz_min, xyz_max, near, far)
+    N_steps = torch.clamp(torch.ceil((t_max - t_min) / stepdist), min=1).long()
+    rays_start = rays_o + rays_d * t_min[:, None]
+    rays_dir = rays_d / torch.norm(rays_d, dim=-1, keepdim=True)
+
+    def points(ray_id, step_id):
+        return rays_start[ray_id] + rays_dir[ray_id] * (stepdist * step_id.to(rays_o.dtype))[:, None]
+
+    def cell(pts):
+        return torch.minimum(torch.clamp(cpu_kernels._grid_ind(pts, xyz_min, units), min=0), grid_size - 1)
+
+    size = 1 << max(0, int(block) - 1).bit_length()
+    ray_id, blk, _ = cpu_kernels._segment_pos((N_steps + size - 1) // size)
+    first = blk * size
+    count = torch.minimum(N_steps[ray_id] - first, torch.full_like(first, size))
+    while size > 1:
+        # points move monotonically along the ray, so the cells of a block lie in the box of its end cells
+        lo, hi = cell(points(ray_id, first)), cell(points(ray_id, first + count - 1))
+        keep = torch.nonzero(pyramid.any_in_box(torch.minimum(lo, hi), torch.maximum(lo, hi)))[..., 0]
+        ray_id, first, count = ray_id[keep], first[keep], count[keep]
+        size //= 2
+        # halves in order, the second one only where the block is longer than size
+        ray_id = torch.stack([ray_id, ray_id], dim=-1).view(-1)
+        count = torch.stack([torch.clamp(count, max=size), count - size], dim=-1).view(-1)
+        first = torch.stack([first, first + size], dim=-1).view(-1)
+        valid = count > 0
+        ray_id, first, count = ray_id[valid], first[valid], count[valid]
+
+    step_id = first
+    ray_pts = points(ray_id, step_id)
+    in_bound = torch.all((ray_pts >= xyz_min) & (ray_pts <= xyz_max), dim=-1)
+    mask_valid = in_bound & cpu_kernels._cvrg_mask(pyramid.levels[0], cpu_kernels._flat_ind(cell(ray_pts), grid_size))
+    return ray_pts[mask_valid], ray_id[mask_valid], step_id[mask_valid], N_steps, t_min, t_max
@@ -0,0 +1,165 @@
+import os
+import numpy as np
+import torch
+import torch.distributed as dist
+from . import cpu_kernels
+
+''' Multi-process training
+    torchrun --nproc_per_node N train_hier.py --config ... --distributed 1 [--model_parallel 1] [--dist_backend gloo]
+data parallel (default): every rank keeps a full replica of the model, including the coverage maps, and renders its share
+    (batch_size // world_size rays) of the same global batch. Gradients are averaged with bucketed all_reduce
+    after backward, so with identical initial weights the replicas take identical optimizer steps.
+model parallel: the tensoRFs of every level are split into spatial bricks (SpatialBricks), each rank keeps only the
+    lines and coverage maps of its own brick. All ranks march the same rays; the weighted feature sums and weight sums of
+    agg_tensoRF_at_samples are summed over ranks before normalizing, so the scene size grows with the number of ranks.
+gloo runs on CPU, nccl (default with cuda) on GPUs.
+'''
+BUCKET_NUMEL = 2 ** 24
+# per-tensoRF parameters, split by SpatialBricks instead of replicated
+PARTITIONED = ("density_line", "app_line", "theta_line", "phi_line", "pnt_rot")
+
+
+def init_distributed(args):
+    # (rank, world_size); single process unless --distributed 1 and launched by torchrun
+    if args.distributed <= 0 or int(os.environ.get("WORLD_SIZE", 1)) <= 1:
+        return 0, 1
+    use_cuda = torch.cuda.is_available() and args.kernel_backend != "cpu"
+    backend = args.dist_backend if args.dist_backend is not None else ("nccl" if use_cuda else "gloo")
+    if use_cuda:
+        torch.cuda.set_device(int(os.environ.get("LOCAL_RANK", 0)) % torch.cuda.device_count())
+    dist.init_process_group(backend=backend)
+    print("rank {} of {} ({})".format(dist.get_rank(), dist.get_world_size(), backend))
+    return dist.get_rank(), dist.get_world_size()
+
+
+def get_world_size():
+    return dist.get_world_size() if dist.is_available() and dist.is_initialized() else 1
+
+
+def is_main():
+    return get_world_size() == 1 or dist.get_rank() == 0
+
+
+def barrier():
+    if get_world_size() > 1:
+        dist.barrier()
+
+
+class ShardedSampler:
+    # SimpleSampler over the same permutation on every rank (own seeded RandomState), each rank takes a strided slice of the batch
+    def __init__(self, total, batch, rank=0, world_size=1, seed=0):
+        self.total = total
+        self.batch = batch
+        self.rank = rank
+        self.world_size = world_size
+        self.curr = total
+        self.ids = None
+        self.rng = np.random.RandomState(seed)
+
+    def nextids(self):
+        self.curr+=self.batch
+        if self.curr + self.batch > self.total:
+            self.ids = torch.LongTensor(self.rng.permutation(self.total))
+            self.curr = 0
+        return self.ids[self.curr+self.rank:self.curr+self.batch:self.world_size]
+
+
+def seed_all(seed):
+    # same random stream on every rank, model parallel ranks must draw the same ray jitter and background
+    torch.manual_seed(seed)
+    np.random.seed(seed)
+
+
+def shared_parameters(module):
+    return [param for name, param in module.named_parameters() if not name.startswith(PARTITIONED)]
+
+
+@torch.no_grad()
+def broadcast_parameters(params, src=0):
+    if get_world_size() == 1:
+        return
+    for param in params:
+        dist.broadcast(param.data, src)
+
+
+@torch.no_grad()
+def average_gradients(params):
+    world_size = get_world_size()
+    if world_size == 1:
+        return
+    params = [param for param in params if param.requires_grad]
+    if len(params) == 0:
+        return
+    # a param may have no grad on some ranks (set_to_none, no ray hit its tensoRFs): agree on which ones to reduce
+    has_grad = torch.as_tensor([param.grad is not None for param in params], dtype=torch.float32, device=params[0].device)
+    dist.all_reduce(has_grad)
+    grads = []
+    for param, flag in zip(params, has_grad.tolist()):
+        if flag > 0:
+            if param.grad is None:
+                param.grad = torch.zeros_like(param)
+            grads.append(param.grad)
+
+    bucket, numel = [], 0
+    for i, grad in enumerate(grads):
+        bucket.append(grad)
+        numel += grad.numel()
+        if numel >= BUCKET_NUMEL or i == len(grads) - 1:
+            flat = torch.cat([g.reshape(-1) for g in bucket])
+            dist.all_reduce(flat)
+            flat /= world_size
+            offset = 0
+            for g in bucket:
+                g.copy_(flat[offset:offset + g.numel()].view_as(g))
+                offset += g.numel()
+            bucket, numel = [], 0
+
+
+class _ReduceSum(torch.autograd.Function):
+    # sum of the partial results of all ranks. What follows is computed identically on every rank,
+    # so each rank already holds the full gradient of the sum: backward is the identity, not another all_reduce
+    @staticmethod
+    def forward(ctx, tensor):
+        tensor = tensor.clone()
+        dist.all_reduce(tensor)
+        return tensor
+
+    @staticmethod
+    def backward(ctx, grad):
+        return grad
+
+
+class SpatialBricks:
+    ''' Spatial partition of the tensoRFs for model parallelism
+    Every level's points are cut into world_size slabs along the longest axis of the aabb, at the count quantiles
+    of that level, so each rank owns about 1 / world_size of the tensoRFs. geo is identical on all ranks,
+    hence so are the cuts. The top K_tensoRF / KNN selection runs per brick, so a sample near a cut may aggregate
+    up to K tensoRFs from each side.
+    '''
+    def __init__(self, aabb):
+        self.rank = dist.get_rank()
+        self.world_size = get_world_size()
+        self.axis = int(torch.argmax(aabb[1] - aabb[0]))
+
+    def owned(self, xyz):
+        coord = xyz[..., self.axis].contiguous()
+        if len(coord) == 0:
+            return torch.zeros_like(coord, dtype=torch.bool)
+        cuts = torch.sort(coord)[0][[len(coord) * r // self.world_size for r in range(1, self.world_size)]].contiguous()
+        return torch.searchsorted(cuts, coord, right=True) == self.rank
+
+    def own(self, geo):
+        return [geo_lvl[self.owned(geo_lvl[..., :3])] for geo_lvl in geo]
+
+    def reduce(self, tensor):
+        return _ReduceSum.apply(tensor)
+
+    def union_cvrg(self, cvrg):
+        # coverage of one level over all bricks, in a form create_sample_map can merge across levels
+        if isinstance(cvrg, cpu_kernels.SparseCvrg):
+            keys = [None] * self.world_size
+            dist.all_gather_object(keys, cvrg.keys.cpu())
+            return cpu_kernels.SparseCvrg(torch.unique(torch.cat(keys)).to(cvrg.device), cvrg.shape)
+        covered = (cvrg >= 0).to(torch.uint8)
+        dist.all_reduce(covered, op=dist.ReduceOp.MAX)
+        return covered.to(torch.int8) - 1
@@ -180,27 +180,16 @@ class PointTensorBase(TensorBase):
     @torch.no_grad()
     def updateAlphaMask(self):
         gridSize = self.gridSize
-        alpha, dense_xyz = self.getDenseAlpha(gridSize)
-        dense_xyz = dense_xyz.transpose(0, 2).contiguous()
-        alpha = alpha.clamp(0, 1).transpose(0, 2).contiguous()[None, None]
         total_voxels = gridSize[0] * gridSize[1] * gridSize[2]
-
-        ks = 3
-        alpha = F.max_pool3d(alpha, kernel_size=ks, padding=ks // 2, stride=1).view((gridSize[2], gridSize[1], gridSize[0])) #.view(gridSize[::-1])
-        alpha[alpha >= self.alphaMask_thres] = 1
-        alpha[alpha < self.alphaMask_thres] = 0
-
+        pnt_rmatrix = None if self.args.rot_init is None else self.rot2m(self.pnt_rot)
+        # occupancy of the covered / previously masked cells only, in batches of --alpha_batch cells
+        batch = getattr(self.args, "alpha_batch", 1 << 22)
+        candidates = candidate_cells(self.aabb, gridSize, self.tensoRF_cvrg_inds >= 0 if self.args.tensoRF_shape == "cube" and self.args.rot_init is None else None, self.units, prior=self.alphaMask, batch=batch)
+        alpha, new_aabb = occupancy_grid(lambda xyz: self.compute_alpha(xyz, self.stepSize, pnt_rmatrix), self.aabb, gridSize, self.alphaMask_thres, batch=batch, candidates=candidates)
         self.alphaMask = AlphaGridMask(self.device, self.aabb, alpha, mask_cache_thres=self.alphaMask_thres)
 
-        valid_xyz = dense_xyz[alpha > 0.5]
-
-        xyz_min = valid_xyz.amin(0)
-        xyz_max = valid_xyz.amax(0)
-
-        new_aabb = torch.stack((xyz_min, xyz_max))
-
         total = torch.sum(alpha)
-        print(f"bbox: {xyz_min, xyz_max} alpha rest %%%f" % (total / total_voxels * 100))
+        print(f"bbox: {new_aabb} alpha rest %%%f" % (total / total_voxels * 100))
         return new_aabb
 
 
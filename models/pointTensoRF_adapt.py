@@ -7,6 +7,7 @@ import time
 import os
 from torch_scatter import segment_coo
 from .apparatus import *
+from .sample_budget import SampleBudget
 from .tensorBase import TensorBase
 from tqdm import tqdm
 import math, time, copy, itertools
@@ -30,6 +31,7 @@ class PointTensorBase_adapt(TensorBase):
 
         self.args = args
         self.lvl = len(args.local_unit)
+        self.sample_budget = SampleBudget(args.sample_budget) if getattr(args, "sample_budget", 0) > 0 else None
         self.density_n_comp = density_n_comp
         self.app_n_comp = appearance_n_comp
         self.app_dim = app_dim
@@ -86,10 +88,7 @@ class PointTensorBase_adapt(TensorBase):
         super(PointTensorBase_adapt, self).save(path+".th")
         info = {}
         if self.alphaMask is not None:
-            alpha_volume = self.alphaMask.alpha_volume.bool().cpu().numpy()
-            info.update({'alphaMask.shape':alpha_volume.shape})
-            info.update({'alphaMask.mask':np.packbits(alpha_volume.reshape(-1))})
-            info.update({'alphaMask.aabb': self.alphaMask.aabb.cpu().numpy()})
+            info.update(self.alphaMask.checkpoint_fields())
         info.update({
             'geo_xyz': [self.geo_xyz[l].cpu().numpy() for l in range(self.lvl)],
             'box_length': self.box_length,
@@ -115,9 +114,7 @@ class PointTensorBase_adapt(TensorBase):
         # create grid of scene, update voxel units
         super(PointTensorBase_adapt, self).load(ckpt)
         if 'alphaMask.aabb' in info.keys():
-            length = np.prod(info['alphaMask.shape'])
-            alpha_volume = torch.from_numpy(np.unpackbits(info['alphaMask.mask'])[:length].reshape(info['alphaMask.shape']))
-            self.alphaMask = AlphaGridMask(self.device, torch.as_tensor(info['alphaMask.aabb'], device=self.device), alpha_volume.float().to(self.device), mask_cache_thres=self.alphaMask_thres)
+            self.alphaMask = AlphaGridMask.from_checkpoint(self.device, info, mask_cache_thres=self.alphaMask_thres)
         self.update_stepSize(self.local_dims)
 
 
@@ -305,28 +302,16 @@ class PointTensorBase_adapt(TensorBase):
     @torch.no_grad()
     def updateAlphaMask(self):
         gridSize = self.gridSize
-        alpha, dense_xyz = self.getDenseAlpha(gridSize)
-        dense_xyz = dense_xyz.transpose(0, 2).contiguous()
-        alpha = alpha.clamp(0, 1).transpose(0, 2).contiguous()[None, None]
         total_voxels = gridSize[0] * gridSize[1] * gridSize[2]
-
-        ks = 3
-        alpha = F.max_pool3d(alpha, kernel_size=ks, padding=ks // 2, stride=1).view((gridSize[2], gridSize[1], gridSize[0]))
-        alpha[alpha >= self.alphaMask_thres] = 1
-        alpha[alpha < self.alphaMask_thres] = 0
-
+        pnt_rmatrix = None if self.args.rot_init is None else self.pnt_rmatrix
+        # occupancy of the covered / previously masked cells only, in batches of --alpha_batch cells
+        batch = getattr(self.args, "alpha_batch", 1 << 22)
+        candidates = candidate_cells(self.aabb, gridSize, self.tensoRF_cvrg_filter if self.args.tensoRF_shape == "cube" else None, self.units, prior=self.alphaMask, batch=batch)
+        alpha, new_aabb = occupancy_grid(lambda xyz: self.compute_alpha(xyz, pnt_rmatrix, self.stepSize), self.aabb, gridSize, self.alphaMask_thres, batch=batch, candidates=candidates)
         self.alphaMask = AlphaGridMask(self.device, self.aabb, alpha, mask_cache_thres=self.alphaMask_thres)
 
-        valid_xyz = dense_xyz[alpha > 0.5]
-
-        xyz_min = valid_xyz.amin(0)
-        xyz_max = valid_xyz.amax(0)
-
-        new_aabb = torch.stack((xyz_min, xyz_max))
-
         total = torch.sum(alpha)
-        print(f"bbox: {xyz_min, xyz_max} alpha rest %%%f" % (total / total_voxels * 100))
-
+        print(f"bbox: {new_aabb} alpha rest %%%f" % (total / total_voxels * 100))
         return new_aabb
 
 
@@ -555,7 +540,11 @@ class PointTensorBase_adapt(TensorBase):
                     step_id = step_id[mask]
         # ################ if all samplings are filtered, return background value
         if ray_id is None or len(ray_id) == 0 or not mask_any:
+            if is_train and self.sample_budget is not None:
+                self.sample_budget.skip(N)
             return torch.full([N, 3], 1.0 if (white_bg or (is_train and torch.rand((1,)) < 0.5)) else 0.0, device="cuda", dtype=torch.float32), rays_chunk[..., -1].detach(), None, None, None
+        if is_train and self.sample_budget is not None:
+            xyz_sampled, ray_id, step_id = self.sample_budget.limit(xyz_sampled, ray_id, step_id if return_depth else None, N)
 
         # local_gindx_s: small indices of xyz axes;
         # local_gindx_l: large index of xyz axes;
@@ -576,23 +565,9 @@ class PointTensorBase_adapt(TensorBase):
         mask = weights > self.rayMarch_weight_thres
 
         ################ if we has no positive in mask, then masking will throw error, if has no negative in mask, don't need masking
-        if mask.any() and (~mask).any():
-            if return_depth:
-                step_id = step_id[mask]
-                alpha = alpha[mask]
-            weights = weights[mask]
-            ray_id = ray_id[mask]
-            holder = torch.zeros((len(mask)), device=mask.device, dtype=torch.int64)
-            holder[mask] = torch.arange(0, torch.sum(mask).cpu().item(), device=mask.device, dtype=torch.int64)
-            for l in range(self.lvl):
-                tensor_mask = mask[agg_id[l]]
-                agg_id[l] = holder[agg_id[l][tensor_mask]]
-                tensoRF_id[l] = tensoRF_id[l][tensor_mask]
-                local_gindx_s[l] = local_gindx_s[l][tensor_mask]
-                local_gindx_l[l] = local_gindx_l[l][tensor_mask]
-                local_gweight_s[l] = local_gweight_s[l][tensor_mask]
-                local_gweight_l[l] = local_gweight_l[l][tensor_mask]
-                local_kernel_dist[l] = local_kernel_dist[l][tensor_mask]
+        records = SampleRecords.from_levels(local_gindx_s=local_gindx_s, local_gindx_l=local_gindx_l, local_gweight_s=local_gweight_s, local_gweight_l=local_gweight_l, local_kernel_dist=local_kernel_dist, tensoRF_id=tensoRF_id, agg_id=agg_id)
+        records, (weights, ray_id, step_id, alpha) = records.prune(mask, weights, ray_id, step_id if return_depth else None, alpha if return_depth else None)
+        local_gindx_s, local_gindx_l, local_gweight_s, local_gweight_l, local_kernel_dist, tensoRF_id, agg_id = records.levels("local_gindx_s", "local_gindx_l", "local_gweight_s", "local_gweight_l", "local_kernel_dist", "tensoRF_id", "agg_id")
 
         #  ################compute radiance color on shading points
         app_features = self.compute_appfeature_geo(local_gindx_s, local_gindx_l, local_gweight_s, local_gweight_l, local_kernel_dist, tensoRF_id, agg_id, sample_num=len(ray_id), dir_gindx_s=dir_gindx_s, dir_gindx_l=dir_gindx_l, dir_gweight_l=dir_gweight_l)
@@ -676,44 +651,31 @@ class PointTensorCP_adapt(PointTensorBase_adapt):
         return torch.nn.ParameterList(line_coef).to(device)
 
     def mask_one_svd(self, lines, local_dims, cumsum_dims, mask):
+        # rows of the kept boxes, in the order of dim_cumsum_counter
         line_coef = []
         for l in range(self.lvl):
             for dim in range(3):
-                line = []
-                for i in range(len(self.geo_xyz[l])):
-                    if mask[l][i] > 0:
-                        start = cumsum_dims[l][i, dim]
-                        leng = local_dims[l][i, dim]
-                        line.append(lines[3*l+dim][start:start+leng+1,:])
-                line = torch.cat(line)
-                line_coef.append(torch.nn.Parameter(line))
+                row_mask = torch.repeat_interleave(mask[l].to(lines[3*l+dim].device), (local_dims[l][:, dim] + 1).long())
+                line_coef.append(torch.nn.Parameter(lines[3*l+dim][row_mask]))
         return torch.nn.ParameterList(line_coef).to(self.device)
 
     def upsample_one_svd(self, lines, local_range, local_dims):
-
+        # resample every box's segment to its new local_dims in one pass over all boxes (ragged_arange)
         line_coef = []
         for l in range(self.lvl):
             # cur_unit = self.args.local_unit[l][self.up_stage]
             pre_unit = self.args.local_unit[l][self.up_stage - 1]
             for dim in range(3):
-                local_gindx_s = []
-                local_gindx_l = []
-                local_gweight_l = []
-                local_gweight_s = []
-                for i in range(len(self.geo_xyz[l])):
-                    cur_pos = torch.linspace(-local_range[l][i,dim], local_range[l][i,dim], steps=local_dims[l][i,dim]+1, device=self.device)
-                    soft_inds = torch.minimum(torch.maximum((cur_pos + self.local_range[l][i,dim]) / pre_unit, torch.as_tensor(0.0, dtype=torch.float32, device=self.device)), self.local_dims[l][i, dim])
-                    inds = torch.minimum(torch.maximum(torch.floor(soft_inds).to(torch.int64), torch.as_tensor(0, dtype=torch.int64, device=self.device)), self.local_dims[l][i,dim]-1)
-                    local_gindx_s.append(inds + self.dim_cumsum_counter[l][i, dim].long())
-                    local_gindx_l.append(local_gindx_s[-1] + 1)
-                    local_gweight_l.append(soft_inds - inds)
-                    local_gweight_s.append(1.0 - local_gweight_l[-1])
-
-                    # print("local_gindx_s_lst", self.local_dims[l][i,dim], local_gindx_s_lst[-1].shape, local_gindx_s_lst[-1].min(), local_gindx_s_lst[-1].max(), local_gweight_l_lst[-1].shape, local_gweight_l_lst[-1].min(), local_gweight_l_lst[-1].max())
-                local_gindx_s = torch.cat(local_gindx_s)
-                local_gindx_l = torch.cat(local_gindx_l)
-                local_gweight_l = torch.cat(local_gweight_l)[:,None]
-                local_gweight_s = torch.cat(local_gweight_s)[:,None]
+                steps = local_dims[l][:, dim] + 1
+                box, pos = ragged_arange(steps)
+                cur_pos = ragged_linspace(-local_range[l][:, dim], local_range[l][:, dim], steps, box, pos)
+                pre_dims = self.local_dims[l][box, dim]
+                soft_inds = torch.minimum(torch.maximum((cur_pos + self.local_range[l][box, dim]) / pre_unit, torch.as_tensor(0.0, dtype=torch.float32, device=self.device)), pre_dims)
+                inds = torch.minimum(torch.maximum(torch.floor(soft_inds).to(torch.int64), torch.as_tensor(0, dtype=torch.int64, device=self.device)), pre_dims - 1)
+                local_gindx_s = inds + self.dim_cumsum_counter[l][box, dim].long()
+                local_gindx_l = local_gindx_s + 1
+                local_gweight_l = (soft_inds - inds)[:, None]
+                local_gweight_s = 1.0 - local_gweight_l
                 line_coef.append(torch.nn.Parameter(lines[3*l+dim][local_gindx_s] * local_gweight_s + lines[3*l+dim][local_gindx_l] * local_gweight_l))
         return torch.nn.ParameterList(line_coef).to(self.device)
 
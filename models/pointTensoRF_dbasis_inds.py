@@ -75,10 +75,7 @@ class PointTensorBase_dbasis(TensorBase):
         super(PointTensorBase_dbasis, self).save(path+".th")
         info = {}
         if self.alphaMask is not None:
-            alpha_volume = self.alphaMask.alpha_volume.bool().cpu().numpy()
-            info.update({'alphaMask.shape':alpha_volume.shape})
-            info.update({'alphaMask.mask':np.packbits(alpha_volume.reshape(-1))})
-            info.update({'alphaMask.aabb': self.alphaMask.aabb.cpu().numpy()})
+            info.update(self.alphaMask.checkpoint_fields())
         info.update({
             'geo_xyz': [self.geo_xyz[l].cpu().numpy() for l in range(self.lvl)],
             'local_range': [self.local_range[l].cpu().numpy() for l in range(self.lvl)],
@@ -98,9 +95,7 @@ class PointTensorBase_dbasis(TensorBase):
         # create grid of scene, update voxel units
         super(PointTensorBase_adapt, self).load(ckpt)
         if 'alphaMask.aabb' in info.keys():
-            length = np.prod(info['alphaMask.shape'])
-            alpha_volume = torch.from_numpy(np.unpackbits(info['alphaMask.mask'])[:length].reshape(info['alphaMask.shape']))
-            self.alphaMask = AlphaGridMask(self.device, torch.as_tensor(info['alphaMask.aabb'], device=self.device), alpha_volume.float().to(self.device), mask_cache_thres=self.alphaMask_thres)
+            self.alphaMask = AlphaGridMask.from_checkpoint(self.device, info, mask_cache_thres=self.alphaMask_thres)
         self.update_stepSize(self.local_dims)
 
     def update_stepSize(self, local_dims):
@@ -265,28 +260,15 @@ class PointTensorBase_dbasis(TensorBase):
     @torch.no_grad()
     def updateAlphaMask(self):
         gridSize = self.gridSize
-        alpha, dense_xyz = self.getDenseAlpha(gridSize)
-        dense_xyz = dense_xyz.transpose(0, 2).contiguous()
-        alpha = alpha.clamp(0, 1).transpose(0, 2).contiguous()[None, None]
         total_voxels = gridSize[0] * gridSize[1] * gridSize[2]
-
-        ks = 3
-        alpha = F.max_pool3d(alpha, kernel_size=ks, padding=ks // 2, stride=1).view((gridSize[2], gridSize[1], gridSize[0]))
-        alpha[alpha >= self.alphaMask_thres] = 1
-        alpha[alpha < self.alphaMask_thres] = 0
-
+        # occupancy of the covered / previously masked cells only, in batches of --alpha_batch cells
+        batch = getattr(self.args, "alpha_batch", 1 << 22)
+        candidates = candidate_cells(self.aabb, gridSize, self.tensoRF_cvrg_filter if self.args.tensoRF_shape == "cube" else None, self.units, prior=self.alphaMask, batch=batch)
+        alpha, new_aabb = occupancy_grid(lambda xyz: self.compute_alpha(xyz, self.stepSize, self.pnt_rmatrix), self.aabb, gridSize, self.alphaMask_thres, batch=batch, candidates=candidates)
         self.alphaMask = AlphaGridMask(self.device, self.aabb, alpha, mask_cache_thres=self.alphaMask_thres)
 
-        valid_xyz = dense_xyz[alpha > 0.5]
-
-        xyz_min = valid_xyz.amin(0)
-        xyz_max = valid_xyz.amax(0)
-
-        new_aabb = torch.stack((xyz_min, xyz_max))
-
         total = torch.sum(alpha)
-        print(f"bbox: {xyz_min, xyz_max} alpha rest %%%f" % (total / total_voxels * 100))
-
+        print(f"bbox: {new_aabb} alpha rest %%%f" % (total / total_voxels * 100))
         return new_aabb
 
 
@@ -456,24 +438,9 @@ class PointTensorBase_dbasis(TensorBase):
         weights, bg_weight = Alphas2Weights.apply(alpha, ray_id, N)  #
         mask = weights > self.rayMarch_weight_thres
         # print("weights",weights.shape,torch.min(weights), torch.max(weights))
-        if mask.any() and (~mask).any():
-            if return_depth:
-                step_id = step_id[mask]
-            weights = weights[mask]
-            ray_id = ray_id[mask]
-            holder = torch.zeros((len(mask)), device=mask.device, dtype=torch.int64)
-            holder[mask] = torch.arange(0, torch.sum(mask).cpu().item(), device=mask.device, dtype=torch.int64)
-            for l in range(self.lvl):
-                tensor_mask = mask[agg_id[l]]
-                agg_id[l] = holder[agg_id[l][tensor_mask]]
-                tensoRF_id[l] = tensoRF_id[l][tensor_mask]
-                local_gindx_s[l] = local_gindx_s[l][tensor_mask]
-                local_gindx_l[l] = local_gindx_l[l][tensor_mask]
-                local_gweight_s[l] = local_gweight_s[l][tensor_mask]
-                local_gweight_l[l] = local_gweight_l[l][tensor_mask]
-                local_kernel_dist[l] = local_kernel_dist[l][tensor_mask]
-                if local_norm_xyz is not None:
-                    local_norm_xyz[l] = local_norm_xyz[l][tensor_mask]
+        records = SampleRecords.from_levels(local_gindx_s=local_gindx_s, local_gindx_l=local_gindx_l, local_gweight_s=local_gweight_s, local_gweight_l=local_gweight_l, local_kernel_dist=local_kernel_dist, tensoRF_id=tensoRF_id, agg_id=agg_id, local_norm_xyz=local_norm_xyz)
+        records, (weights, ray_id, step_id) = records.prune(mask, weights, ray_id, step_id if return_depth else None)
+        local_gindx_s, local_gindx_l, local_gweight_s, local_gweight_l, local_kernel_dist, tensoRF_id, agg_id, local_norm_xyz = records.levels("local_gindx_s", "local_gindx_l", "local_gweight_s", "local_gweight_l", "local_kernel_dist", "tensoRF_id", "agg_id", "local_norm_xyz")
         app_features = self.compute_appfeature_geo(local_gindx_s, local_gindx_l, local_gweight_s, local_gweight_l, local_kernel_dist, tensoRF_id, agg_id, local_norm_xyz, sample_num=len(ray_id), dir_gindx_s=dir_gindx_s, dir_gindx_l=dir_gindx_l, dir_gweight_l=dir_gweight_l)
         rgb = self.renderModule(None, viewdirs[ray_id], app_features)
         # print("rgb",rgb.shape, torch.max(rgb,dim=0)[0])
@@ -7,16 +7,20 @@ import time
 import os
 from torch_scatter import segment_coo
 from .apparatus import *
+from .sample_budget import SampleBudget
 from .tensorBase import TensorBase
+from .parallel import SpatialBricks, get_world_size
+from .line_gather import line_prod
+from .occupancy_pyramid import OccupancyPyramid, sample_pts_on_rays_pyramid
 from tqdm import tqdm
 
 def vis_box_pca(cluster_raw_pnts, geo, pca_cluster_newpnts, cluster_raw_mean, local_ranges, args, pnt_rmatrix, sep=False, subdir="rot_tensoRF"):
     for l in range(len(geo)):
         if not sep:
-            draw_box_pca(geo[l][..., :3], None, local_ranges[l], f'{args.basedir}/{args.expname}', l+1000, args, pnt_rmatrix[l].cuda(), subdir=subdir) 
+            draw_box_pca(geo[l][..., :3], None, local_ranges[l], f'{args.basedir}/{args.expname}', l+1000, args, pnt_rmatrix[l].to(geo[l].device), subdir=subdir) 
         else:
             draw_sep_box_pca(cluster_raw_pnts[l], geo[l][..., :3], None, local_ranges[l],
-                         f'{args.basedir}/{args.expname}', l, args, pnt_rmatrix[l].cuda(), subdir=subdir)
+                         f'{args.basedir}/{args.expname}', l, args, pnt_rmatrix[l].to(geo[l].device), subdir=subdir)
 def vis_box(geo, args):
     for l in range(len(geo)):
         draw_box(geo[l][..., :3], args.local_range[l], f'{args.basedir}/{args.expname}', l)
@@ -26,8 +30,11 @@ class PointTensorBase_hier(TensorBase):
         super(TensorBase, self).__init__()
         assert geo is not None, "No geo loaded, when using pointTensorBase"
         self.args = args
-        self.geo = geo
-        self.pnt_xyz = [geo_lvl[..., :3].cuda().contiguous() for geo_lvl in self.geo]
+        # model parallel: keep only the tensoRFs of this rank's brick
+        self.bricks = SpatialBricks(aabb) if args.model_parallel > 0 and get_world_size() > 1 else None
+        self.geo = geo if self.bricks is None else self.bricks.own(geo)
+        self.pnt_xyz = [geo_lvl[..., :3].to(device).contiguous() for geo_lvl in self.geo]
+        self.sample_budget = SampleBudget(args.sample_budget) if getattr(args, "sample_budget", 0) > 0 else None
         self.density_n_comp = density_n_comp
         self.app_n_comp = appearance_n_comp
         self.app_dim = app_dim
@@ -172,16 +179,22 @@ class PointTensorBase_hier(TensorBase):
 
     def agg_tensoRF_at_samples(self, dist, agg_id, value, out=None, outweight=None):
         weights = self.agg_weight_func(dist)
-        weight_sum = segment_coo(
-            src=weights,
-            index=agg_id,
-            out=outweight,
-            reduce='sum')
-        agg_value = segment_coo(
-            src=weights * value,
-            index=agg_id,
-            out=out,
-            reduce='sum')
+        if self.bricks is not None and len(agg_id) == 0:
+            # no sample hits this rank's brick, it still takes part in the reduction
+            weight_sum, agg_value = outweight, out
+        else:
+            weight_sum = segment_coo(
+                src=weights,
+                index=agg_id,
+                out=outweight,
+                reduce='sum')
+            agg_value = segment_coo(
+                src=weights * value,
+                index=agg_id,
+                out=out,
+                reduce='sum')
+        if self.bricks is not None:
+            weight_sum, agg_value = self.bricks.reduce(weight_sum), self.bricks.reduce(agg_value)
         return agg_value / torch.clamp(weight_sum, min=1), weight_sum > 0
 
     @torch.no_grad()
@@ -258,29 +271,16 @@ class PointTensorBase_hier(TensorBase):
     @torch.no_grad()
     def updateAlphaMask(self):
         gridSize = self.gridSize
-        alpha, dense_xyz = self.getDenseAlpha(gridSize)
-        dense_xyz = dense_xyz.transpose(0, 2).contiguous()
-        alpha = alpha.clamp(0, 1).transpose(0, 2).contiguous()[None, None]
         total_voxels = gridSize[0] * gridSize[1] * gridSize[2]
-
-        ks = 3
-        alpha = F.max_pool3d(alpha, kernel_size=ks, padding=ks // 2, stride=1).view((gridSize[2], gridSize[1], gridSize[0])) #.view(gridSize[::-1])
-        alpha[alpha >= self.alphaMask_thres] = 1
-        alpha[alpha < self.alphaMask_thres] = 0
-        # alpha = alpha.to(torch.bool)
-        # print("alpha size!!!!!!!!!!!!!!!!!!!!!!!", alpha.element_size() * alpha.nelement())
+        pnt_rmatrix = None if self.args.rot_init is None else self.rot2m(self.pnt_rot)
+        # occupancy of the covered / previously masked cells only, in batches of --alpha_batch cells
+        batch = getattr(self.args, "alpha_batch", 1 << 22)
+        candidates = candidate_cells(self.aabb, gridSize, self.tensoRF_cvrg_filter, self.units, prior=self.alphaMask, batch=batch)
+        alpha, new_aabb = occupancy_grid(lambda xyz: self.compute_alpha(xyz, self.stepSize, pnt_rmatrix), self.aabb, gridSize, self.alphaMask_thres, batch=batch, candidates=candidates)
         self.alphaMask = AlphaGridMask(self.device, self.aabb, alpha, mask_cache_thres=self.alphaMask_thres)
 
-        valid_xyz = dense_xyz[alpha > 0.5]
-
-        xyz_min = valid_xyz.amin(0)
-        xyz_max = valid_xyz.amax(0)
-
-        new_aabb = torch.stack((xyz_min, xyz_max))
-
         total = torch.sum(alpha)
-        #import pdb;pdb.set_trace()
-        print(f"bbox: {xyz_min, xyz_max} alpha rest %%%f" % (total / total_voxels * 100))
+        print(f"bbox: {new_aabb} alpha rest %%%f" % (total / total_voxels * 100))
         return new_aabb
 
 
@@ -333,9 +333,13 @@ class PointTensorBase_hier(TensorBase):
                     #     torch::Tensor units,
                     #     torch::Tensor local_range,
                     #     torch::Tensor local_dims, const int max_tensoRF
-                    torch.cuda.empty_cache()
-                    torch.cuda.synchronize()           
-                    tensoRF_cvrg_inds, tensoRF_count, tensoRF_topindx = search_geo_hier_cuda.build_tensoRF_map_hier(self.pnt_xyz[l], self.gridSize, self.aabb[0], self.aabb[1], self.units, self.local_range[l], self.local_dims[l], self.max_tensoRF[l])
+                    if torch.cuda.is_available():
+                        torch.cuda.empty_cache()
+                        torch.cuda.synchronize()
+                    if self.args.sparse_cvrg > 0:
+                        tensoRF_cvrg_inds, tensoRF_count, tensoRF_topindx = cpu_kernels.build_tensoRF_map_hier(self.pnt_xyz[l], self.gridSize, self.aabb[0], self.aabb[1], self.units, self.local_range[l], self.local_dims[l], self.max_tensoRF[l], sparse=True)
+                    else:
+                        tensoRF_cvrg_inds, tensoRF_count, tensoRF_topindx = get_kernels(self.device).search_geo_hier.build_tensoRF_map_hier(self.pnt_xyz[l], self.gridSize, self.aabb[0], self.aabb[1], self.units, self.local_range[l], self.local_dims[l], self.max_tensoRF[l])
                 else:
                     print("no implementation")
                     exit()
@@ -344,16 +348,25 @@ class PointTensorBase_hier(TensorBase):
                 print("no implementation")
                 exit()
                 tensoRF_cvrg_inds, tensoRF_count, tensoRF_topindx = search_geo_cuda.build_sphere_tensoRF_map(self.pnt_xyz[l], self.gridSize, self.aabb[0], self.aabb[1], self.units, self.radiusl, self.radiush, self.local_dims[l, :3], self.max_tensoRF[l])
-            tensoRF_cvrg_inds, tensoRF_count, tensoRF_topindx = tensoRF_cvrg_inds.contiguous(), tensoRF_count.contiguous(), tensoRF_topindx.contiguous()
+            tensoRF_count, tensoRF_topindx = tensoRF_count.contiguous(), tensoRF_topindx.contiguous()
+            if torch.is_tensor(tensoRF_cvrg_inds):
+                tensoRF_cvrg_inds = tensoRF_cvrg_inds.contiguous()
             self.tensoRF_cvrg_inds.append(tensoRF_cvrg_inds)
             self.tensoRF_count.append(tensoRF_count)
             self.tensoRF_topindx.append(tensoRF_topindx)
-        torch.cuda.empty_cache()
-        torch.cuda.synchronize()
-        if self.args.filterall == 0:
-            self.tensoRF_cvrg_filter = torch.any(torch.stack(self.tensoRF_cvrg_inds, dim=-1) >= 0, dim=-1).contiguous() if len(self.tensoRF_cvrg_inds) > 0 else (self.tensoRF_cvrg_inds[0] >= 0).contiguous()
+        if torch.cuda.is_available():
+            torch.cuda.empty_cache()
+            torch.cuda.synchronize()
+        # rays are marched through the coverage of all bricks
+        cvrg_lst = self.tensoRF_cvrg_inds if self.bricks is None else [self.bricks.union_cvrg(cvrg) for cvrg in self.tensoRF_cvrg_inds]
+        if self.args.sparse_cvrg > 0:
+            self.tensoRF_cvrg_filter = cpu_kernels.merge_cvrg(cvrg_lst, all_lvl=self.args.filterall > 0)
+            print("sparse coverage: {} of {} cells occupied".format(len(self.tensoRF_cvrg_filter), self.tensoRF_cvrg_filter.shape.numel()))
+        elif self.args.filterall == 0:
+            self.tensoRF_cvrg_filter = torch.any(torch.stack(cvrg_lst, dim=-1) >= 0, dim=-1).contiguous() if len(cvrg_lst) > 0 else (cvrg_lst[0] >= 0).contiguous()
         else:
-            self.tensoRF_cvrg_filter = torch.all(torch.stack(self.tensoRF_cvrg_inds, dim=-1) >= 0, dim=-1).contiguous() if len(self.tensoRF_cvrg_inds) > 0 else (self.tensoRF_cvrg_inds[0] >= 0).contiguous()
+            self.tensoRF_cvrg_filter = torch.all(torch.stack(cvrg_lst, dim=-1) >= 0, dim=-1).contiguous() if len(cvrg_lst) > 0 else (cvrg_lst[0] >= 0).contiguous()
+        self.cvrg_pyramid = OccupancyPyramid(self.tensoRF_cvrg_filter) if getattr(self.args, "skip_empty", 0) > 0 else None
         # self.cvrg_inds_center2pnts(self.tensoRF_cvrg_inds)
         # print("tensoRF_cvrg_inds, tensoRF_count, tensoRF_topindx, max_tensoRF_count", self.tensoRF_cvrg_inds.shape, self.tensoRF_count.shape, self.tensoRF_topindx.shape, torch.max(self.tensoRF_count))
         # print("tensoRF_cvrg_inds", self.tensoRF_cvrg_inds.numel(), torch.max(self.tensoRF_cvrg_inds), torch.sum(self.tensoRF_cvrg_inds >= 0), self.tensoRF_count.shape, self.tensoRF_topindx.shape)
@@ -409,8 +422,6 @@ class PointTensorBase_hier(TensorBase):
   
                scene_center = (self.aabb[0] + self.aabb[1]) * 0.5
                scene_radius = (self.aabb[1] - self.aabb[0]) * 0.5
-               #scene_center = torch.tensor([0.0046, -0.1786,  0.4006]).cuda()
-               #scene_radius = torch.tensor([0.7347, 0.7347, 0.7347]).cuda()
 
                rays_o_aft = (rays_o - scene_center) / scene_radius
                rays_d_aft = rays_d / rays_d.norm(dim=-1, keepdim=True)
@@ -447,12 +458,12 @@ class PointTensorBase_hier(TensorBase):
                #exit()
               
                    
-               ray_id = torch.arange(ray_pts.shape[:2][0]).view(-1,1).expand(ray_pts.shape[:2]).flatten().cuda()
-               step_id = torch.arange(ray_pts.shape[:2][1]).view(1,-1).expand(ray_pts.shape[:2]).flatten().cuda()
+               ray_id = torch.arange(ray_pts.shape[:2][0]).view(-1,1).expand(ray_pts.shape[:2]).flatten().to(rays_o.device)
+               step_id = torch.arange(ray_pts.shape[:2][1]).view(1,-1).expand(ray_pts.shape[:2]).flatten().to(rays_o.device)
                
-               ray_pts = ray_pts.reshape(-1,3).cuda()
-               t_min = torch.zeros_like(ray_id).cuda()
-               mask_valid = torch.ones_like(step_id,dtype=torch.bool).cuda()
+               ray_pts = ray_pts.reshape(-1,3).to(rays_o.device)
+               t_min = torch.zeros_like(ray_id)
+               mask_valid = torch.ones_like(step_id,dtype=torch.bool)
                stepSize = 0.02
 
  
@@ -482,8 +493,12 @@ class PointTensorBase_hier(TensorBase):
                
 
                
+            elif self.cvrg_pyramid is not None and use_mask:
+               # covered steps only, already masked
+               ray_pts, ray_id, step_id, N_steps, t_min, t_max = sample_pts_on_rays_pyramid(rays_o, rays_d, self.cvrg_pyramid, self.units, self.aabb[0], self.aabb[1], near, far, self.stepSize, block=self.args.skip_block)
+               mask_valid = None
             else:
-               ray_pts, mask_valid, ray_id, step_id, N_steps, t_min, t_max = search_geo_cuda.sample_pts_on_rays_cvrg(rays_o, rays_d, self.tensoRF_cvrg_filter, self.units, self.aabb[0], self.aabb[1], near, far, self.stepSize)
+               ray_pts, mask_valid, ray_id, step_id, N_steps, t_min, t_max = get_kernels(self.device, self.tensoRF_cvrg_filter).search_geo.sample_pts_on_rays_cvrg(rays_o, rays_d, self.tensoRF_cvrg_filter, self.units, self.aabb[0], self.aabb[1], near, far, self.stepSize)
                
         elif self.args.tensoRF_shape == "sphere":
             print("no implementation")
@@ -494,7 +509,7 @@ class PointTensorBase_hier(TensorBase):
             ray_pts, mask_valid, ray_id, step_id, N_steps, t_min, t_max = search_geo_cuda.sample_pts_on_rays_sphere_cvrg(rays_o, rays_d, self.pnt_xyz, self.tensoRF_cvrg_inds, self.tensoRF_count, self.tensoRF_topindx, self.units, self.radiusl, self.radiush, self.aabb[0], self.aabb[1], near, far, self.stepSize)
 
         
-        if use_mask:
+        if use_mask and mask_valid is not None:
             ray_pts = ray_pts[mask_valid]
             ray_id = ray_id[mask_valid]
             step_id = step_id[mask_valid]
@@ -506,7 +521,7 @@ class PointTensorBase_hier(TensorBase):
     def filter_xyz_cvrg(self, xyz_sampled, pnt_rmatrix=None):
         if self.args.tensoRF_shape == "cube":
             if self.args.rot_init is None:
-                mask = search_geo_cuda.filter_xyz_cvrg(xyz_sampled.contiguous(), self.aabb[0], self.aabb[1], self.units, self.tensoRF_cvrg_filter)
+                mask = get_kernels(self.device, self.tensoRF_cvrg_filter).search_geo.filter_xyz_cvrg(xyz_sampled.contiguous(), self.aabb[0], self.aabb[1], self.units, self.tensoRF_cvrg_filter)
             else:
                 print("no implementation")
                 exit()
@@ -523,7 +538,8 @@ class PointTensorBase_hier(TensorBase):
 
     def cvrg_inds_center2pnts(self, tensoRF_cvrg_inds):
         for l in range(self.lvl):
-            inds = torch.nonzero(tensoRF_cvrg_inds[l]>=0)
+            cvrg_inds = tensoRF_cvrg_inds[l].dense() if isinstance(tensoRF_cvrg_inds[l], cpu_kernels.SparseCvrg) else tensoRF_cvrg_inds[l]
+            inds = torch.nonzero(cvrg_inds>=0)
             pnts = self.aabb[0][None, ...] + (inds+0.5) * self.units[None, ...]
             print("center pnts", torch.min(pnts, dim=0)[0], torch.max(pnts, dim=0)[0])
             np.savetxt("log/ship_hier_try/cvrg_inds_center2pnts_lvl{}.txt".format(l), pnts.cpu().numpy(), delimiter=";")
@@ -578,7 +594,7 @@ class PointTensorBase_hier(TensorBase):
                 #     local_gweight_s = 1 - local_gweight_l
                 #     mask = None
                 # else:
-                local_gindx_s, local_gindx_l, local_gweight_s, local_gweight_l, local_kernel_dist, tensoRF_id, agg_id = search_geo_hier_cuda.sample_2_tensoRF_cvrg_hier(xyz_sampled.contiguous(), self.aabb[0], self.aabb[1], self.units, self.lvl_units[l], self.local_range[l], self.local_dims[l,:3], self.tensoRF_cvrg_inds[l], self.tensoRF_count[l], self.tensoRF_topindx[l], self.pnt_xyz[l], self.K_tensoRF[l], self.KNN)
+                local_gindx_s, local_gindx_l, local_gweight_s, local_gweight_l, local_kernel_dist, tensoRF_id, agg_id = get_kernels(self.device, self.tensoRF_cvrg_inds[l]).search_geo_hier.sample_2_tensoRF_cvrg_hier(xyz_sampled.contiguous(), self.aabb[0], self.aabb[1], self.units, self.lvl_units[l], self.local_range[l], self.local_dims[l,:3], self.tensoRF_cvrg_inds[l], self.tensoRF_count[l], self.tensoRF_topindx[l], self.pnt_xyz[l], self.K_tensoRF[l], self.KNN)
             elif self.args.tensoRF_shape == "sphere":
                 print("no implementation")
                 exit()
@@ -624,6 +640,31 @@ class PointTensorBase_hier(TensorBase):
 
 
 
+    @torch.no_grad()
+    def march_terminate(self, xyz_sampled, ray_id, N, pnt_rmatrix=None):
+        # front to back in segments of --ert_steps samples per ray, a ray stops once its transmittance drops below
+        # --ert_thresh. Returns the evaluated samples (a prefix of every ray) as a mask over xyz_sampled and their alpha
+        seg = max(1, self.args.ert_steps)
+        log_thresh = float(np.log(self.args.ert_thresh))
+        counts = torch.bincount(ray_id, minlength=N)
+        pos = torch.arange(len(ray_id), device=ray_id.device) - (torch.cumsum(counts, 0) - counts)[ray_id]
+        log_t = torch.zeros(N, device=xyz_sampled.device)
+        alpha = torch.zeros(len(ray_id), device=xyz_sampled.device)
+        evaluated = torch.zeros(len(ray_id), dtype=torch.bool, device=ray_id.device)
+        for start in range(0, counts.max().item(), seg):
+            sel = torch.nonzero((pos >= start) & (pos < start + seg) & (log_t[ray_id] > log_thresh))[..., 0]
+            # every brick sees the same rays and reduced densities, so the ranks stop together
+            if len(sel) == 0:
+                break
+            local_gindx_s, local_gindx_l, local_gweight_s, local_gweight_l, local_kernel_dist, tensoRF_id, agg_id = self.sample_2_tensoRF_cvrg_hier(xyz_sampled[sel], pnt_rmatrix=pnt_rmatrix)
+            sigma_feature = self.compute_densityfeature_geo(local_gindx_s, local_gindx_l, local_gweight_s, local_gweight_l, local_kernel_dist, tensoRF_id, agg_id, sample_num=len(sel))
+            alpha_seg = Raw2Alpha.apply(sigma_feature.flatten(), self.density_shift, self.stepSize * self.distance_scale)
+            alpha[sel] = alpha_seg
+            evaluated[sel] = True
+            log_t.index_add_(0, ray_id[sel], torch.log(torch.clamp(1 - alpha_seg, min=1e-10)))
+        return evaluated, alpha[evaluated]
+
+
     def forward(self, rays_chunk, white_bg=True, is_train=False, ray_type=0, N_samples=-1, return_depth=0,
                 tensoRF_per_ray=None, eval=False, rot_step=False, depth_bg=True):
 
@@ -656,36 +697,39 @@ class PointTensorBase_hier(TensorBase):
                     step_id = step_id[mask]
 
         if ray_id is None or len(ray_id) == 0 or not mask_any:
-            return torch.full([N, 3], 1.0 if (white_bg or (is_train and torch.rand((1,)) < 0.5)) else 0.0, device="cuda", dtype=torch.float32), rays_chunk[..., -1].detach(), None, None, None
+            if is_train and self.sample_budget is not None:
+                self.sample_budget.skip(N)
+            return torch.full([N, 3], 1.0 if (white_bg or (is_train and torch.rand((1,)) < 0.5)) else 0.0, device=rays_chunk.device, dtype=torch.float32), rays_chunk[..., -1].detach(), None, None, None
+        if is_train and self.sample_budget is not None:
+            xyz_sampled, ray_id, step_id = self.sample_budget.limit(xyz_sampled, ray_id, step_id if return_depth else None, N)
         
-        local_gindx_s, local_gindx_l, local_gweight_s, local_gweight_l, local_kernel_dist, tensoRF_id, agg_id = self.sample_2_tensoRF_cvrg_hier(xyz_sampled, pnt_rmatrix=pnt_rmatrix, rotgrad=rot_step)
-        # print("local_kernel_dist", local_kernel_dist[0].shape, torch.max(local_kernel_dist[0]), torch.min(local_kernel_dist[0]), local_kernel_dist[0])
-        sigma_feature = self.compute_densityfeature_geo(local_gindx_s, local_gindx_l, local_gweight_s, local_gweight_l, local_kernel_dist, tensoRF_id, agg_id, sample_num=len(ray_id))
-
-        if shift is None:
-            alpha = Raw2Alpha.apply(sigma_feature.flatten(), self.density_shift, self.stepSize * self.distance_scale).reshape(sigma_feature.shape)
+        if eval and not is_train and shift is None and getattr(self.args, "ert_thresh", 0) > 0:
+            # early ray termination: density of a per-ray prefix only, records again for the kept samples only
+            evaluated, alpha = self.march_terminate(xyz_sampled, ray_id, N, pnt_rmatrix=pnt_rmatrix)
+            xyz_sampled, ray_id = xyz_sampled[evaluated], ray_id[evaluated]
+            step_id = step_id[evaluated] if return_depth else step_id
+            weights, bg_weight = Alphas2Weights.apply(alpha, ray_id, N)
+            mask = weights > self.rayMarch_weight_thres
+            if mask.any() and not mask.all():
+                xyz_sampled, weights, ray_id = xyz_sampled[mask], weights[mask], ray_id[mask]
+                step_id = step_id[mask] if return_depth else step_id
+            local_gindx_s, local_gindx_l, local_gweight_s, local_gweight_l, local_kernel_dist, tensoRF_id, agg_id = self.sample_2_tensoRF_cvrg_hier(xyz_sampled, pnt_rmatrix=pnt_rmatrix, rotgrad=rot_step)
         else:
-            alpha = Raw2Alpha_randstep.apply(sigma_feature.flatten(), self.density_shift, (shift * self.distance_scale)[ray_id].contiguous()).reshape(sigma_feature.shape)
-        # print("alpha", alpha.shape, ray_id.shape, len(torch.unique(ray_id)), torch.unique(ray_id))
-        weights, bg_weight = Alphas2Weights.apply(alpha, ray_id, N) #
-        mask = weights > self.rayMarch_weight_thres
-        # print("weights",weights.shape,torch.min(weights), torch.max(weights))
-        if mask.any() and (~mask).any():
-            if return_depth:
-                step_id = step_id[mask]
-            weights = weights[mask]
-            ray_id = ray_id[mask]
-            holder = torch.zeros((len(mask)), device=mask.device, dtype=torch.int64)
-            holder[mask] = torch.arange(0, torch.sum(mask).cpu().item(), device=mask.device, dtype=torch.int64)
-            for l in range(self.lvl):
-                tensor_mask = mask[agg_id[l]]
-                agg_id[l] = holder[agg_id[l][tensor_mask]]
-                tensoRF_id[l] = tensoRF_id[l][tensor_mask]
-                local_gindx_s[l] = local_gindx_s[l][tensor_mask]
-                local_gindx_l[l] = local_gindx_l[l][tensor_mask]
-                local_gweight_s[l] = local_gweight_s[l][tensor_mask]
-                local_gweight_l[l] = local_gweight_l[l][tensor_mask]
-                local_kernel_dist[l] = local_kernel_dist[l][tensor_mask]
+            local_gindx_s, local_gindx_l, local_gweight_s, local_gweight_l, local_kernel_dist, tensoRF_id, agg_id = self.sample_2_tensoRF_cvrg_hier(xyz_sampled, pnt_rmatrix=pnt_rmatrix, rotgrad=rot_step)
+            # print("local_kernel_dist", local_kernel_dist[0].shape, torch.max(local_kernel_dist[0]), torch.min(local_kernel_dist[0]), local_kernel_dist[0])
+            sigma_feature = self.compute_densityfeature_geo(local_gindx_s, local_gindx_l, local_gweight_s, local_gweight_l, local_kernel_dist, tensoRF_id, agg_id, sample_num=len(ray_id))
+
+            if shift is None:
+                alpha = Raw2Alpha.apply(sigma_feature.flatten(), self.density_shift, self.stepSize * self.distance_scale).reshape(sigma_feature.shape)
+            else:
+                alpha = Raw2Alpha_randstep.apply(sigma_feature.flatten(), self.density_shift, (shift * self.distance_scale)[ray_id].contiguous()).reshape(sigma_feature.shape)
+            # print("alpha", alpha.shape, ray_id.shape, len(torch.unique(ray_id)), torch.unique(ray_id))
+            weights, bg_weight = Alphas2Weights.apply(alpha, ray_id, N) #
+            mask = weights > self.rayMarch_weight_thres
+            # print("weights",weights.shape,torch.min(weights), torch.max(weights))
+            records = SampleRecords.from_levels(local_gindx_s=local_gindx_s, local_gindx_l=local_gindx_l, local_gweight_s=local_gweight_s, local_gweight_l=local_gweight_l, local_kernel_dist=local_kernel_dist, tensoRF_id=tensoRF_id, agg_id=agg_id)
+            records, (weights, ray_id, step_id) = records.prune(mask, weights, ray_id, step_id if return_depth else None)
+            local_gindx_s, local_gindx_l, local_gweight_s, local_gweight_l, local_kernel_dist, tensoRF_id, agg_id = records.levels("local_gindx_s", "local_gindx_l", "local_gweight_s", "local_gweight_l", "local_kernel_dist", "tensoRF_id", "agg_id")
 
         app_features = self.compute_appfeature_geo(local_gindx_s, local_gindx_l, local_gweight_s, local_gweight_l, local_kernel_dist, tensoRF_id, agg_id, sample_num=len(ray_id), dir_gindx_s=dir_gindx_s, dir_gindx_l=dir_gindx_l, dir_gweight_l=dir_gweight_l)
         rgb = self.renderModule(None, viewdirs[ray_id], app_features)
@@ -780,7 +824,7 @@ class PointTensorCP_hier(PointTensorBase_hier):
             self.theta_line, self.phi_line = None, None
 
         if self.args.rot_init is not None and init:
-            self.pnt_rot = torch.nn.ParameterList([torch.nn.Parameter(torch.as_tensor(self.args.rot_init, device="cuda", dtype=torch.float32).repeat(len(geo), 1), requires_grad=self.args.rotgrad>0) for geo in self.geo]).to(device)
+            self.pnt_rot = torch.nn.ParameterList([torch.nn.Parameter(torch.as_tensor(self.args.rot_init, device=device, dtype=torch.float32).repeat(len(geo), 1), requires_grad=self.args.rotgrad>0) for geo in self.geo]).to(device)
 
         self.basis_mat = torch.nn.ModuleList([torch.nn.Linear(self.app_n_comp[l][0], self.app_dim[l], bias=False).to(device) for l in range(len(self.app_dim))]).to(device)
 
@@ -866,6 +910,8 @@ class PointTensorCP_hier(PointTensorBase_hier):
 
     def ind_intrp_line_map_batch_prod(self, vecModes, density_lines, local_gindx_s, local_gindx_l, local_gweight_s, local_gweight_l, tensoRF_id):
         # print("tensoRF_id.shape, density_lines[0].shape, local_gindx_s.shape, vecModes", tensoRF_id.shape, torch.min(tensoRF_id), torch.max(tensoRF_id), density_lines[0].shape, local_gindx_s.shape, local_gweight_s.shape)
+        if self.args.line_gather != "eager":
+            return line_prod(density_lines, local_gindx_s, local_gindx_l, local_gweight_s, local_gweight_l, tensoRF_id, mode=self.args.line_gather)
         return (density_lines[0][tensoRF_id, :, local_gindx_s[..., 0]] * local_gweight_s[:, None, 0] + density_lines[0][tensoRF_id, :, local_gindx_l[..., 0]] * local_gweight_l[:, None, 0]) *  (density_lines[1][tensoRF_id, :, local_gindx_s[..., 1]] * local_gweight_s[:, None, 1] + density_lines[1][tensoRF_id, :, local_gindx_l[..., 1]] * local_gweight_l[:, None, 1]) * (density_lines[2][tensoRF_id, :, local_gindx_s[..., 2]] * local_gweight_s[:, None, 2] + density_lines[2][tensoRF_id, :, local_gindx_l[..., 2]] * local_gweight_l[:, None, 2])
 
 
@@ -909,9 +955,9 @@ class PointTensorCP_hier(PointTensorBase_hier):
         sigma_feature_acc = torch.zeros([sample_num], device=local_gindx_s[0].device, dtype=torch.float32)
         # print("self.density_line", len(self.density_line), len(self.density_line[0]))
         # print("self.density_line shape", self.density_line[0][0].shape, torch.max(self.density_line[0][0]))
-        num_lvl_exist = torch.zeros([sample_num, 1], device="cuda", dtype=torch.float32)
+        num_lvl_exist = torch.zeros([sample_num, 1], device=local_gindx_s[0].device, dtype=torch.float32)
         for l in range(self.lvl):
-            if len(local_gindx_s[l]) > 0:
+            if len(local_gindx_s[l]) > 0 or self.bricks is not None:
                 sigma_feature = torch.sum(self.ind_intrp_line_map_batch_prod(self.vecMode, self.density_line[3*l:3*l+3], local_gindx_s[l], local_gindx_l[l], local_gweight_s[l], local_gweight_l[l], tensoRF_id[l]), dim=1, keepdim=True)
                 sigma_feature, has_tensorf = self.agg_tensoRF_at_samples(local_kernel_dist[l], agg_id[l], sigma_feature, out=torch.zeros([sample_num, 1], device=local_gindx_s[l].device, dtype=torch.float32), outweight=torch.zeros([sample_num, 1], device=local_gindx_s[l].device, dtype=torch.float32))
                 if self.args.den_lvl_norm > 0:
@@ -924,9 +970,9 @@ class PointTensorCP_hier(PointTensorBase_hier):
         # plane + line basis
         # line_coef_point = torch.prod(self.ind_intrp_line_map_batch(self.vecMode, self.app_line, local_gindx_s, local_gindx_l, local_gweight_s, local_gweight_l, tensoRF_id), dim=-1)
         infeat = torch.zeros([sample_num, 0 if self.args.radiance_add == 0 else self.app_dim[0]], device=local_gindx_s[0].device, dtype=torch.float32)
-        num_lvl_exist = torch.zeros([sample_num, 1], device="cuda", dtype=torch.float32)
+        num_lvl_exist = torch.zeros([sample_num, 1], device=local_gindx_s[0].device, dtype=torch.float32)
         for l in range(self.lvl):
-            if len(local_gindx_s[l]) > 0:
+            if len(local_gindx_s[l]) > 0 or self.bricks is not None:
                 line_coef_point = self.ind_intrp_line_map_batch_prod(self.vecMode, self.app_line[3*l:3*l+3], local_gindx_s[l], local_gindx_l[l], local_gweight_s[l], local_gweight_l[l], tensoRF_id[l])
                 app_feat, has_tensorf = self.agg_tensoRF_at_samples(local_kernel_dist[l], agg_id[l], line_coef_point, out=torch.zeros([sample_num, self.app_n_comp[l][0]], device=local_gindx_s[l].device, dtype=torch.float32), outweight=torch.zeros([sample_num, 1], device=local_gindx_s[l].device, dtype=torch.float32))
                 if dir_gindx_s is not None:
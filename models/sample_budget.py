@@ -0,0 +1,61 @@
+import torch
+
+''' Per-batch sample budget of the hier / adapt training forwards (--sample_budget N)
+The samples of a training batch (after the coverage and alpha mask tests) are capped at --sample_budget: when a batch
+holds more, rays are ordered by occupied length and every ray keeps at most its first c samples, c the largest cap that
+fits the budget; short rays are untouched, the longest ones lose their far samples. This bounds the sample-level
+tensors and the records built from them, hence the peak memory of a step; their sizes still vary below the budget.
+A truncated ray renders without its far samples, its color then leans on the background (white_bg / bg_weight), so it
+must not be trained on: every forward records which of its rays were truncated and how many samples they lost, and
+the training loop takes them with pop() to leave those rays out of the losses and report the dropped samples.
+Steps within the budget record nothing, the bookkeeping only costs (and syncs) on overflow steps.
+'''
+
+
+class SampleBudget:
+    def __init__(self, budget):
+        self.budget = int(budget)
+        self.reset()
+
+    def reset(self):
+        # per forward since the last pop: (n_rays, truncated ray mask or None, dropped sample count or None)
+        self.records = []
+
+    def cap(self, counts):
+        # largest per-ray cap c with sum(min(counts, c)) <= budget. With the counts sorted, capping at the i-th one
+        # keeps prefix[i] + counts[i] * (n - i) samples; the cap lies between the last count that fits and the next.
+        # At least one sample per ray, even if that overflows
+        counts = torch.sort(counts)[0]
+        n = len(counts)
+        prefix = torch.cumsum(counts, 0) - counts
+        kept = prefix + counts * torch.arange(n, 0, -1, device=counts.device)
+        i = min(int(torch.searchsorted(kept, torch.as_tensor([self.budget], device=counts.device), right=True)), n - 1)
+        return max(1, (self.budget - int(prefix[i])) // (n - i))
+
+    def skip(self, n_rays):
+        # a forward of n_rays that never reached limit (no samples at all)
+        self.records.append((n_rays, None, None))
+
+    @torch.no_grad()
+    def limit(self, xyz_sampled, ray_id, step_id, n_rays):
+        # ray_id sorted (samples near to far per ray); step_id may be None
+        if len(ray_id) <= self.budget:
+            self.skip(n_rays)
+            return xyz_sampled, ray_id, step_id
+        counts = torch.bincount(ray_id, minlength=n_rays)
+        pos = torch.arange(len(ray_id), device=ray_id.device) - (torch.cumsum(counts, 0) - counts)[ray_id]
+        cap = self.cap(counts)
+        keep = pos < cap
+        self.records.append((n_rays, counts > cap, (len(ray_id) - keep.sum())))
+        return xyz_sampled[keep], ray_id[keep], step_id[keep] if step_id is not None else None
+
+    def pop(self, n_rays):
+        # (truncated [n_rays] bool, dropped samples) of the forwards since the last pop, in ray order,
+        # or (None, 0) when none of them overflowed
+        records, self.records = self.records, []
+        assert sum(n for n, _, _ in records) == n_rays, "sample budget records don't cover the {} rays".format(n_rays)
+        if all(truncated is None for _, truncated, _ in records):
+            return None, 0
+        device = next(truncated.device for _, truncated, _ in records if truncated is not None)
+        truncated = torch.cat([torch.zeros(n, dtype=torch.bool, device=device) if mask is None else mask for n, mask, _ in records])
+        return truncated, int(sum(dropped for _, _, dropped in records if dropped is not None))
@@ -132,9 +132,7 @@ class TensorBase(torch.nn.Module):
 
     def load(self, ckpt):
         if 'alphaMask.aabb' in ckpt.keys():
-            length = np.prod(ckpt['alphaMask.shape'])
-            alpha_volume = torch.from_numpy(np.unpackbits(ckpt['alphaMask.mask'])[:length].reshape(ckpt['alphaMask.shape']))
-            self.alphaMask = AlphaGridMask(self.device, ckpt['alphaMask.aabb'].to(self.device), alpha_volume.float().to(self.device), mask_cache_thres=self.alphaMask_thres)
+            self.alphaMask = AlphaGridMask.from_checkpoint(self.device, ckpt, mask_cache_thres=self.alphaMask_thres)
         self.load_state_dict(ckpt['state_dict'])
 
 
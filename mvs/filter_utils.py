@@ -11,6 +11,9 @@ from tqdm import tqdm
 import cv2
 from PIL import Image
 
+# source views reprojected together by filter_view_gpu
+SRC_CHUNK = 16
+
 def reproject_with_depth(depth_ref, intrinsics_ref, extrinsics_ref, depth_src, intrinsics_src, extrinsics_src):
     width, height = depth_ref.shape[1], depth_ref.shape[0]
     ## step1. project reference pixels to the source view
@@ -219,6 +222,112 @@ def check_geometric_consistency_gpu(depth_ref, intrinsics_ref, extrinsics_ref, d
 
 
 
+def reproject_with_depth_batch(depth_ref, intrinsics_ref, extrinsics_ref, depth_src, intrinsics_src, extrinsics_src):
+    # reproject_with_depth_gpu against S source views at once: depth_src [S, H, W], intrinsics_src [S, 3, 3], extrinsics_src [S, 4, 4]
+    height, width = depth_ref.shape
+    S = len(depth_src)
+    y_ref, x_ref = torch.meshgrid(torch.arange(0, height, device=depth_ref.device), torch.arange(0, width, device=depth_ref.device))
+    x_ref, y_ref = x_ref.reshape([-1]), y_ref.reshape([-1])
+    ones = torch.ones_like(x_ref)[None, :]
+    xyz_ref = torch.matmul(torch.linalg.inv(intrinsics_ref), torch.stack([x_ref, y_ref, torch.ones_like(x_ref)], dim=0) * depth_ref.reshape([-1]))
+    xyz_src = torch.matmul(torch.matmul(extrinsics_src, torch.linalg.inv(extrinsics_ref)), torch.cat([xyz_ref, ones], dim=0))[:, :3]
+    K_xyz_src = torch.matmul(intrinsics_src, xyz_src)
+    xy_src = K_xyz_src[:, :2] / K_xyz_src[:, 2:3]
+    x_src = xy_src[:, 0].reshape([S, height, width]).to(torch.float32)
+    y_src = xy_src[:, 1].reshape([S, height, width]).to(torch.float32)
+    oor_mask = torch.logical_or(torch.logical_or(x_src >= width, x_src < 0), torch.logical_or(y_src >= height, y_src < 0))
+    sampled_depth_src = F.grid_sample(depth_src[:, None, ...], torch.stack([x_src * 2 / (width-1) - 1, y_src * 2 / (height-1) - 1], dim=-1), align_corners=True, mode='bilinear', padding_mode='border')
+
+    xyz_src = torch.matmul(torch.linalg.inv(intrinsics_src), torch.cat([xy_src, ones[None].expand(S, 1, -1)], dim=1) * sampled_depth_src.reshape([S, 1, -1]))
+    xyz_reprojected = torch.matmul(torch.matmul(extrinsics_ref, torch.linalg.inv(extrinsics_src)), torch.cat([xyz_src, ones[None].expand(S, 1, -1)], dim=1))[:, :3]
+    depth_reprojected = xyz_reprojected[:, 2].reshape([S, height, width]).to(torch.float32)
+    K_xyz_reprojected = torch.matmul(intrinsics_ref, xyz_reprojected)
+    xy_reprojected = K_xyz_reprojected[:, :2] / K_xyz_reprojected[:, 2:3]
+    x_reprojected = xy_reprojected[:, 0].reshape([S, height, width]).to(torch.float32)
+    y_reprojected = xy_reprojected[:, 1].reshape([S, height, width]).to(torch.float32)
+    return depth_reprojected, x_reprojected, y_reprojected, x_src, y_src, oor_mask
+
+
+def check_geometric_consistency_batch(depth_ref, intrinsics_ref, extrinsics_ref, depth_src, intrinsics_src, extrinsics_src):
+    # check_geometric_consistency_gpu against S source views at once, every output gets a leading S dim
+    height, width = depth_ref.shape
+    y_ref, x_ref = torch.meshgrid(torch.arange(0, height, device=depth_ref.device), torch.arange(0, width, device=depth_ref.device))
+    depth_reprojected, x2d_reprojected, y2d_reprojected, x2d_src, y2d_src, oor_mask = reproject_with_depth_batch(depth_ref, intrinsics_ref, extrinsics_ref, depth_src, intrinsics_src, extrinsics_src)
+    dist = torch.sqrt((x2d_reprojected - x_ref) ** 2 + (y2d_reprojected - y_ref) ** 2)
+    relative_depth_diff = torch.abs(depth_reprojected - depth_ref) / depth_ref
+    mask = torch.logical_and(dist < 1, relative_depth_diff < 0.01)
+    depth_reprojected[~mask] = 0
+    return mask, ~oor_mask, depth_reprojected, x2d_src, y2d_src
+
+
+def select_source_views(cam_xyz_all, intrinsics_all, extrinsics_all, k, stride=16):
+    # top k source views of every reference view: the fraction of the reference's (subsampled) depth points that land
+    # in front of and inside the source frustum, weighted by how close the viewing directions are
+    V = len(cam_xyz_all)
+    if k <= 0 or k >= V - 1:
+        return [[src for src in range(V) if src != ref] for ref in range(V)]
+    device = intrinsics_all[0].device
+    intrinsics = torch.stack([intrinsics_all[v][0] for v in range(V)]).to(device)
+    extrinsics = torch.stack([extrinsics_all[v][0] for v in range(V)]).to(device)
+    height, width = cam_xyz_all[0].shape[1:3]
+    c2ws = torch.linalg.inv(extrinsics)
+    axes = c2ws[:, :3, 2]
+    neighbors = []
+    for ref in range(V):
+        # camera space points of the reference
+        xyz = cam_xyz_all[ref][0, ::stride, ::stride].reshape(-1, 3).to(device)
+        xyz = xyz[xyz[:, 2] > 0]
+        if len(xyz) == 0:
+            neighbors.append([src for src in range(V) if src != ref][:k])
+            continue
+        world = c2ws[ref] @ torch.cat([xyz.T, torch.ones_like(xyz[None, :, 0])], dim=0)
+        cam = torch.matmul(extrinsics, world)[:, :3]
+        proj = torch.matmul(intrinsics, cam)
+        x, y = proj[:, 0] / proj[:, 2], proj[:, 1] / proj[:, 2]
+        inside = (cam[:, 2] > 0) & (x >= 0) & (x < width) & (y >= 0) & (y < height)
+        score = inside.to(torch.float32).mean(-1) * torch.clamp(axes @ axes[ref], min=0)
+        score[ref] = -1
+        neighbors.append(torch.topk(score, k).indices.tolist())
+    return neighbors
+
+
+def filter_view_gpu(cam_view, src_views, cam_xyz_all, intrinsics_all, extrinsics_all, confidence_all, points_mask_all, opt, cpu2gpu=False, near_fars=None):
+    # consistency filter of one reference view against src_views; cam_xyz_all entries are [C, H, W, 3]
+    cam_intrinsics, cam_extrinsics, cam_xy, cam_depth_est, confidence, points_mask = intrinsics_all[cam_view][0], extrinsics_all[cam_view][0], cam_xyz_all[cam_view][0,...,:-1], cam_xyz_all[cam_view][0,...,-1], confidence_all[cam_view][0,0,...], points_mask_all[cam_view][0,0,...]
+    if cpu2gpu:
+        cam_xy, cam_depth_est, confidence, points_mask = cam_xy.cuda(), cam_depth_est.cuda(), confidence.cuda(), points_mask.cuda()
+    sum_srcview_depth_ests = 0
+    geo_mask_sum = 0
+
+    # compute the geometric mask
+    for i in range(0, len(src_views), SRC_CHUNK):
+        # source depths are stacked on the host and copied in one transfer per chunk
+        chunk = src_views[i:i + SRC_CHUNK]
+        src_depth_est = torch.stack([cam_xyz_all[src_view][0,...,-1] for src_view in chunk]).to(cam_depth_est.device)
+        src_intrinsics = torch.stack([intrinsics_all[src_view][0] for src_view in chunk]).to(cam_depth_est.device)
+        src_extrinsics = torch.stack([extrinsics_all[src_view][0] for src_view in chunk]).to(cam_depth_est.device)
+        geo_mask, vis_mask, depth_reprojected, x2d_src, y2d_src = check_geometric_consistency_batch(cam_depth_est, cam_intrinsics, cam_extrinsics, src_depth_est, src_intrinsics, src_extrinsics)
+        geo_mask_sum += geo_mask.to(torch.int32).sum(0)
+        sum_srcview_depth_ests += depth_reprojected.sum(0)
+
+    depth_est_averaged = (sum_srcview_depth_ests + cam_depth_est) / (geo_mask_sum + 1)
+    # at least 3 source views matched
+    geo_mask = geo_mask_sum >= opt.geo_cnsst_num # visible_and_not_match_sum < 3 #
+    final_mask = torch.logical_and(confidence > opt.depth_conf_thresh, points_mask)
+    final_mask = torch.logical_and(final_mask, geo_mask) if len(src_views)>0 else final_mask
+    xy, depth = cam_xy[final_mask,:], depth_est_averaged[final_mask][...,None]
+    xyz_cam = torch.cat([xy, depth], dim=-1)
+
+    confidence_filtered = confidence[final_mask]
+    if opt.default_conf > 1.0:
+        confidence_filtered = reassign_conf(confidence_filtered, final_mask, geo_mask_sum, opt.geo_cnsst_num)
+
+    xyz_world = torch.cat([xyz_cam, torch.ones_like(xyz_cam[...,0:1])], axis=-1) @ torch.inverse(cam_extrinsics).transpose(0,1)
+    # print("xyz_world",xyz_world.shape)
+    xyz_world, xyz_cam, confidence_filtered, final_mask = range_mask_torch(xyz_world, xyz_cam, confidence_filtered, opt, final_mask)
+    return xyz_cam, xyz_world[:,:3], confidence_filtered, final_mask
+
+
 def filter_by_masks_gpu(cam_xyz_all, intrinsics_all, extrinsics_all, confidence_all, points_mask_all, opt, vis=False, return_w=False, cpu2gpu=False, near_fars_all=None):
     xyz_cam_lst=[]
     xyz_world_lst=[]
@@ -226,49 +335,14 @@ def filter_by_masks_gpu(cam_xyz_all, intrinsics_all, extrinsics_all, confidence_
     B, N, C, H, W, _ = cam_xyz_all[0].shape
     cam_xyz_all = [cam_xyz.view(C,H,W,3) for cam_xyz in cam_xyz_all]
     final_mask_lst = []
+    # every reference is checked against its --geo_src_views best overlapping views (all other views if 0),
+    # reprojected SRC_CHUNK views at a time
+    src_views_all = select_source_views(cam_xyz_all, intrinsics_all, extrinsics_all, getattr(opt, "geo_src_views", 0))
     for cam_view in tqdm(range(len(cam_xyz_all))) if vis else range(len(cam_xyz_all)):
         near_fars = near_fars_all[cam_view] if near_fars_all is not None else None
-
-        cam_intrinsics, cam_extrinsics, cam_xy, cam_depth_est, confidence, points_mask = intrinsics_all[cam_view][0], extrinsics_all[cam_view][0], cam_xyz_all[cam_view][0,...,:-1], cam_xyz_all[cam_view][0,...,-1], confidence_all[cam_view][0,0,...], points_mask_all[cam_view][0,0,...]
-        if cpu2gpu:
-            cam_xy, cam_depth_est, confidence, points_mask = cam_xy.cuda(), cam_depth_est.cuda(), confidence.cuda(), points_mask.cuda()
-        sum_srcview_depth_ests = 0
-        geo_mask_sum = 0
-        visible_and_match_sum = 0
-        visible_and_not_match_sum = 0
-        visible_sum = 0
-
-        # compute the geometric mask
-        for src_view in range(len(cam_xyz_all)):
-            if cam_view == src_view:
-                continue
-            src_intrinsics, src_extrinsics, src_depth_est = intrinsics_all[src_view][0], extrinsics_all[src_view][0], cam_xyz_all[src_view][0,...,-1]
-            if cpu2gpu:
-                src_depth_est = src_depth_est.cuda()
-            geo_mask, vis_mask, depth_reprojected, x2d_src, y2d_src = check_geometric_consistency_gpu(cam_depth_est, cam_intrinsics, cam_extrinsics, src_depth_est, src_intrinsics, src_extrinsics)
-            # visible_sum += vis_mask.to(torch.float32)
-            # visible_and_match_sum += torch.logical_and(vis_mask, geo_mask).to(torch.float32)
-            # visible_and_not_match_sum += torch.logical_and(vis_mask, ~geo_mask).to(torch.float32)
-            geo_mask_sum += geo_mask.to(torch.int32)
-            sum_srcview_depth_ests += depth_reprojected
-
-        depth_est_averaged = (sum_srcview_depth_ests + cam_depth_est) / (geo_mask_sum + 1)
-        # at least 3 source views matched
-        geo_mask = geo_mask_sum >= opt.geo_cnsst_num # visible_and_not_match_sum < 3 #
-        final_mask = torch.logical_and(confidence > opt.depth_conf_thresh, points_mask)
-        final_mask = torch.logical_and(final_mask, geo_mask) if len(cam_xyz_all)>1 else final_mask
-        xy, depth = cam_xy[final_mask,:], depth_est_averaged[final_mask][...,None]
-        xyz_cam = torch.cat([xy, depth], dim=-1)
-
-        confidence_filtered = confidence[final_mask]
-        if opt.default_conf > 1.0:
-            confidence_filtered = reassign_conf(confidence_filtered, final_mask, geo_mask_sum, opt.geo_cnsst_num)
-
-        xyz_world = torch.cat([xyz_cam, torch.ones_like(xyz_cam[...,0:1])], axis=-1) @ torch.inverse(cam_extrinsics).transpose(0,1)
-        # print("xyz_world",xyz_world.shape)
-        xyz_world, xyz_cam, confidence_filtered, final_mask = range_mask_torch(xyz_world, xyz_cam, confidence_filtered, opt, final_mask)
+        xyz_cam, xyz_world, confidence_filtered, final_mask = filter_view_gpu(cam_view, src_views_all[cam_view], cam_xyz_all, intrinsics_all, extrinsics_all, confidence_all, points_mask_all, opt, cpu2gpu=cpu2gpu, near_fars=near_fars)
         xyz_cam_lst.append(xyz_cam.cpu() if cpu2gpu else xyz_cam)
-        xyz_world_lst.append(xyz_world[:,:3].cpu() if cpu2gpu else xyz_world[:,:3])
+        xyz_world_lst.append(xyz_world.cpu() if cpu2gpu else xyz_world)
         confidence_filtered_lst.append(confidence_filtered.cpu() if cpu2gpu else confidence_filtered)
         final_mask_lst.append(final_mask)
     return xyz_cam_lst, xyz_world_lst, confidence_filtered_lst, final_mask_lst
@@ -43,6 +43,8 @@ class MvsPointsModel(nn.Module):
         self.render_kwargs_train.pop('network_featmvs')
         self.render_kwargs_train.pop('network_2d')
         self.render_kwargs_train['NDC_local'] = False
+        # FeatureNet output by view id, shared by the reference views that reuse an image as a source
+        self.feature_cache = OrderedDict()
         # self.cnt = 0
 
 
@@ -170,60 +172,108 @@ class MvsPointsModel(nn.Module):
 
 
     def gen_points(self, batch):
-        if 'scan' in batch.keys():
-            batch.pop('scan')
-        data_mvs, pose_ref = self.decode_batch(batch)
-        imgs, proj_mats = data_mvs['images'], data_mvs['proj_mats']
-        near_fars, depths_h = data_mvs['near_fars'], data_mvs['depths_h'] if 'depths_h' in data_mvs else None
-        # print("depths_h", batch["near_fars"], depths_h.shape, depths_h[0,0,:,:])
-        # volume_feature:(1, 8, D, 176, 208)       img_feat:(B, V, C, h, w)
-        cam_expected_depth = None
-        ndc_std_depth = None
+        return self.gen_points_batch([batch])[0]
+
+
+    def cached_features(self, bimgs, keys):
+        # FeatureNet output of every view of every sample, [B, 32, h, w] per view. keys: int view ids are cached
+        # across calls (up to --mvs_feature_cache images), anything else is computed for this call only
+        feats, missing, pending = {}, [], set()
+        for b, sample_keys in enumerate(keys):
+            for v, key in enumerate(sample_keys):
+                if key in feats or key in pending:
+                    continue
+                if key in self.feature_cache:
+                    self.feature_cache.move_to_end(key)
+                    feats[key] = self.feature_cache[key]
+                else:
+                    missing.append((b, v, key))
+                    pending.add(key)
+        if len(missing) > 0:
+            with torch.no_grad():
+                new_feats = self.ReconNet.feature(torch.stack([bimgs[b][v] for b, v, _ in missing]))
+            capacity = getattr(self.args, "mvs_feature_cache", 32)
+            for (b, v, key), feat in zip(missing, new_feats):
+                feats[key] = feat
+                if isinstance(key, int) and capacity > 0:
+                    self.feature_cache[key] = feat
+            while len(self.feature_cache) > capacity:
+                self.feature_cache.popitem(last=False)
+        return [torch.stack([feats[sample_keys[v]] for sample_keys in keys]) for v in range(len(keys[0]))]
+
+
+    def gen_points_batch(self, batches):
+        # gen_points of several reference views (one get_init_item sample each) in one MVSNet forward,
+        # returns the gen_points outputs of every sample. Samples of different image sizes run one by one
+        if len(set(tuple((batch["mvs_images"] if "mvs_images" in batch else batch["images"]).shape) for batch in batches)) > 1:
+            return [out for batch in batches for out in self.gen_points_batch([batch])]
         # volume_feature: 1, 8, 128, 176, 208;
         # img_feat: 1, 3, 32, 128, 160;
         # depth_values: 1, 128
-        photometric_confidence_lst=[]
-        cam_xyz_lst = []
-        xyz_color_lst = []
-        nearfar_mask_lst = []
         volume_prob = None
         # w2c_ref = batch["w2cs"][:, self.args.ref_vid, ...].transpose(1, 2)
         depth_vid = [0]
         init_view_num=3
         manual_std_depth=0.0
-        near_far_depth = batch["near_fars_depth"][0]
-        depth_interval, depth_min = (near_far_depth[1] - near_far_depth[0]) / 192., near_far_depth[0]
-        depth_values = (depth_min + torch.arange(0, 192, device="cuda", dtype=torch.float32) * depth_interval)[None, :]
-        dimgs = batch["mvs_images"] if "mvs_images" in batch else imgs
-        bmvs_2d_features=None
-        # print("dimgs",dimgs.shape) # [1, 3, 3, 800, 800]
-        bimgs = dimgs[:, :init_view_num].expand(len(depth_vid), -1, -1, -1, -1)
-        bvid = torch.as_tensor(depth_vid, dtype=torch.long, device="cuda")
-        bproj_mats = proj_mats[0, bvid, ...]
-        bdepth_values = depth_values.expand(len(depth_vid), -1)
+        data_mvs_lst, bimgs, bproj_mats, bdepth_values, keys = [], [], [], [], []
+        for b, batch in enumerate(batches):
+            if 'scan' in batch.keys():
+                batch.pop('scan')
+            data_mvs, pose_ref = self.decode_batch(batch)
+            near_far_depth = batch["near_fars_depth"][0]
+            depth_interval, depth_min = (near_far_depth[1] - near_far_depth[0]) / 192., near_far_depth[0]
+            bdepth_values.append(depth_min + torch.arange(0, 192, device="cuda", dtype=torch.float32) * depth_interval)
+            dimgs = batch["mvs_images"] if "mvs_images" in batch else data_mvs['images']
+            # print("dimgs",dimgs.shape) # [1, 3, 3, 800, 800]
+            bimgs.append(dimgs[0, :init_view_num])
+            bproj_mats.append(data_mvs['proj_mats'][0, depth_vid[0]])
+            view_ids = batch["view_ids"][0].tolist() if "view_ids" in batch else None
+            keys.append([view_ids[v] if view_ids is not None else (b, v) for v in range(init_view_num)])
+            data_mvs_lst.append(data_mvs)
 
         with torch.no_grad():
-            # 1, 128, 160;  1, 128, 160; prob_volume: 1, 192, 128, 160
-            depths_h, photometric_confidence, _, _ = self.ReconNet(bimgs, bproj_mats, bdepth_values, features=bmvs_2d_features)
+            # B, 128, 160;  B, 128, 160; prob_volume: B, 192, 128, 160
+            depths_h, photometric_confidence, _, _ = self.ReconNet(torch.stack(bimgs), torch.stack(bproj_mats), torch.stack(bdepth_values), features=self.cached_features(bimgs, keys))
             depths_h, photometric_confidence = depths_h[:,None,...], photometric_confidence[:,None,...]
 
         bcam_expected_depth = torch.nn.functional.interpolate(depths_h, size=list(dimgs.shape)[-2:], mode='nearest')
-
-        photometric_confidence = torch.nn.functional.interpolate(photometric_confidence, size=list(dimgs.shape)[-2:], mode='nearest')  # 1, 1, H, W
-        photometric_confidence_lst = torch.unbind(photometric_confidence[:,None,...], dim=0)
+        bphotometric_confidence = torch.nn.functional.interpolate(photometric_confidence, size=list(dimgs.shape)[-2:], mode='nearest')  # B, 1, H, W
         bndc_std_depth = torch.ones_like(bcam_expected_depth) * manual_std_depth
-        # print(bimgs.shape, batch["intrinsics"].shape) # torch.Size([1, 3, 3, 800, 800]) torch.Size([1, 3, 3, 3])
-        for i in range(len(depth_vid)):
-            vid = depth_vid[i]
-            cam_expected_depth, ndc_std_depth = bcam_expected_depth[i:i+1], bndc_std_depth[i:i+1]
-            ndc_xyz, cam_xyz, HDWD, nearfar_mask = self.sample_func(volume_prob, self.args, batch["intrinsics"][:, vid,...], near_fars[0, vid], cam_expected_depth=cam_expected_depth, ndc_std_depth=ndc_std_depth)
-            if cam_xyz.shape[1] > 0:
-                # cam_xyz torch.Size([1, 1, 1, 800, 800, 3])
-                # print("imgs", imgs.shape) # ([1, 3, 3, 800, 800])
-                xyz_color_lst.append(imgs[0, 0, ...])
-                cam_xyz_lst.append(cam_xyz)
-                nearfar_mask_lst.append(nearfar_mask)
-        return cam_xyz_lst, xyz_color_lst, photometric_confidence_lst, nearfar_mask_lst, HDWD, data_mvs, [batch["intrinsics"][:,int(vid),...] for vid in depth_vid], [batch["w2cs"][:,int(vid),...] for vid in depth_vid]
+        outs = []
+        for b, (batch, data_mvs) in enumerate(zip(batches, data_mvs_lst)):
+            imgs, near_fars = data_mvs['images'], data_mvs['near_fars']
+            photometric_confidence_lst = torch.unbind(bphotometric_confidence[b:b+1, None, ...], dim=0)
+            cam_xyz_lst = []
+            xyz_color_lst = []
+            nearfar_mask_lst = []
+            # print(bimgs.shape, batch["intrinsics"].shape) # torch.Size([1, 3, 3, 800, 800]) torch.Size([1, 3, 3, 3])
+            for vid in depth_vid:
+                cam_expected_depth, ndc_std_depth = bcam_expected_depth[b:b+1], bndc_std_depth[b:b+1]
+                ndc_xyz, cam_xyz, HDWD, nearfar_mask = self.sample_func(volume_prob, self.args, batch["intrinsics"][:, vid,...], near_fars[0, vid], cam_expected_depth=cam_expected_depth, ndc_std_depth=ndc_std_depth)
+                if cam_xyz.shape[1] > 0:
+                    # cam_xyz torch.Size([1, 1, 1, 800, 800, 3])
+                    # print("imgs", imgs.shape) # ([1, 3, 3, 800, 800])
+                    xyz_color_lst.append(imgs[0, 0, ...])
+                    cam_xyz_lst.append(cam_xyz)
+                    nearfar_mask_lst.append(nearfar_mask)
+            outs.append((cam_xyz_lst, xyz_color_lst, photometric_confidence_lst, nearfar_mask_lst, HDWD, data_mvs, [batch["intrinsics"][:,int(vid),...] for vid in depth_vid], [batch["w2cs"][:,int(vid),...] for vid in depth_vid]))
+        return outs
+
+
+    def gen_points_views(self, dataset, desc=None):
+        # (index, sample, gen_points outputs) of every view of dataset, in order. --mvs_batch reference views share a
+        # forward and --mvs_prefetch samples are prepared by a background thread meanwhile
+        self.feature_cache.clear()
+        n = len(dataset.view_id_list)
+        batch_size = max(1, getattr(self.args, "mvs_batch", 1))
+        items = prefetch(dataset.get_init_item, n, getattr(self.args, "mvs_prefetch", 0))
+        with tqdm(total=n, desc=desc) as pbar:
+            for start in range(0, n, batch_size):
+                batches = [next(items) for _ in range(min(batch_size, n - start))]
+                for i, (data, outs) in enumerate(zip(batches, self.gen_points_batch(batches))):
+                    yield start + i, data, outs
+                pbar.update(len(batches))
+        self.feature_cache.clear()
 
 
 
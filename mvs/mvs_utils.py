@@ -10,6 +10,9 @@ import matplotlib.pyplot as plt
 from scipy.spatial.transform import Rotation as R
 from plyfile import PlyData, PlyElement
 from tqdm import tqdm
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from . import point_store
 
 # Misc
 img2mse = lambda x, y : torch.mean((x - y) ** 2)
@@ -18,16 +21,20 @@ to8b = lambda x : (255*np.clip(x,0,1)).astype(np.uint8)
 mse2psnr2 = lambda x : -10. * np.log(x) / np.log(10.)
 
 
-def load_ply_points(args):
-    if not os.path.exists(args.pointfile):
+def load_ply_points(args, device="cuda"):
+    if not os.path.exists(point_store.store_path(args.pointfile)):
         if not os.path.exists(args.pointfile):
             parse_mesh(args)
-    plydata = PlyData.read(args.pointfile)
-    # plydata (PlyProperty('x', 'double'), PlyProperty('y', 'double'), PlyProperty('z', 'double'), PlyProperty('nx', 'double'), PlyProperty('ny', 'double'), PlyProperty('nz', 'double'), PlyProperty('red', 'uchar'), PlyProperty('green', 'uchar'), PlyProperty('blue', 'uchar'))
-    x,y,z=torch.as_tensor(plydata.elements[0].data["x"].astype(np.float32), device="cuda", dtype=torch.float32), torch.as_tensor(plydata.elements[0].data["y"].astype(np.float32), device="cuda", dtype=torch.float32), torch.as_tensor(plydata.elements[0].data["z"].astype(np.float32), device="cuda", dtype=torch.float32)
-    points_xyz = torch.stack([x,y,z], dim=-1)
+        plydata = PlyData.read(args.pointfile)
+        # plydata (PlyProperty('x', 'double'), PlyProperty('y', 'double'), PlyProperty('z', 'double'), PlyProperty('nx', 'double'), PlyProperty('ny', 'double'), PlyProperty('nz', 'double'), PlyProperty('red', 'uchar'), PlyProperty('green', 'uchar'), PlyProperty('blue', 'uchar'))
+        vertex = plydata.elements[0].data
+        columns = {"xyz": np.stack([vertex["x"], vertex["y"], vertex["z"]], axis=-1).astype(np.float32)}
+        if "red" in vertex.dtype.names:
+            columns["rgb"] = np.stack([vertex["red"], vertex["green"], vertex["blue"]], axis=-1).astype(np.uint8)
+        point_store.save_points(args.pointfile, columns)
+    points_xyz = torch.as_tensor(point_store.load_points(args.pointfile)["xyz"], device=device, dtype=torch.float32)
     if args.ranges[0] > -99.0:
-        ranges = torch.as_tensor(opt.ranges, device=points_xyz.device, dtype=torch.float32)
+        ranges = torch.as_tensor(args.ranges, device=points_xyz.device, dtype=torch.float32)
         mask = torch.prod(torch.logical_and(points_xyz >= ranges[None, :3], points_xyz <= ranges[None, 3:]), dim=-1) > 0
         points_xyz = points_xyz[mask]
     # np.savetxt(os.path.join(self.data_dir, self.scan, "exported/pcd.txt"), points_xyz.cpu().numpy(), delimiter=";")
@@ -300,6 +307,20 @@ def filter_keys(dict):
         dict.pop('lindisp')
     return dict
 
+def prefetch(fn, n, depth=2):
+    # fn(0), ..., fn(n - 1) in order, a background thread computes up to depth items ahead; depth 0 runs inline
+    if depth <= 0:
+        for i in range(n):
+            yield fn(i)
+        return
+    with ThreadPoolExecutor(max_workers=1) as pool:
+        futures = deque(pool.submit(fn, i) for i in range(min(depth, n)))
+        for i in range(n):
+            item = futures.popleft().result()
+            if i + depth < n:
+                futures.append(pool.submit(fn, i + depth))
+            yield item
+
 def sub_selete_data(data_batch, device, idx, filtKey=[], filtIndex=['view_ids_all','c2ws_all','scan','bbox','w2ref','ref2w','light_id','ckpt','idx']):
     data_sub_selete = {}
     for item in data_batch.keys():
@@ -0,0 +1,52 @@
+import torch
+
+''' Streaming fusion of the MVS points (--fusion_mode stream)
+Instead of buffering every view's depth, confidence and mask until all views are generated, each view is filtered
+as soon as its --fusion_window neighbors on both sides (in view order) exist, and its surviving points are added
+to voxel hashed accumulators (count, xyz sum, confidence sum per voxel). Peak memory is the window plus the
+occupied voxels, and the voxelized levels are the accumulators' means, no pass over the full cloud at the end.
+Voxels are anchored at the origin (or the dataset's spacemin), not at the min of the final cloud as in
+mvs_utils.construct_voxrange_points_mean, so the level points can differ slightly from the batch mode's.
+'''
+# bits per axis of the packed voxel key, coordinates are offset by half the range
+KEY_BITS = 21
+
+
+class VoxelAccumulator:
+    def __init__(self, vox_size, origin=None, device="cuda"):
+        self.vox_size = torch.as_tensor(vox_size, dtype=torch.float32, device=device).expand(3)
+        self.origin = torch.zeros(3, device=device) if origin is None else torch.as_tensor(origin, dtype=torch.float32, device=device)
+        self.keys = torch.zeros(0, dtype=torch.int64, device=device)
+        self.count = torch.zeros(0, device=device)
+        self.xyz_sum = torch.zeros(0, 3, device=device)
+        self.conf_sum = torch.zeros(0, device=device)
+
+    def __len__(self):
+        return len(self.keys)
+
+    def voxel_keys(self, xyz):
+        ijk = torch.floor((xyz - self.origin) / self.vox_size).long() + (1 << (KEY_BITS - 1))
+        assert len(ijk) == 0 or (ijk.min() >= 0 and ijk.max() < (1 << KEY_BITS)), "voxel index out of range, raise the voxel size"
+        return (ijk[:, 0] << (2 * KEY_BITS)) | (ijk[:, 1] << KEY_BITS) | ijk[:, 2]
+
+    def voxel_centers(self, keys):
+        mask = (1 << KEY_BITS) - 1
+        ijk = torch.stack([keys >> (2 * KEY_BITS), (keys >> KEY_BITS) & mask, keys & mask], dim=-1) - (1 << (KEY_BITS - 1))
+        return (ijk.float() + 0.5) * self.vox_size + self.origin
+
+    @torch.no_grad()
+    def add(self, xyz, confidence):
+        # xyz [N, 3], confidence [N]
+        if len(xyz) == 0:
+            return
+        keys, inv = torch.unique(torch.cat([self.keys, self.voxel_keys(xyz)]), return_inverse=True)
+        old, new = inv[:len(self.keys)], inv[len(self.keys):]
+        count = torch.zeros(len(keys), device=xyz.device).index_add_(0, old, self.count).index_add_(0, new, torch.ones_like(confidence))
+        xyz_sum = torch.zeros(len(keys), 3, device=xyz.device).index_add_(0, old, self.xyz_sum).index_add_(0, new, xyz.float())
+        conf_sum = torch.zeros(len(keys), device=xyz.device).index_add_(0, old, self.conf_sum).index_add_(0, new, confidence.float())
+        self.keys, self.count, self.xyz_sum, self.conf_sum = keys, count, xyz_sum, conf_sum
+
+    def points(self, vox_center=False):
+        # one point per occupied voxel: mean (or voxel center) xyz [K, 3] and mean confidence [K]
+        xyz = self.voxel_centers(self.keys) if vox_center else self.xyz_sum / self.count[:, None]
+        return xyz, self.conf_sum / self.count
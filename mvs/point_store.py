@@ -0,0 +1,133 @@
+import os, json, glob
+import numpy as np
+
+''' Binary point store
+<magic 8B><header length u8><json header><pad to 64B><arrays, each 64B aligned>
+The json header maps a group to its typed columns with dtype, shape and byte offset, so every column is opened with
+np.memmap without parsing or copying. A pointfile's base points live in <name>.pnts as one float32 [N, C] "packed"
+column in the legacy text layout (xyz, xyz+confidence, xyz+rgb, xyz+confidence+rgb, rgb as 0-255 floats, nothing is
+rounded); load_points adds xyz / confidence / rgb / extra views of it and merge_columns returns it as is.
+Every derived group (a voxelized level, ...) is a store of its own, <name>.<group>.pnts, so saving one rewrites
+only that group. .ply clouds are stored as float32 xyz and their uint8 rgb.
+Legacy ';' delimited .txt files are converted to <name>.pnts on first load.
+'''
+MAGIC = b"STRVPNTS"
+ALIGN = 64
+BASE = "points"
+
+
+def store_path(pointfile, group=BASE):
+    stem = os.path.splitext(pointfile)[0]
+    return stem + ".pnts" if group == BASE else "{}.{}.pnts".format(stem, group)
+
+
+def _align(n):
+    return (n + ALIGN - 1) // ALIGN * ALIGN
+
+
+def read_header(path):
+    with open(path, "rb") as f:
+        assert f.read(len(MAGIC)) == MAGIC, "{} is not a point store".format(path)
+        header_len = int(np.frombuffer(f.read(8), dtype="<u8")[0])
+        return json.loads(f.read(header_len).decode("utf-8"))
+
+
+def read_store(path, groups=None):
+    # {group: {column: memmap}}, copy-on-write so torch.as_tensor doesn't complain about read-only buffers
+    header = read_header(path)
+    out = {}
+    for group, columns in header.items():
+        if groups is not None and group not in groups:
+            continue
+        out[group] = {}
+        for name, col in columns.items():
+            if int(np.prod(col["shape"])) == 0:
+                out[group][name] = np.zeros(col["shape"], dtype=col["dtype"])
+            else:
+                out[group][name] = np.memmap(path, dtype=col["dtype"], mode="c", offset=col["offset"], shape=tuple(col["shape"]))
+    return out
+
+
+def write_store(path, groups):
+    header, arrays = {}, []
+    for group, columns in groups.items():
+        header[group] = {}
+        for name, arr in columns.items():
+            arr = np.ascontiguousarray(arr)
+            header[group][name] = {"dtype": arr.dtype.str, "shape": list(arr.shape), "offset": 0}
+            arrays.append((group, name, arr))
+    # offsets depend on the header size, which depends on the offsets' digits: fix them with a generous header
+    header_len = len(json.dumps(header).encode("utf-8")) + 32 * len(arrays) + 64
+    offset = _align(len(MAGIC) + 8 + header_len)
+    for group, name, arr in arrays:
+        header[group][name]["offset"] = offset
+        offset = _align(offset + arr.nbytes)
+    header_bytes = json.dumps(header).encode("utf-8").ljust(header_len)
+
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    # per-process temp file, concurrent writers must not share it
+    tmp = "{}.{}.tmp".format(path, os.getpid())
+    with open(tmp, "wb") as f:
+        f.write(MAGIC)
+        f.write(np.asarray([header_len], dtype="<u8").tobytes())
+        f.write(header_bytes)
+        for group, name, arr in arrays:
+            f.seek(header[group][name]["offset"])
+            f.write(arr.tobytes())
+        f.truncate(offset)
+    os.replace(tmp, path)
+
+
+def pack_columns(pnts):
+    # base points of the legacy text layout, kept as one float32 block
+    return {"packed": np.asarray(pnts, dtype=np.float32).reshape(len(pnts), -1)}
+
+
+def split_columns(pnts):
+    # views of the legacy text layout: xyz, xyz+confidence, xyz+rgb, xyz+confidence+rgb
+    columns = {"xyz": pnts[:, :3]}
+    if pnts.shape[1] in [4, 7]:
+        columns["confidence"] = pnts[:, 3:4]
+    if pnts.shape[1] in [6, 7]:
+        columns["rgb"] = pnts[:, -3:]
+    elif pnts.shape[1] not in [3, 4]:
+        columns["extra"] = pnts[:, 3:]
+    return columns
+
+
+def merge_columns(columns):
+    # float32 [N, C] in the legacy layout: the packed block itself (no copy), or the columns concatenated
+    if "packed" in columns:
+        return columns["packed"]
+    order = [name for name in ["xyz", "confidence", "extra", "rgb"] if name in columns]
+    return np.concatenate([np.asarray(columns[name], dtype=np.float32) for name in order], axis=-1)
+
+
+def convert_txt(pointfile):
+    path = store_path(pointfile)
+    print("converting {} to {}".format(pointfile, path))
+    write_store(path, {BASE: pack_columns(np.loadtxt(pointfile, delimiter=";", ndmin=2))})
+    return path
+
+
+def load_points(pointfile, group=BASE):
+    # columns of group, or None if neither its store nor (for the base points) a legacy .txt exists
+    path = store_path(pointfile, group)
+    if not os.path.exists(path):
+        if group != BASE or not (pointfile.endswith(".txt") and os.path.exists(pointfile)):
+            return None
+        convert_txt(pointfile)
+    columns = read_store(path, groups=[group]).get(group)
+    if columns is not None and "packed" in columns:
+        columns.update(split_columns(columns["packed"]))
+    return columns
+
+
+def save_points(pointfile, columns, group=BASE):
+    path = store_path(pointfile, group)
+    if group == BASE:
+        # new base points invalidate every derived level
+        for derived in glob.glob(glob.escape(os.path.splitext(pointfile)[0]) + ".*.pnts"):
+            os.remove(derived)
+    write_store(path, {group: columns})
+    return path
@@ -37,6 +37,14 @@ def config_parser(cmd=None):
                         help='thresholds for depth merge')
     parser.add_argument("--geo_cnsst_num", type=int, default=0,
                         help='number views required for passing depth merge threshold')
+    parser.add_argument("--geo_src_views", type=int, default=0,
+                        help='source views checked per reference view in depth merge, the best overlapping ones; 0 for all views')
+    parser.add_argument("--mvs_batch", type=int, default=1,
+                        help='reference views per mvs forward when generating points')
+    parser.add_argument("--mvs_prefetch", type=int, default=2,
+                        help='mvs samples prepared ahead by a background thread, 0 to prepare them inline')
+    parser.add_argument("--mvs_feature_cache", type=int, default=32,
+                        help='mvs image features kept by view id for the reference views that reuse them')
     parser.add_argument("--inall_img", type=int, default=1,
                         help='force points in all image during alpha masking')
     parser.add_argument("--default_conf", type=float, default=0.15,
@@ -220,6 +228,16 @@ def config_parser(cmd=None):
                         type=int,
                         default=0)
     # logging/saving options
+    parser.add_argument("--metrics_batch", type=int, default=8,
+                        help='test frames per batched ssim / lpips evaluation')
+    parser.add_argument("--metrics_async", type=int, default=1,
+                        help='compute ssim / lpips on a worker thread while the next test frames render')
+    parser.add_argument("--write_workers", type=int, default=4,
+                        help='threads encoding the evaluation pngs')
+    parser.add_argument("--render_tile", type=int, default=0,
+                        help='render test images in tiles of this many pixels, skipping tiles that see no covered space; 0 for flat ray chunks')
+    parser.add_argument("--alpha_batch", type=int, default=1 << 22,
+                        help='grid cells evaluated per batch when updating the alpha mask')
     parser.add_argument("--N_vis", type=int, default=5,
                         help='N images to vis')
     parser.add_argument("--vis_every", type=int, default=10000,
@@ -40,6 +40,14 @@ def config_parser(cmd=None):
                         help='thresholds for depth merge')
     parser.add_argument("--geo_cnsst_num", type=int, default=0,
                         help='number views required for passing depth merge threshold')
+    parser.add_argument("--geo_src_views", type=int, default=0,
+                        help='source views checked per reference view in depth merge, the best overlapping ones; 0 for all views')
+    parser.add_argument("--mvs_batch", type=int, default=1,
+                        help='reference views per mvs forward when generating points')
+    parser.add_argument("--mvs_prefetch", type=int, default=2,
+                        help='mvs samples prepared ahead by a background thread, 0 to prepare them inline')
+    parser.add_argument("--mvs_feature_cache", type=int, default=32,
+                        help='mvs image features kept by view id for the reference views that reuse them')
     parser.add_argument("--inall_img", type=int, default=1,
                         help='force points in all image during alpha masking')
     parser.add_argument("--default_conf", type=float, default=0.15,
@@ -171,6 +179,8 @@ def config_parser(cmd=None):
     parser.add_argument("--KNN", type=int, default=1, help="if use KNN for sampling")
     parser.add_argument("--rot_KNN", type=int, default=None, help="if use KNN for sampling during rotation optimization")
 
+    parser.add_argument("--scene_cache", type=int, default=0, help='reuse the preprocessed points / clusters and the initial ray mask across runs with the same data and preprocessing args')
+    parser.add_argument("--scene_cache_dir", type=str, default=None, help='where to keep the scene cache, default <basedir>/scene_cache')
     parser.add_argument("--margin", type=int, default=0, help="exclude number of pixel on edge for scannet during train, due to cam distortion")
     parser.add_argument("--test_margin", type=int, default=0, help="number of pixel on edge for scannet during test, due to cam distortion")
     parser.add_argument("--radiance_add", type=int, default=0, help="1, add radiance feature; 0, cat radiance feature")
@@ -308,6 +318,26 @@ def config_parser(cmd=None):
     parser.add_argument('--cluster_num', type=int, action="append", default=None)
     parser.add_argument('--idx_view', type=int, default=0)
     # logging/saving options
+    parser.add_argument("--metrics_batch", type=int, default=8,
+                        help='test frames per batched ssim / lpips evaluation')
+    parser.add_argument("--metrics_async", type=int, default=1,
+                        help='compute ssim / lpips on a worker thread while the next test frames render')
+    parser.add_argument("--write_workers", type=int, default=4,
+                        help='threads encoding the evaluation pngs')
+    parser.add_argument("--render_tile", type=int, default=0,
+                        help='render test images in tiles of this many pixels, skipping tiles that see no covered space; 0 for flat ray chunks')
+    parser.add_argument("--importance_sampling", type=int, default=0,
+                        help='draw training rays in proportion to the recent error of their pixel tile instead of uniformly (single process)')
+    parser.add_argument("--importance_tile", type=int, default=64,
+                        help='consecutive rays sharing one error statistic')
+    parser.add_argument("--importance_uniform", type=float, default=0.25,
+                        help='share of every batch still drawn uniformly')
+    parser.add_argument("--importance_decay", type=float, default=0.9,
+                        help='decay of the per-tile error moving average')
+    parser.add_argument("--sample_budget", type=int, default=0,
+                        help='max samples per training batch, the longest rays lose their far samples beyond it and are left out of the loss (counted in the progress bar); 0 for unbounded')
+    parser.add_argument("--alpha_batch", type=int, default=1 << 22,
+                        help='grid cells evaluated per batch when updating the alpha mask')
     parser.add_argument("--N_vis", type=int, default=5,
                         help='N images to vis')
     parser.add_argument("--vis_every", type=int, default=10000,
@@ -32,6 +32,12 @@ def config_parser(cmd=None):
                         type=str,
                         default='0',
                         help='gpu ids: e.g. 0  0,1,2, 0,2. use -1 for CPU')
+    parser.add_argument('--kernel_backend', type=str, default='auto',
+                        choices=['auto', 'cuda', 'cpu'],
+                        help='search/render kernels: cuda extensions, pytorch cpu reference, or auto by device')
+    parser.add_argument('--line_gather', type=str, default='eager',
+                        choices=['eager', 'fused', 'compile'],
+                        help='line feature gather: advanced indexing, fused gather + product with a scatter backward, or the fused op under torch.compile')
     # mvs options
     parser.add_argument('--mvs_model', type=str, default='mvs_points',
                         choices=['mvs_points'])
@@ -39,6 +45,20 @@ def config_parser(cmd=None):
                         help='thresholds for depth merge')
     parser.add_argument("--geo_cnsst_num", type=int, default=0,
                         help='number views required for passing depth merge threshold')
+    parser.add_argument("--geo_src_views", type=int, default=0,
+                        help='source views checked per reference view in depth merge, the best overlapping ones; 0 for all views')
+    parser.add_argument("--mvs_batch", type=int, default=1,
+                        help='reference views per mvs forward when generating points')
+    parser.add_argument("--mvs_prefetch", type=int, default=2,
+                        help='mvs samples prepared ahead by a background thread, 0 to prepare them inline')
+    parser.add_argument("--mvs_feature_cache", type=int, default=32,
+                        help='mvs image features kept by view id for the reference views that reuse them')
+    parser.add_argument("--fusion_mode", type=str, default="batch", choices=["batch", "stream"],
+                        help='batch: filter the mvs points after all views are generated, stream: fuse every view into voxel accumulators as it is generated')
+    parser.add_argument("--fusion_window", type=int, default=4,
+                        help='neighbor views on each side a view is checked against in stream fusion')
+    parser.add_argument("--fusion_vox", type=float, default=0.0,
+                        help='voxel size of the stream fused point cloud, 0 for a quarter of the finest vox_range')
     parser.add_argument("--inall_img", type=int, default=1,
                         help='force points in all image during alpha masking')
     parser.add_argument("--default_conf", type=float, default=0.15,
@@ -122,7 +142,19 @@ def config_parser(cmd=None):
     parser.add_argument("--rot_step", type=int, default=None, action="append")
     parser.add_argument("--unit_lvl", type=int, default=0, help='which lvl we take grid unit')
     parser.add_argument("--filterall", type=int, default=0, help='if only keep when all lvl covers or any lvl covers')
+    parser.add_argument("--sparse_cvrg", type=int, default=0, help='keep the coverage maps as sorted keys of occupied cells instead of dense gridSize volumes')
     parser.add_argument("--rnd_ray", type=int, default=0, help='input data directory')
+    parser.add_argument("--distributed", type=int, default=0, help='data-parallel training over the processes launched by torchrun')
+    parser.add_argument("--dist_backend", type=str, default=None, choices=['gloo', 'nccl'], help='default nccl with cuda, gloo otherwise')
+    parser.add_argument("--model_parallel", type=int, default=0, help='with --distributed, split the tensoRFs into spatial bricks owned by the ranks instead of replicating the model')
+    parser.add_argument("--scene_cache", type=int, default=0, help='reuse the preprocessed points / clusters and the initial ray mask across runs with the same data and preprocessing args')
+    parser.add_argument("--scene_cache_dir", type=str, default=None, help='where to keep the scene cache, default <basedir>/scene_cache')
+    parser.add_argument("--stream_rays", type=int, default=0, help='keep the training images as a uint8 cache and generate rays per batch instead of materializing all_rays / all_rgbs')
+    parser.add_argument("--load_workers", type=int, default=0, help='threads decoding and resizing the dataset images, 0 for cpu count + 4')
+    parser.add_argument("--frame_select", type=int, default=0, help='scannet: train on the sharpest frame of every 5 instead of every 5th frame, skipping near duplicate poses')
+    parser.add_argument("--frame_workers", type=int, default=0, help='processes scoring frame blur, 0 for all cores')
+    parser.add_argument("--frame_min_dist", type=float, default=0.0, help='with --frame_select, drop frames closer than this to a sharper selected one (0 for no distance test)...')
+    parser.add_argument("--frame_min_angle", type=float, default=0.0, help='...and within this many degrees of its view direction (0 for no angle test)')
 
     parser.add_argument("--ji", type=int, default=0)
     parser.add_argument("--rot_KNN", type=int, default=None, help="if use KNN for sampling during rotation optimization")
@@ -266,6 +298,34 @@ def config_parser(cmd=None):
                         type=int,
                         default=0)
     # logging/saving options
+    parser.add_argument("--metrics_batch", type=int, default=8,
+                        help='test frames per batched ssim / lpips evaluation')
+    parser.add_argument("--metrics_async", type=int, default=1,
+                        help='compute ssim / lpips on a worker thread while the next test frames render')
+    parser.add_argument("--write_workers", type=int, default=4,
+                        help='threads encoding the evaluation pngs')
+    parser.add_argument("--render_tile", type=int, default=0,
+                        help='render test images in tiles of this many pixels, skipping tiles that see no covered space; 0 for flat ray chunks')
+    parser.add_argument("--ert_thresh", type=float, default=0,
+                        help='at test time stop evaluating density along a ray once its transmittance is below this; 0 to disable, <= 1e-3 renders the same images')
+    parser.add_argument("--ert_steps", type=int, default=64,
+                        help='samples per ray marched between early termination checks')
+    parser.add_argument("--skip_empty", type=int, default=0,
+                        help='sample rays through a coverage pyramid that skips empty blocks of steps, same samples as the uniform march')
+    parser.add_argument("--skip_block", type=int, default=64,
+                        help='steps per block of the empty space skipping, rounded up to a power of two')
+    parser.add_argument("--importance_sampling", type=int, default=0,
+                        help='draw training rays in proportion to the recent error of their pixel tile instead of uniformly (single process)')
+    parser.add_argument("--importance_tile", type=int, default=64,
+                        help='consecutive rays sharing one error statistic')
+    parser.add_argument("--importance_uniform", type=float, default=0.25,
+                        help='share of every batch still drawn uniformly')
+    parser.add_argument("--importance_decay", type=float, default=0.9,
+                        help='decay of the per-tile error moving average')
+    parser.add_argument("--sample_budget", type=int, default=0,
+                        help='max samples per training batch, the longest rays lose their far samples beyond it and are left out of the loss (counted in the progress bar); 0 for unbounded')
+    parser.add_argument("--alpha_batch", type=int, default=1 << 22,
+                        help='grid cells evaluated per batch when updating the alpha mask')
     parser.add_argument("--N_vis", type=int, default=5,
                         help='N images to vis')
     parser.add_argument("--vis_every", type=int, default=10000,
@@ -23,7 +23,7 @@ def gen_geo(args):
     if geo is None:
         print("Do MVS to create pointfile at ", args.pointfile)
         dataset = mvs_dataset_dict[args.dataset_name]
-        mvs_dataset = dataset(args.datadir, split='train', downsample=args.downsample_train, is_stack=False)
+        mvs_dataset = dataset(args.datadir, split='train', downsample=args.downsample_train, is_stack=False, args=args)
         model = create_mvs_model(args)
         xyz_world_all, confidence_filtered_all = gen_points_filter(mvs_dataset, args, model)
         geo = torch.cat([xyz_world_all, confidence_filtered_all], dim=-1)
@@ -57,10 +57,8 @@ def gen_points_filter(dataset, args, model):
     imgs_lst, HDWD_lst, c2ws_lst, w2cs_lst, intrinsics_lst = [],[],[],[],[]
 
     with torch.no_grad():
-        for i in tqdm(range(0, len(dataset.view_id_list))):
-            data = dataset.get_init_item(i)
+        for i, data, (points_xyz_lst, _, photometric_confidence_lst, point_mask_lst, HDWD, data_mvs, intrinsics_lst, extrinsics_lst) in model.gen_points_views(dataset):
             # intrinsics    1, 3, 3, 3
-            points_xyz_lst, photometric_confidence_lst, point_mask_lst, HDWD, data_mvs, intrinsics_lst, extrinsics_lst = model.gen_points(data)
 
             c2ws, w2cs, intrinsics, near_fars = data_mvs['c2ws'], data_mvs['w2cs'], data["intrinsics"], data["near_fars"]
 
@@ -6,7 +6,7 @@ sys.path.append(os.path.join(pathlib.Path(__file__).parent.parent.absolute(), '.
 import torch
 import torch_cluster
 import numpy as np
-from mvs import mvs_utils, filter_utils
+from mvs import mvs_utils, filter_utils, point_store
 torch.manual_seed(0)
 np.random.seed(0)
 from tqdm import tqdm
@@ -17,10 +17,11 @@ from collections import defaultdict
 from preprocessing.boxing import find_tensorf_box, filter_cluster_n_pnts
 
 def load(pointfile):
-    if os.path.exists(pointfile):
-        return torch.as_tensor(np.loadtxt(pointfile, delimiter=";"), dtype=torch.float32)
-    else:
+    columns = point_store.load_points(pointfile)
+    if columns is None:
         return None
+    # view of the memmapped block, nothing is copied until it moves to the device
+    return torch.as_tensor(point_store.merge_columns(columns), dtype=torch.float32)
 
 
 def gen_pnts(args):
@@ -46,13 +47,13 @@ def gen_geo(args, pnts=None):
     if pnts is None:
         print("Do MVS to create pointfile at ", args.pointfile)
         dataset = mvs_dataset_dict[args.dataset_name]
-        mvs_dataset = dataset(args.datadir, split='train', downsample=args.downsample_train, is_stack=False)
+        mvs_dataset = dataset(args.datadir, split='train', downsample=args.downsample_train, is_stack=False, args=args)
         model = create_mvs_model(args)
         xyz_world_all, confidence_filtered_all, rgb_all = gen_points_filter(mvs_dataset, args, model)
         # geo = torch.cat([xyz_world_all, confidence_filtered_all], dim=-1)
         pnts = torch.cat([xyz_world_all, torch.as_tensor(rgb_all * 255, device=xyz_world_all.device)], dim=-1)
         os.makedirs(os.path.dirname(args.pointfile), exist_ok=True)
-        np.savetxt(args.pointfile, pnts.cpu().numpy(), delimiter=";")
+        point_store.save_points(args.pointfile, point_store.pack_columns(pnts.cpu().numpy()))
     else:
         print("successfully loaded args.pointfile at : ", args.pointfile, pnts.shape)
         if args.ranges[0] > -90.0:
@@ -145,10 +146,8 @@ def gen_points_filter(dataset, args, model):
     rgb_all, HDWD_lst, c2ws_lst, w2cs_lst, intrinsics_lst = [],[],[],[],[]
 
     with torch.no_grad():
-        for i in tqdm(range(0, len(dataset.view_id_list))):
-            data = dataset.get_init_item(i)
+        for i, data, (points_xyz_lst, xyz_color_lst, photometric_confidence_lst, point_mask_lst, HDWD, data_mvs, intrinsics_lst, extrinsics_lst) in model.gen_points_views(dataset):
             # intrinsics    1, 3, 3, 3
-            points_xyz_lst, xyz_color_lst, photometric_confidence_lst, point_mask_lst, HDWD, data_mvs, intrinsics_lst, extrinsics_lst = model.gen_points(data)
 
             c2ws, w2cs, intrinsics, near_fars = data_mvs['c2ws'], data_mvs['w2cs'], data["intrinsics"], data["near_fars"]
 
@@ -4,8 +4,10 @@ import pathlib
 sys.path.append(os.path.join(pathlib.Path(__file__).parent.absolute(), '..'))
 import torch
 import torch_cluster
+import hashlib
 import numpy as np
-from mvs import mvs_utils, filter_utils
+from mvs import mvs_utils, filter_utils, point_store
+from mvs.point_fusion import VoxelAccumulator
 torch.manual_seed(0)
 np.random.seed(0)
 from tqdm import tqdm
@@ -13,15 +15,32 @@ from utils import masking, create_mvs_model
 from dataLoader import mvs_dataset_dict
 
 def load(pointfile):
-    if os.path.exists(pointfile):
-        return torch.as_tensor(np.loadtxt(pointfile, delimiter=";"), dtype=torch.float32)
-    else:
+    columns = point_store.load_points(pointfile)
+    if columns is None:
         return None
+    # view of the memmapped block, nothing is copied until it moves to the device
+    return torch.as_tensor(point_store.merge_columns(columns), dtype=torch.float32)
+
+def level_store(args):
+    # the voxelized levels live next to the pointfile; depth points have no file of their own, keep them with the run
+    if args.pointfile == 'depth':
+        return os.path.join(args.basedir, args.expname, "depth")
+    return args.pointfile
+
+def geo_digest(args, geo):
+    # levels derive from the (cropped) source points, a new cloud or crop must not hit the old ones
+    digest = hashlib.sha1(np.ascontiguousarray(geo[..., :3].cpu().numpy()).tobytes())
+    digest.update(str(list(args.ranges)).encode("utf-8"))
+    return digest.hexdigest()[:16]
 
-def gen_geo(args):
+def vox_group(args, i, digest):
+    return "vox_{}_{}_{}".format("_".join(str(v) for v in args.vox_range[i]), args.vox_center[i], digest)
+
+def gen_geo(args, device="cuda"):
+    # device: where the returned levels live; MVS generation of a missing pointfile still needs cuda
     if args.pointfile.endswith('ply'):
         # points_path = os.path.join(self.root_dir, "exported/pcd.ply")
-        geo = mvs_utils.load_ply_points(args)
+        geo = mvs_utils.load_ply_points(args, device=device)
     elif args.pointfile == 'depth':
         colordir = os.path.join(args.datadir, "exported/color")
         image_paths = [f for f in os.listdir(colordir) if os.path.isfile(os.path.join(colordir, f))]
@@ -30,29 +49,42 @@ def gen_geo(args):
         all_id_list = mvs_utils.filter_valid_id(args, list(range(len(image_paths))))
         depth_intrinsic = np.loadtxt(
             os.path.join(args.datadir, "exported/intrinsic/intrinsic_depth.txt")).astype(np.float32)[:3, :3]
-        geo = mvs_utils.load_init_depth_points(args, all_id_list, depth_intrinsic, device="cuda")
+        geo = mvs_utils.load_init_depth_points(args, all_id_list, depth_intrinsic, device=device)
         # np.savetxt(os.path.join(args.basedir, args.expname, "depth.txt"), geo.cpu().numpy(), delimiter=";")
     else:
         geo = load(args.pointfile)
     if geo is None:
         print("Do MVS to create pointfile at ", args.pointfile)
         dataset = mvs_dataset_dict[args.dataset_name]
-        mvs_dataset = dataset(args.datadir, split='train', downsample=args.downsample_train, is_stack=False)
+        mvs_dataset = dataset(args.datadir, split='train', downsample=args.downsample_train, is_stack=False, args=args)
         model = create_mvs_model(args)
-        xyz_world_all, confidence_filtered_all = gen_points_filter(mvs_dataset, args, model)
+        if getattr(args, "fusion_mode", "batch") == "stream":
+            xyz_world_all, confidence_filtered_all, geo_lvls = gen_points_fuse(mvs_dataset, args, model)
+        else:
+            (xyz_world_all, confidence_filtered_all), geo_lvls = gen_points_filter(mvs_dataset, args, model), []
         geo = torch.cat([xyz_world_all, confidence_filtered_all], dim=-1)
         os.makedirs(os.path.dirname(args.pointfile), exist_ok=True)
-        np.savetxt(args.pointfile, geo.cpu().numpy(), delimiter=";")
+        point_store.save_points(args.pointfile, point_store.pack_columns(geo.cpu().numpy()))
+        # stream fusion already voxelized the levels
+        digest = geo_digest(args, geo) if len(geo_lvls) > 0 else None
+        for i, geo_lvl in enumerate(geo_lvls):
+            point_store.save_points(level_store(args), {"xyz": geo_lvl.cpu().numpy()}, group=vox_group(args, i, digest))
     else:
         print("successfully loaded args.pointfile at : ", args.pointfile, geo.shape)
     geo_lst = []
     if args.vox_range is not None and not args.pointfile[:-4].endswith("vox"):
         geo_xyz, confidence = geo[..., :3], geo[..., -1:]
+        digest = geo_digest(args, geo)
         for i in range(len(args.vox_range)):
-            geo_lvl, _, _, _ = mvs_utils.construct_voxrange_points_mean(geo_xyz, torch.as_tensor(args.vox_range[i], dtype=torch.float32, device=geo.device), vox_center=args.vox_center[i]>0)
-            # print("after vox geo shape", geo_lvl.shape)
-            np.savetxt(args.pointfile[:-4] + "_{}_vox".format(args.vox_range[i][0]) + ".txt", geo_lvl.cpu().numpy(), delimiter=";")
-            geo_lst.append(geo_lvl.cuda())
+            group = vox_group(args, i, digest)
+            columns = point_store.load_points(level_store(args), group=group)
+            if columns is not None:
+                geo_lvl = torch.as_tensor(columns["xyz"])
+            else:
+                geo_lvl, _, _, _ = mvs_utils.construct_voxrange_points_mean(geo_xyz, torch.as_tensor(args.vox_range[i], dtype=torch.float32, device=geo.device), vox_center=args.vox_center[i]>0)
+                # print("after vox geo shape", geo_lvl.shape)
+                point_store.save_points(level_store(args), {"xyz": geo_lvl.cpu().numpy()}, group=group)
+            geo_lst.append(geo_lvl.to(device))
 
     if args.fps_num is not None:
         for i in range(len(args.fps_num)):
@@ -60,8 +92,7 @@ def gen_geo(args):
                 fps_inds = torch_cluster.fps(geo_lst[i][...,:3], ratio=args.fps_num[i]/len(geo_lst[i]), random_start=True)
                 geo_lvl = geo_lst[i][fps_inds, ...]
                 print("fps_inds", fps_inds.shape, geo_lvl.shape)
-                np.savetxt(args.pointfile[:-4]+"_{}".format(args.fps_num)+".txt", geo_lvl.cpu().numpy(), delimiter=";")
-                geo_lst[i] = geo_lvl.cuda()
+                geo_lst[i] = geo_lvl.to(device)
     return geo_lst
 
 
@@ -78,10 +109,8 @@ def gen_points_filter(dataset, args, model):
     imgs_lst, HDWD_lst, c2ws_lst, w2cs_lst, intrinsics_lst = [],[],[],[],[]
 
     with torch.no_grad():
-        for i in tqdm(range(0, len(dataset.view_id_list))):
-            data = dataset.get_init_item(i)
+        for i, data, (points_xyz_lst, _, photometric_confidence_lst, point_mask_lst, HDWD, data_mvs, intrinsics_lst, extrinsics_lst) in model.gen_points_views(dataset):
             # intrinsics    1, 3, 3, 3
-            points_xyz_lst, photometric_confidence_lst, point_mask_lst, HDWD, data_mvs, intrinsics_lst, extrinsics_lst = model.gen_points(data)
 
             c2ws, w2cs, intrinsics, near_fars = data_mvs['c2ws'], data_mvs['w2cs'], data["intrinsics"], data["near_fars"]
 
@@ -138,4 +167,62 @@ def gen_points_filter(dataset, args, model):
             print("after voxelize:", xyz_world_all.shape, points_vid.shape)
             xyz_world_all = xyz_world_all.cuda()
 
-    return xyz_world_all, confidence_filtered_all[..., None]
\ No newline at end of file
+    return xyz_world_all, confidence_filtered_all[..., None]
+
+
+def gen_points_fuse(dataset, args, model):
+    # streaming counterpart of gen_points_filter, see mvs/point_fusion.py. Returns the fused points, their confidence
+    # and the points of every --vox_range level
+    window = args.fusion_window
+    if args.fusion_vox > 0:
+        fusion_vox = args.fusion_vox
+    elif args.vox_range is not None:
+        fusion_vox = min(min(vox_range) for vox_range in args.vox_range) / 4
+    else:
+        raise ValueError("--fusion_mode stream needs --fusion_vox or --vox_range")
+    origin = getattr(dataset, "spacemin", None)
+    fused = VoxelAccumulator(fusion_vox, origin)
+    lvls = [VoxelAccumulator(vox_range, origin) for vox_range in args.vox_range] if args.vox_range is not None else []
+    # view index -> cam_xyz [C, H, W, 3], intrinsics, extrinsics, confidence, points mask; at most 2 * window + 1 views
+    views = {}
+
+    def fuse(i):
+        ids = [j for j in range(i - window, i + window + 1) if j in views]
+        cam_xyz_all, intrinsics_all, extrinsics_all, confidence_all, points_mask_all = [[views[j][k] for j in ids] for k in range(5)]
+        ref = ids.index(i)
+        src_views = filter_utils.select_source_views(cam_xyz_all, intrinsics_all, extrinsics_all, args.geo_src_views)[ref]
+        _, xyz_world, confidence, _ = filter_utils.filter_view_gpu(ref, src_views, cam_xyz_all, intrinsics_all, extrinsics_all, confidence_all, points_mask_all, args)
+        if getattr(dataset, "spacemin", None) is not None:
+            mask = (xyz_world - dataset.spacemin[None, ...].to(xyz_world.device)) >= 0
+            mask *= (dataset.spacemax[None, ...].to(xyz_world.device) - xyz_world) >= 0
+            mask = torch.prod(mask, dim=-1) > 0
+            xyz_world, confidence = xyz_world[mask], confidence[mask]
+        if getattr(dataset, "alphas", None) is not None:
+            vishull_mask = mvs_utils.alpha_masking(xyz_world, dataset.alphas, dataset.intrinsics, dataset.cam2worlds, dataset.world2cams, dataset.near_far if args.ranges[0] < -90.0 and getattr(dataset,"spacemin",None) is None else None, args=args)
+            xyz_world, confidence = xyz_world[vishull_mask], confidence[vishull_mask]
+        for acc in [fused] + lvls:
+            acc.add(xyz_world, confidence)
+
+    n = len(dataset.view_id_list)
+    with torch.no_grad():
+        for i, data, (points_xyz_lst, _, photometric_confidence_lst, point_mask_lst, HDWD, data_mvs, intrinsics_lst, extrinsics_lst) in model.gen_points_views(dataset):
+            B, N, C, H, W, _ = points_xyz_lst[0].shape
+            views[i] = (points_xyz_lst[0].view(C, H, W, 3), intrinsics_lst[0], extrinsics_lst[0], photometric_confidence_lst[0], point_mask_lst[0])
+            # view i - window now has all its neighbors, and view i - 2 * window is no one's neighbor anymore
+            if i >= window:
+                fuse(i - window)
+                views.pop(i - 2 * window, None)
+        for i in range(max(0, n - window), n):
+            fuse(i)
+        views.clear()
+        torch.cuda.empty_cache()
+
+        xyz_world_all, confidence_filtered_all = fused.points()
+        print("fused xyz_world_all", xyz_world_all.shape, "voxels of", fusion_vox)
+        if args.vox_res > 0:
+            xyz_world_all, _, sampled_pnt_idx = mvs_utils.construct_vox_points_closest(xyz_world_all, args.vox_res)
+            confidence_filtered_all = confidence_filtered_all[sampled_pnt_idx]
+            print("after voxelize:", xyz_world_all.shape)
+        geo_lvls = [lvl.points(vox_center=args.vox_center[i] > 0)[0] for i, lvl in enumerate(lvls)]
+
+    return xyz_world_all, confidence_filtered_all[..., None], geo_lvls
@@ -0,0 +1,133 @@
+import os
+import json
+import pickle
+import hashlib
+import numpy as np
+import torch
+
+''' Persistent cache of the preprocessed scene
+Entries are content addressed: the key hashes the dataset directory (relative path, size and mtime of every input
+file, not the files the pipeline writes there itself), the point file, and the args the preprocessing step reads, so
+changing any of them misses instead of serving stale data, while runs that only change training args (lr, n_iters,
+TV weights, ...) hit.
+    geo:  geo_lst of train_hier / (cluster_dict, pnts) of train_adapt
+    rays: the initial ray mask (and per-ray tensoRF assignment) of filtering_rays, also keyed on the rays it masks and on
+          the model's aabb, units, step size and coverage map
+Enable with --scene_cache 1; entries go to --scene_cache_dir (default <basedir>/scene_cache) and can be deleted at any time.
+'''
+GEO_ARGS = ["dataset_name", "pointfile", "pretrained_mvs_ckpt", "downsample_train", "ranges", "use_geo", "vox_res", "vox_range",
+            "vox_center", "fps_num", "dilation_ratio", "cluster_method", "cluster_num", "boxing_method", "depth_conf_thresh",
+            "geo_cnsst_num", "geo_src_views", "fusion_mode", "fusion_window", "fusion_vox", "default_conf", "inall_img", "ub360"]
+RAY_ARGS = ["dataset_name", "downsample_train", "margin", "ub360", "ray_type", "tensoRF_shape", "filterall"]
+# written into the dataset directory by the pipeline: blur score cache, point stores, temp files
+OUTPUT_SUFFIXES = ("blur_scores.npz", ".pnts", ".tmp", ".tmp.npz")
+
+
+def fingerprint(path):
+    # (relative path, size, mtime) of path, or of every input file under it
+    if path is None or not os.path.exists(path):
+        return [path]
+    if os.path.isfile(path):
+        stat = os.stat(path)
+        return [os.path.abspath(path), stat.st_size, stat.st_mtime_ns]
+    entries = []
+    for root, dirs, files in os.walk(path):
+        dirs.sort()
+        for name in sorted(files):
+            if name.endswith(OUTPUT_SUFFIXES):
+                continue
+            stat = os.stat(os.path.join(root, name))
+            entries.append([os.path.relpath(os.path.join(root, name), path), stat.st_size, stat.st_mtime_ns])
+    return [os.path.abspath(path), entries]
+
+
+def tensor_digest(tensor):
+    if tensor is None:
+        return None
+    if hasattr(tensor, "keys"):
+        # cpu_kernels.SparseCvrg
+        return [list(tensor.shape), tensor_digest(tensor.keys)]
+    array = tensor.detach().cpu().numpy() if torch.is_tensor(tensor) else np.asarray(tensor)
+    return [array.dtype.str, list(array.shape), hashlib.sha1(np.ascontiguousarray(array).tobytes()).hexdigest()]
+
+
+def ray_digest(rays):
+    # all_rays tensor, or the images' poses and kept pixel ids of a RayStream
+    if torch.is_tensor(rays):
+        return tensor_digest(rays)
+    return [list(rays.shape), tensor_digest(rays.c2ws), tensor_digest(rays.directions), tensor_digest(rays.pix_ids), _jsonable(rays.ndc)]
+
+
+def _jsonable(value):
+    if torch.is_tensor(value) or isinstance(value, np.ndarray):
+        return np.asarray(value.cpu() if torch.is_tensor(value) else value).tolist()
+    if isinstance(value, (list, tuple)):
+        return [_jsonable(v) for v in value]
+    return value
+
+
+def scene_key(args, names, *extra):
+    content = {name: _jsonable(getattr(args, name, None)) for name in names}
+    content["datadir"] = fingerprint(args.datadir)
+    if args.pointfile is not None and os.path.isfile(args.pointfile):
+        content["pointfile"] = fingerprint(args.pointfile)
+    content["extra"] = _jsonable(list(extra))
+    return hashlib.sha1(json.dumps(content, sort_keys=True, default=str).encode("utf-8")).hexdigest()
+
+
+def geo_key(args):
+    # dvgo density points (use_geo < 0) depend on the pre_* training args as well
+    names = GEO_ARGS + sorted(name for name in vars(args) if name.startswith("pre_")) if args.use_geo < 0 else GEO_ARGS
+    return scene_key(args, names)
+
+
+def ray_key(args, tensorf, rays):
+    model = [tensor_digest(getattr(tensorf, name, None)) for name in ["aabb", "units", "stepSize", "near_far", "tensoRF_cvrg_filter"]]
+    return scene_key(args, RAY_ARGS, model, ray_digest(rays))
+
+
+def cache_path(args, kind, key):
+    cache_dir = args.scene_cache_dir if args.scene_cache_dir is not None else os.path.join(args.basedir, "scene_cache")
+    return os.path.join(cache_dir, "{}_{}.pkl".format(kind, key[:20]))
+
+
+def _to(obj, device):
+    if torch.is_tensor(obj):
+        return obj.to(device)
+    if isinstance(obj, (list, tuple)):
+        return type(obj)(_to(o, device) for o in obj)
+    if isinstance(obj, dict):
+        return {k: _to(v, device) for k, v in obj.items()}
+    return obj
+
+
+def load(args, kind, key, device="cpu"):
+    if args.scene_cache <= 0:
+        return None
+    path = cache_path(args, kind, key)
+    if not os.path.exists(path):
+        return None
+    with open(path, "rb") as f:
+        obj = pickle.load(f)
+    print("loaded {} from scene cache {}".format(kind, path))
+    return _to(obj, device)
+
+
+def save(args, kind, key, obj):
+    if args.scene_cache <= 0:
+        return
+    path = cache_path(args, kind, key)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    # per-process temp file, every rank of a distributed run writes the same entry
+    tmp = "{}.{}.tmp".format(path, os.getpid())
+    with open(tmp, "wb") as f:
+        pickle.dump(_to(obj, "cpu"), f, protocol=4)
+    os.replace(tmp, path)
+
+
+def cached(args, kind, key, fn, device="cpu"):
+    obj = load(args, kind, key, device=device)
+    if obj is None:
+        obj = fn()
+        save(args, kind, key, obj)
+    return obj
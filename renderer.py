@@ -7,7 +7,10 @@ from models.pointTensoRF_hier import PointTensorCP_hier
 from models.pointTensoRF_adapt import PointTensorCP_adapt
 from models.pointTensoRF_dbasis import PointTensor_DBaseVMGS #,PointTensor_DBase
 from models.archive_pointTensoRF import PointTensorCPB, PointTensorCPD, PointTensorVMSplit
+from models.apparatus import TileCuller
 from utils import *
+from metrics import MetricsEngine
+from frame_writer import FrameWriter
 from dataLoader.ray_utils import ndc_rays_blender
 import random
  
@@ -35,6 +38,36 @@ def OctreeRender_trilinear_fast(rays, tensorf, chunk=4096, N_samples=-1, ray_typ
     return torch.cat(rgbs), torch.cat(weights) if len(weights) > 0 else None, torch.cat(depth_maps) if return_depth else None, torch.cat(rgbpers) if len(rgbpers) > 0 else None, torch.cat(ray_ids) if len(ray_ids) > 0 else None
 
 
+def tile_culler(tensorf, args, ray_type=0):
+    # TileCuller for the coverage sampled models (cube tensoRFs, not ub360 / ndc), else None
+    if getattr(args, "render_tile", 0) <= 0 or ray_type != 0 or getattr(tensorf, "tensoRF_cvrg_filter", None) is None:
+        return None
+    if tensorf.args.tensoRF_shape != "cube" or tensorf.args.ub360 == 1:
+        return None
+    return TileCuller(tensorf)
+
+
+@torch.no_grad()
+def render_tiles(rays, H, W, tensorf, renderer, tile=32, culler=None, white_bg=True, depth_bg=True, device='cuda', **kwargs):
+    # renders the [H * W] row-major rays of one image tile by tile, so every chunk is a compact screen region,
+    # skipping the tiles culler proves empty. Their rays get the background color, and depth 1000 if depth_bg
+    n_tx = (W + tile - 1) // tile
+    tile_id = ((torch.arange(H) // tile)[:, None] * n_tx + (torch.arange(W) // tile)[None, :]).view(-1)
+    order = torch.argsort(tile_id, stable=True)
+    tile_id = tile_id[order].to(device)
+    rays = rays[order].to(device)
+    if culler is not None:
+        keep = culler.visible(rays[:, :3], rays[:, 3:6], tile_id, int(tile_id[-1]) + 1)[tile_id]
+        order, rays = order[keep.cpu()], rays[keep]
+    rgb_map = torch.full([H * W, 3], 1.0 if white_bg else 0.0, device=device)
+    depth_map = torch.full([H * W], 1000.0 if depth_bg else 0.0, device=device)
+    if len(rays) > 0:
+        rgb, _, depth, _, _ = renderer(rays, tensorf, white_bg=white_bg, depth_bg=depth_bg, device=device, **kwargs)
+        rgb_map[order.to(device)] = rgb
+        depth_map[order.to(device)] = depth
+    return rgb_map, None, depth_map, None, None
+
+
 # def den_eval(geo, dataset, allrays, allrgbs, tensorf, args, renderer, N_samples=-1, white_bg=True, ray_type=0,
 #              device="cuda", den_thresh=0.7):
 #     xyz_input, alphas = tensorf.get_grid_centers(), []
@@ -49,8 +82,7 @@ def OctreeRender_trilinear_fast(rays, tensorf, chunk=4096, N_samples=-1, ray_typ
 @torch.no_grad()
 def evaluation(test_dataset, tensorf, args, renderer, savePath=None, N_vis=5, prtx='', N_samples=-1,
                white_bg=False, ray_type=0, compute_extra_metrics=True, device='cuda'):
-    PSNRs, rgb_maps, depth_maps = [], [], []
-    ssims,l_alex,l_vgg=[],[],[]
+    PSNRs = []
     os.makedirs(savePath, exist_ok=True)
     os.makedirs(savePath+"/rgbd", exist_ok=True)
 
@@ -59,6 +91,8 @@ def evaluation(test_dataset, tensorf, args, renderer, savePath=None, N_vis=5, pr
     except Exception:
         pass
 
+    # ssim / lpips of every frame, computed in batches while the next frames render
+    engine = MetricsEngine(tensorf.device, batch=getattr(args, "metrics_batch", 8), asynchronous=getattr(args, "metrics_async", 1) > 0) if compute_extra_metrics and len(test_dataset.all_rgbs) else None
     near_far = test_dataset.near_far
     if len(test_dataset.img_wh) > 2:
        img_eval_interval = 1 if N_vis < 0 else max(len(test_dataset.all_rays) // N_vis,1)
@@ -78,6 +112,9 @@ def evaluation(test_dataset, tensorf, args, renderer, savePath=None, N_vis=5, pr
            else:
               idxs_img.append((np.array(idxs_img_num[idx_k])[:,0]*np.array(idxs_img_num[idx_k])[:,1]).sum())
     
+    culler = tile_culler(tensorf, args, ray_type)
+    # pngs and the videos (full test sets only) are encoded in the background, frame by frame
+    writer = FrameWriter(savePath, prtx, video=img_eval_interval == 1, quality=10, workers=getattr(args, "write_workers", 4))
     img_kk = 0
     for idx, samples in tqdm(enumerate(test_dataset.all_rays[0::img_eval_interval]), file=sys.stdout):
      
@@ -103,7 +140,10 @@ def evaluation(test_dataset, tensorf, args, renderer, savePath=None, N_vis=5, pr
         cur_tensoRF_per_ray = None
         # _, _, cur_tensoRF_per_ray = tensorf.filtering_rays(rays, None, bbox_only=True, apply_filter=False)
     
-        rgb_map, _, depth_map, _, _ = renderer(rays, tensorf, chunk=args.batch_size, N_samples=N_samples, ray_type=ray_type, white_bg = white_bg, device=device, return_depth=1, tensoRF_per_ray = None if cur_tensoRF_per_ray is None else cur_tensoRF_per_ray.cuda() , eval=True)
+        if getattr(args, "render_tile", 0) > 0:
+            rgb_map, _, depth_map, _, _ = render_tiles(rays, H, W, tensorf, renderer, tile=args.render_tile, culler=culler, chunk=args.batch_size, N_samples=N_samples, ray_type=ray_type, white_bg = white_bg, device=device, return_depth=1, eval=True)
+        else:
+            rgb_map, _, depth_map, _, _ = renderer(rays, tensorf, chunk=args.batch_size, N_samples=N_samples, ray_type=ray_type, white_bg = white_bg, device=device, return_depth=1, tensoRF_per_ray = None if cur_tensoRF_per_ray is None else cur_tensoRF_per_ray.to(device), eval=True)
         rgb_map = rgb_map.clamp(0.0, 1.0)
 
         rgb_map, depth_map = rgb_map.reshape(H, W, 3).cpu(), depth_map.reshape(H, W).cpu()
@@ -114,39 +154,25 @@ def evaluation(test_dataset, tensorf, args, renderer, savePath=None, N_vis=5, pr
             loss = torch.mean((rgb_map - gt_rgb) ** 2)
             PSNRs.append(-10.0 * np.log(loss.item()) / np.log(10.0))
 
-            if compute_extra_metrics:
-                ssim = rgb_ssim(rgb_map, gt_rgb, 1)
-                l_a = rgb_lpips(gt_rgb.numpy(), rgb_map.numpy(), 'alex', tensorf.device)
-                l_v = rgb_lpips(gt_rgb.numpy(), rgb_map.numpy(), 'vgg', tensorf.device)
-                ssims.append(ssim)
-                l_alex.append(l_a)
-                l_vgg.append(l_v)
+            if engine is not None:
+                engine.add(f'{prtx}{idx:03d}', rgb_map, gt_rgb)
 
         rgb_map = (rgb_map.numpy() * 255).astype('uint8')
         # rgb_map = np.concatenate((rgb_map, depth_map), axis=1)
-        rgb_maps.append(rgb_map)
-        depth_maps.append(depth_map)
-        if savePath is not None:
-            imageio.imwrite(f'{savePath}/{prtx}{idx:03d}.png', rgb_map)
-            rgb_map = np.concatenate((rgb_map, depth_map), axis=1)
-            imageio.imwrite(f'{savePath}/rgbd/{prtx}{idx:03d}.png', rgb_map)
+        writer.add(idx, rgb_map, depth_map)
+    writer.close()
 
     if PSNRs:
         psnr = np.mean(np.asarray(PSNRs))
-        if compute_extra_metrics:
-            ssim = np.mean(np.asarray(ssims))
-            l_a = np.mean(np.asarray(l_alex))
-            l_v = np.mean(np.asarray(l_vgg))
+        if engine is not None:
+            mean = engine.save(f'{savePath}/{prtx}metrics.json', psnr=PSNRs)
+            ssim, l_a, l_v = mean["ssim"], mean["lpips_alex"], mean["lpips_vgg"]
             np.savetxt(f'{savePath}/{prtx}mean.txt', np.asarray([psnr, ssim, l_a, l_v]))
             print(f'{savePath}/{prtx}mean.txt', " psnr:{}, ssim:{}".format(psnr, ssim))
         else:
             np.savetxt(f'{savePath}/{prtx}mean.txt', np.asarray([psnr]))
             print(f'{savePath}/{prtx}mean.txt', " psnr:{}".format(psnr))
 
-    if img_eval_interval == 1:
-        imageio.mimwrite(f'{savePath}/{prtx}video.mp4', np.stack(rgb_maps), fps=30, quality=10)
-        imageio.mimwrite(f'{savePath}/{prtx}depthvideo.mp4', np.stack(depth_maps), fps=30, quality=10)
-
     return PSNRs
 
 @torch.no_grad()
@@ -208,7 +234,7 @@ def margin_restore(map, margin):
 @torch.no_grad()
 def evaluation_path(test_dataset,tensorf, c2ws, renderer, savePath=None, N_vis=5, prtx='', N_samples=-1,
                     white_bg=False, ray_type=0, compute_extra_metrics=True, device='cuda'):
-    PSNRs, rgb_maps, depth_maps = [], [], []
+    PSNRs = []
     ssims,l_alex,l_vgg=[],[],[]
     os.makedirs(savePath, exist_ok=True)
     os.makedirs(savePath+"/rgbd", exist_ok=True)
@@ -219,6 +245,7 @@ def evaluation_path(test_dataset,tensorf, c2ws, renderer, savePath=None, N_vis=5
         pass
 
     near_far = test_dataset.near_far
+    writer = FrameWriter(savePath, prtx, quality=8)
     for idx, c2w in tqdm(enumerate(c2ws)):
 
         W, H = test_dataset.img_wh
@@ -239,15 +266,8 @@ def evaluation_path(test_dataset,tensorf, c2ws, renderer, savePath=None, N_vis=5
 
         rgb_map = (rgb_map.numpy() * 255).astype('uint8')
         # rgb_map = np.concatenate((rgb_map, depth_map), axis=1)
-        rgb_maps.append(rgb_map)
-        depth_maps.append(depth_map)
-        if savePath is not None:
-            imageio.imwrite(f'{savePath}/{prtx}{idx:03d}.png', rgb_map)
-            rgb_map = np.concatenate((rgb_map, depth_map), axis=1)
-            imageio.imwrite(f'{savePath}/rgbd/{prtx}{idx:03d}.png', rgb_map)
-
-    imageio.mimwrite(f'{savePath}/{prtx}video.mp4', np.stack(rgb_maps), fps=30, quality=8)
-    imageio.mimwrite(f'{savePath}/{prtx}depthvideo.mp4', np.stack(depth_maps), fps=30, quality=8)
+        writer.add(idx, rgb_map, depth_map)
+    writer.close()
 
     if PSNRs:
         psnr = np.mean(np.asarray(PSNRs))
@@ -0,0 +1,53 @@
+import numpy as np
+import torch
+import torch.nn.functional as F
+
+from models.apparatus import AlphaGridMask, pack_bits, unpack_bits
+
+
+def random_volume(shape, p=0.2, seed=0):
+    generator = torch.Generator().manual_seed(seed)
+    return torch.rand(shape, generator=generator) < p
+
+
+def test_pack_bits_matches_numpy():
+    for n in [1, 7, 8, 9, 64, 1000]:
+        mask = random_volume([n], p=0.5, seed=n)
+        bits = pack_bits(mask)
+        np.testing.assert_array_equal(bits.numpy(), np.packbits(mask.numpy()))
+        assert torch.equal(unpack_bits(bits, n), mask)
+
+
+def test_checkpoint_round_trip():
+    aabb = torch.tensor([[-1.0, -1.0, -1.0], [1.0, 2.0, 1.0]])
+    volume = random_volume([5, 7, 6])
+    mask = AlphaGridMask("cpu", aabb, volume.float().view(1, 1, 5, 7, 6))
+    assert mask.bits.numel() * 8 >= volume.numel() and mask.bits.dtype == torch.uint8
+    assert torch.equal(mask.volume(), volume)
+
+    fields = mask.checkpoint_fields()
+    # same layout as the np.packbits of the float volume the checkpoints always held
+    assert tuple(fields['alphaMask.shape']) == (1, 1, 5, 7, 6)
+    np.testing.assert_array_equal(fields['alphaMask.mask'], np.packbits(volume.numpy().reshape(-1)))
+
+    loaded = AlphaGridMask.from_checkpoint("cpu", fields)
+    assert torch.equal(loaded.volume(), volume)
+    assert torch.equal(loaded.bits, mask.bits) and torch.equal(loaded.cell_bits, mask.cell_bits)
+    torch.testing.assert_close(loaded.aabb, aabb)
+
+
+def test_sample_alpha_matches_grid_sample():
+    # the former test: trilinear, zero padded grid_sample of the volume > 0
+    aabb = torch.tensor([[0.0, 0.0, 0.0], [1.0, 1.0, 1.0]])
+    volume = random_volume([6, 5, 4], p=0.1, seed=1)
+    mask = AlphaGridMask("cpu", aabb, volume.float())
+    torch.manual_seed(0)
+    xyz = torch.rand(20000, 3) * 1.4 - 0.2
+    reference = F.grid_sample(volume.float().view(1, 1, 6, 5, 4), mask.normalize_coord(xyz).view(1, -1, 1, 1, 3), align_corners=True).view(-1) > 0
+    sampled = mask.sample_alpha(xyz) > 0
+    assert torch.equal(sampled, reference)
+
+    # on the voxel planes the lookup may only add points
+    planes = torch.tensor([[1 / 3, 0.5, 0.6], [0.2, 0.25, 0.4], [0.7, 0.1, 0.2]])
+    ref_planes = F.grid_sample(volume.float().view(1, 1, 6, 5, 4), mask.normalize_coord(planes).view(1, -1, 1, 1, 3), align_corners=True).view(-1) > 0
+    assert (mask.sample_alpha(planes) > 0)[ref_planes].all()
@@ -0,0 +1,104 @@
+import torch
+
+from models import cpu_kernels
+
+# a 2 x 2 x 2 grid of 0.5 cells over the unit cube
+XYZ_MIN, XYZ_MAX = torch.zeros(3), torch.ones(3)
+UNITS = torch.full([3], 0.5)
+GRID = torch.tensor([2, 2, 2])
+
+
+def composite(alpha, ray_id, n_rays):
+    # weights and final transmittance of front-to-back compositing, per ray in python
+    weights, last = torch.zeros_like(alpha), torch.ones([n_rays], dtype=alpha.dtype)
+    for r in range(n_rays):
+        T = torch.ones([], dtype=alpha.dtype)
+        for i in torch.nonzero(ray_id == r).view(-1).tolist():
+            weights[i] = T * alpha[i]
+            T = T * (1 - alpha[i])
+        last[r] = T
+    return weights, last
+
+
+def test_raw2alpha():
+    exp_d, alpha = cpu_kernels.raw2alpha(torch.tensor([0.0, 0.0, -1.0]), 0.0, torch.tensor([1.0, 2.0, 1.0]))
+    torch.testing.assert_close(exp_d, torch.tensor([1.0, 1.0, torch.exp(torch.tensor(-1.0))]))
+    torch.testing.assert_close(alpha, torch.tensor([0.5, 0.75, 1 - 1 / (1 + torch.exp(torch.tensor(-1.0)))]))
+
+
+def test_alpha2weight_known_output():
+    # ray 0 composites both points, ray 1 is opaque after its first point, ray 2 has no points
+    alpha = torch.tensor([0.5, 0.5, 1.0, 0.3])
+    ray_id = torch.tensor([0, 0, 1, 1])
+    weight, T, alphainv_last, i_start, i_end = cpu_kernels.alpha2weight(alpha, ray_id, 3)
+    torch.testing.assert_close(weight, torch.tensor([0.5, 0.25, 1.0, 0.0]))
+    torch.testing.assert_close(T, torch.tensor([1.0, 0.5, 1.0, 1.0]))
+    torch.testing.assert_close(alphainv_last, torch.tensor([0.25, 0.0, 1.0]))
+    assert i_start.tolist() == [0, 2, 0]
+    assert i_end.tolist() == [2, 3, 0]
+
+
+def test_alpha2weight_backward_matches_autograd():
+    torch.manual_seed(0)
+    ray_id = torch.tensor([0, 0, 0, 1, 1, 3, 3, 3, 3])
+    alpha = (torch.rand(len(ray_id), dtype=torch.float64) * 0.5).requires_grad_()
+    grad_weights, grad_last = torch.randn(len(ray_id), dtype=torch.float64), torch.randn(4, dtype=torch.float64)
+
+    weights, last = composite(alpha, ray_id, 4)
+    expected = torch.autograd.grad((weights * grad_weights).sum() + (last * grad_last).sum(), alpha)[0]
+
+    alpha = alpha.detach()
+    weight, T, alphainv_last, i_start, i_end = cpu_kernels.alpha2weight(alpha, ray_id, 4)
+    torch.testing.assert_close(weight, weights.detach())
+    torch.testing.assert_close(alphainv_last, last.detach())
+    grad = cpu_kernels.alpha2weight_backward(alpha, weight, T, alphainv_last, i_start, i_end, 4, grad_weights, grad_last)
+    torch.testing.assert_close(grad, expected)
+
+
+def test_infer_t_minmax():
+    rays_o = torch.tensor([[-1.0, 0.5, 0.5], [0.5, 0.5, 0.5], [-1.0, 2.0, 0.5]])
+    rays_d = torch.tensor([[1.0, 0.0, 0.0], [0.0, 0.0, 1.0], [1.0, 0.0, 0.0]])
+    t_min, t_max = cpu_kernels.infer_t_minmax(rays_o, rays_d, XYZ_MIN, XYZ_MAX, 0.0, 10.0)
+    torch.testing.assert_close(t_min[:2], torch.tensor([1.0, 0.0]))
+    torch.testing.assert_close(t_max[:2], torch.tensor([2.0, 0.5]))
+    # misses the box: the exit comes before the entry
+    assert t_max[2] <= t_min[2]
+
+
+def test_sample_pts_on_rays_cvrg():
+    cvrg = torch.zeros([2, 2, 2], dtype=torch.bool)
+    cvrg[0, 0, 0] = True
+    rays_o, rays_d = torch.tensor([[-1.0, 0.25, 0.25]]), torch.tensor([[1.0, 0.0, 0.0]])
+    rays_pts, mask_valid, ray_id, step_id, N_steps, t_min, t_max = cpu_kernels.sample_pts_on_rays_cvrg(
+        rays_o, rays_d, cvrg, UNITS, XYZ_MIN, XYZ_MAX, 0.0, 10.0, 0.25)
+    assert N_steps.tolist() == [4]
+    assert ray_id.tolist() == [0, 0, 0, 0] and step_id.tolist() == [0, 1, 2, 3]
+    torch.testing.assert_close(rays_pts[:, 0], torch.tensor([0.0, 0.25, 0.5, 0.75]))
+    assert mask_valid.tolist() == [True, True, False, False]
+
+
+def test_filter_xyz_cvrg():
+    cvrg = torch.zeros([2, 2, 2], dtype=torch.bool)
+    cvrg[1, 0, 1] = True
+    xyz = torch.tensor([[0.75, 0.25, 0.75], [0.25, 0.25, 0.25], [1.5, 0.25, 0.75]])
+    assert cpu_kernels.filter_xyz_cvrg(xyz, XYZ_MIN, XYZ_MAX, UNITS, cvrg).tolist() == [True, False, False]
+
+
+def test_build_and_sample_tensoRF_map_hier():
+    # one tensoRF at the center covers every cell, each cell lists it once
+    geo_xyz = torch.tensor([[0.5, 0.5, 0.5]])
+    local_range = torch.full([3], 0.25)
+    cvrg_inds, count, topindx = cpu_kernels.build_tensoRF_map_hier(geo_xyz, GRID, XYZ_MIN, XYZ_MAX, UNITS, local_range, None, 2)
+    assert cvrg_inds.tolist() == torch.arange(8, dtype=torch.int32).view(2, 2, 2).tolist()
+    assert count.tolist() == [1] * 8
+    assert topindx[:, 0].tolist() == [0] * 8 and topindx[:, 1].tolist() == [-1] * 8
+
+    lvl_units, local_dims = torch.full([3], 0.1), torch.tensor([6, 6, 6])
+    gindx_s, gindx_l, gweight_s, gweight_l, dist, tensoRF_id, agg_id = cpu_kernels.sample_2_tensoRF_cvrg_hier(
+        torch.tensor([[0.6, 0.6, 0.6]]), XYZ_MIN, XYZ_MAX, UNITS, lvl_units, local_range, local_dims,
+        cvrg_inds, count, topindx, geo_xyz, 2, False)
+    assert tensoRF_id.tolist() == [0] and agg_id.tolist() == [0]
+    assert gindx_s.tolist() == [[3, 3, 3]] and gindx_l.tolist() == [[4, 4, 4]]
+    torch.testing.assert_close(gweight_l, torch.full([1, 3], 0.5))
+    torch.testing.assert_close(gweight_s, torch.full([1, 3], 0.5))
+    torch.testing.assert_close(dist, torch.tensor([0.03]).sqrt())
@@ -0,0 +1,66 @@
+import torch
+
+from models import cpu_kernels
+from models.apparatus import AlphaGridMask, candidate_cells, occupancy_grid
+
+
+def test_occupancy_grid_known_output():
+    # a single occupied grid point at (2, 1, 3) of a 5 x 4 x 6 grid over [0, 4] x [0, 3] x [0, 5]
+    aabb = torch.tensor([[0.0, 0.0, 0.0], [4.0, 3.0, 5.0]])
+    gridSize = [5, 4, 6]
+    point = torch.tensor([2.0, 1.0, 3.0])
+    occ, bounds = occupancy_grid(lambda xyz: (xyz - point).abs().sum(-1).lt(1e-4).float(), aabb, gridSize, 0.5, batch=7)
+    assert occ.shape == (6, 4, 5)
+    expected = torch.zeros(6, 4, 5, dtype=torch.bool)
+    expected[2:5, 0:3, 1:4] = True
+    assert torch.equal(occ, expected)
+    torch.testing.assert_close(bounds, torch.tensor([[1.0, 0.0, 2.0], [3.0, 2.0, 4.0]]))
+
+
+def test_occupancy_grid_empty():
+    aabb = torch.tensor([[0.0, 0.0, 0.0], [1.0, 1.0, 1.0]])
+    occ, bounds = occupancy_grid(lambda xyz: torch.zeros(len(xyz)), aabb, [3, 3, 3], 0.5)
+    assert not occ.any() and bounds is None
+
+
+def test_candidates_cover_every_passing_cell():
+    # compute_alpha's exact tests (coverage and previous mask) only pass on candidate cells, so evaluating the
+    # candidates only gives the same grid
+    torch.manual_seed(0)
+    for trial in range(6):
+        aabb = torch.tensor([[-1.0, -0.5, 0.0], [1.0, 0.7, 1.3]])
+        cvrg_shape = torch.randint(3, 9, (3,))
+        units = (aabb[1] - aabb[0]) / cvrg_shape
+        cvrg = torch.rand(*cvrg_shape.tolist()) < 0.15
+        gridSize = torch.randint(5, 20, (3,)).tolist()
+        prior = None
+        if trial % 2 == 1:
+            X, Y, Z = gridSize
+            prior = AlphaGridMask("cpu", aabb, (torch.rand(Z, Y, X) < 0.3).float())
+
+        def alpha_fn(xyz):
+            passing = cpu_kernels.filter_xyz_cvrg(xyz, aabb[0], aabb[1], units, cvrg)
+            if prior is not None:
+                passing &= prior.sample_alpha(xyz) > 0
+            return passing.float()
+
+        candidates = candidate_cells(aabb, gridSize, cvrg, units, prior=prior, batch=64)
+        full, full_bounds = occupancy_grid(alpha_fn, aabb, gridSize, 0.5)
+        fast, fast_bounds = occupancy_grid(alpha_fn, aabb, gridSize, 0.5, candidates=candidates)
+        assert torch.equal(full, fast)
+        assert (full_bounds is None) == (fast_bounds is None)
+        if full_bounds is not None:
+            torch.testing.assert_close(full_bounds, fast_bounds)
+        # and fewer cells are evaluated
+        assert candidates.sum() < candidates.numel()
+
+
+def test_sparse_coverage_gives_the_same_candidates():
+    aabb = torch.tensor([[0.0, 0.0, 0.0], [1.0, 1.0, 1.0]])
+    cvrg = torch.zeros(4, 4, 4, dtype=torch.bool)
+    cvrg[1, 2, 3] = cvrg[0, 0, 0] = True
+    units = torch.full([3], 0.25)
+    keys = torch.nonzero(cvrg.view(-1))[..., 0]
+    sparse = cpu_kernels.SparseCvrg(keys, cvrg.shape)
+    assert torch.equal(candidate_cells(aabb, [9, 9, 9], cvrg, units), candidate_cells(aabb, [9, 9, 9], sparse, units))
+    assert candidate_cells(aabb, [9, 9, 9]) is None
@@ -0,0 +1,43 @@
+import torch
+
+from mvs.point_fusion import VoxelAccumulator
+
+
+def test_accumulates_means_per_voxel():
+    acc = VoxelAccumulator(0.5, device="cpu")
+    acc.add(torch.tensor([[0.1, 0.1, 0.1], [0.3, 0.2, 0.4], [-0.2, 0.1, 0.1]]), torch.tensor([1.0, 0.5, 0.2]))
+    assert len(acc) == 2
+    # a later batch lands in an existing voxel and a new one
+    acc.add(torch.tensor([[0.2, 0.3, 0.1], [1.2, 0.1, 0.1]]), torch.tensor([0.0, 0.8]))
+    acc.add(torch.zeros(0, 3), torch.zeros(0))
+    assert len(acc) == 3
+
+    xyz, conf = acc.points()
+    order = torch.argsort(xyz[:, 0])
+    torch.testing.assert_close(xyz[order], torch.tensor([[-0.2, 0.1, 0.1], [0.2, 0.2, 0.2], [1.2, 0.1, 0.1]]))
+    torch.testing.assert_close(conf[order], torch.tensor([0.2, 0.5, 0.8]))
+
+    centers, _ = acc.points(vox_center=True)
+    torch.testing.assert_close(centers[order], torch.tensor([[-0.25, 0.25, 0.25], [0.25, 0.25, 0.25], [1.25, 0.25, 0.25]]))
+
+
+def test_batches_equal_a_single_pass():
+    torch.manual_seed(0)
+    xyz, conf = torch.rand(1000, 3) * 4 - 2, torch.rand(1000)
+    once = VoxelAccumulator(torch.tensor([0.3, 0.4, 0.5]), origin=[0.1, 0.0, -0.1], device="cpu")
+    once.add(xyz, conf)
+    streamed = VoxelAccumulator(torch.tensor([0.3, 0.4, 0.5]), origin=[0.1, 0.0, -0.1], device="cpu")
+    for chunk in torch.split(torch.arange(1000), 77):
+        streamed.add(xyz[chunk], conf[chunk])
+    assert torch.equal(once.keys, streamed.keys)
+    torch.testing.assert_close(once.count, streamed.count)
+    for a, b in zip(once.points(), streamed.points()):
+        torch.testing.assert_close(a, b)
+
+
+def test_voxel_keys_round_trip():
+    acc = VoxelAccumulator(0.25, origin=[1.0, -1.0, 0.5], device="cpu")
+    xyz = torch.tensor([[1.1, -0.9, 0.6], [-3.0, 5.0, -2.0], [1.0, -1.0, 0.5]])
+    centers = acc.voxel_centers(acc.voxel_keys(xyz))
+    # every point lies in the voxel whose center is returned
+    assert ((xyz - centers).abs() <= 0.125 + 1e-6).all()
@@ -0,0 +1,58 @@
+import os
+
+import numpy as np
+
+from mvs import point_store
+
+
+def test_txt_converts_to_zero_copy_columns(tmp_path):
+    pointfile = str(tmp_path / "points.txt")
+    pnts = np.asarray([[0.0, 1.0, 2.0, 0.5, 10.0, 20.0, 255.0], [3.0, 4.0, 5.0, 0.25, 0.0, 128.0, 64.0]])
+    np.savetxt(pointfile, pnts, delimiter=";")
+
+    columns = point_store.load_points(pointfile)
+    assert os.path.exists(str(tmp_path / "points.pnts"))
+    np.testing.assert_array_equal(columns["xyz"], pnts[:, :3])
+    np.testing.assert_array_equal(columns["confidence"], pnts[:, 3:4])
+    # rgb stays 0-255, nothing is rounded
+    np.testing.assert_array_equal(columns["rgb"], pnts[:, 4:])
+    assert np.shares_memory(columns["xyz"], columns["packed"]) and np.shares_memory(columns["rgb"], columns["packed"])
+    merged = point_store.merge_columns(columns)
+    assert merged is columns["packed"] and merged.dtype == np.float32
+
+    # the store is read from now on, even without the .txt
+    os.remove(pointfile)
+    np.testing.assert_array_equal(point_store.load_points(pointfile)["packed"], pnts.astype(np.float32))
+
+
+def test_split_columns_layouts():
+    for width, names in [(3, ["xyz"]), (4, ["xyz", "confidence"]), (6, ["xyz", "rgb"]),
+                         (7, ["xyz", "confidence", "rgb"]), (5, ["xyz", "extra"])]:
+        pnts = np.arange(2 * width, dtype=np.float32).reshape(2, width)
+        columns = point_store.split_columns(pnts)
+        assert sorted(columns) == sorted(names)
+        merged = point_store.merge_columns(columns)
+        np.testing.assert_array_equal(merged, pnts)
+
+
+def test_groups_are_separate_stores(tmp_path):
+    pointfile = str(tmp_path / "scene.txt")
+    point_store.save_points(pointfile, point_store.pack_columns(np.ones([4, 3])))
+    level = {"xyz": np.zeros([2, 3], dtype=np.float32), "ids": np.arange(2), "empty": np.zeros([0, 3], dtype=np.float32)}
+    path = point_store.save_points(pointfile, level, group="vox_0")
+    assert path == point_store.store_path(pointfile, "vox_0") == str(tmp_path / "scene.vox_0.pnts")
+
+    loaded = point_store.load_points(pointfile, group="vox_0")
+    assert sorted(loaded) == ["empty", "ids", "xyz"]
+    np.testing.assert_array_equal(loaded["ids"], np.arange(2))
+    assert loaded["empty"].shape == (0, 3)
+    assert point_store.load_points(pointfile, group="vox_1") is None
+
+    # new base points drop the levels derived from the old ones
+    point_store.save_points(pointfile, point_store.pack_columns(np.zeros([4, 3])))
+    assert not os.path.exists(path)
+    assert point_store.load_points(pointfile, group="vox_0") is None
+
+
+def test_missing_pointfile(tmp_path):
+    assert point_store.load_points(str(tmp_path / "missing.txt")) is None
@@ -0,0 +1,51 @@
+import torch
+
+from dataLoader.ray_utils import ImportanceSampler, SumTree
+
+
+def test_sum_tree_totals_and_updates():
+    tree = SumTree(5, value=2.0)
+    assert tree.total() == 10.0
+    tree.set(torch.tensor([0, 3]), torch.tensor([0.5, 4.0]))
+    assert tree.total() == 0.5 + 2.0 + 2.0 + 4.0 + 2.0
+    # every inner node is the sum of its children
+    for node in range(1, tree.size):
+        assert tree.tree[node] == tree.tree[2 * node] + tree.tree[2 * node + 1]
+
+
+def test_sum_tree_samples_proportionally():
+    torch.manual_seed(0)
+    tree = SumTree(6, value=0.0)
+    tree.set(torch.tensor([1, 4]), torch.tensor([1.0, 3.0]))
+    leaves = tree.sample(20000)
+    assert set(leaves.tolist()) == {1, 4}
+    assert abs((leaves == 4).double().mean().item() - 0.75) < 0.02
+
+
+def test_sum_tree_single_leaf():
+    tree = SumTree(1)
+    assert tree.sample(4).tolist() == [0, 0, 0, 0]
+
+
+def test_importance_sampler_draws_high_error_tiles():
+    torch.manual_seed(0)
+    sampler = ImportanceSampler(total=1000, batch=200, tile=100, uniform=0.25, decay=0.0)
+    ids = sampler.nextids()
+    assert len(ids) == 200 and ids.min() >= 0 and ids.max() < 1000
+
+    # one ray of every tile: tile 3 has a large error, the others none (floored at 1e-6)
+    ids = torch.arange(0, 1000, 100)
+    sampler.update(ids, (ids // 100 == 3).double())
+    ids = sampler.nextids()
+    # nearly all of the importance share lands in tile 3, the uniform share anywhere
+    assert ((ids[:150] // 100) == 3).double().mean() > 0.99
+    assert ids[150:].max() < 1000
+
+
+def test_importance_sampler_last_tile():
+    # the ragged last tile never yields ids past the end
+    sampler = ImportanceSampler(total=250, batch=64, tile=100, uniform=0.0)
+    sampler.update(torch.tensor([0, 100]), torch.zeros(2))
+    for _ in range(20):
+        ids = sampler.nextids()
+        assert ids.max() < 250
@@ -0,0 +1,36 @@
+import torch
+
+from models.sample_budget import SampleBudget
+
+
+def test_cap_is_the_largest_that_fits():
+    for counts in [[5, 2, 6, 1], [3, 3, 3], [0, 9, 4, 4, 1], [10]]:
+        for budget in range(1, sum(counts) + 2):
+            cap = SampleBudget(budget).cap(torch.tensor(counts))
+            fits = [c for c in range(1, max(counts) + 1) if sum(min(n, c) for n in counts) <= budget]
+            # caps past the longest ray keep the same samples
+            assert min(cap, max(counts)) == max(fits + [1])
+
+
+def test_limit_drops_far_samples_and_records_them():
+    budget = SampleBudget(10)
+    ray_id = torch.tensor([0, 0, 0, 0, 0, 1, 1, 2, 2, 2, 2, 2, 2, 3])
+    xyz = torch.arange(len(ray_id), dtype=torch.float32)[:, None].expand(-1, 3)
+    budget.skip(2)
+    xyz_kept, ray_kept, step_kept = budget.limit(xyz, ray_id, torch.arange(len(ray_id)), 4)
+    # cap 3: rays 0 and 2 keep their first three samples
+    assert ray_kept.tolist() == [0, 0, 0, 1, 1, 2, 2, 2, 3]
+    assert step_kept.tolist() == [0, 1, 2, 5, 6, 7, 8, 9, 13]
+    assert torch.equal(xyz_kept[:, 0].long(), step_kept)
+    truncated, dropped = budget.pop(6)
+    assert truncated.tolist() == [False, False, True, False, True, False]
+    assert dropped == 5
+
+
+def test_within_budget_records_nothing():
+    budget = SampleBudget(10)
+    ray_id = torch.tensor([0, 0, 1])
+    xyz, kept, step = budget.limit(torch.zeros(3, 3), ray_id, None, 2)
+    assert kept is ray_id and step is None
+    assert budget.pop(2) == (None, 0)
+    assert budget.records == []
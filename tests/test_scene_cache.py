@@ -0,0 +1,73 @@
+import os
+from types import SimpleNamespace
+
+import torch
+
+from preprocessing import scene_cache
+
+
+def make_args(tmp_path, **kwargs):
+    datadir = tmp_path / "scene"
+    if not datadir.exists():
+        (datadir / "images").mkdir(parents=True)
+        (datadir / "images" / "0.png").write_bytes(b"image")
+        (datadir / "transforms.json").write_text("{}")
+    args = dict(datadir=str(datadir), basedir=str(tmp_path / "log"), pointfile=None, dataset_name="blender", use_geo=1,
+                vox_res=100, downsample_train=1.0, lr_init=0.02, n_iters=1000, pre_n_iters=10,
+                scene_cache=1, scene_cache_dir=None)
+    args.update(kwargs)
+    return SimpleNamespace(**args)
+
+
+def test_geo_key_follows_the_preprocessing_inputs(tmp_path):
+    args = make_args(tmp_path)
+    key = scene_cache.geo_key(args)
+    assert scene_cache.geo_key(make_args(tmp_path)) == key
+    # training-only args hit, preprocessing args miss
+    assert scene_cache.geo_key(make_args(tmp_path, lr_init=0.1, n_iters=5)) == key
+    assert scene_cache.geo_key(make_args(tmp_path, vox_res=200)) != key
+    # pre_* args only matter for the density points
+    assert scene_cache.geo_key(make_args(tmp_path, pre_n_iters=20)) == key
+    assert scene_cache.geo_key(make_args(tmp_path, use_geo=-1)) != scene_cache.geo_key(make_args(tmp_path, use_geo=-1, pre_n_iters=20))
+
+
+def test_geo_key_follows_the_dataset_files(tmp_path):
+    args = make_args(tmp_path)
+    key = scene_cache.geo_key(args)
+    # files the pipeline writes into the dataset don't count
+    (tmp_path / "scene" / "blur_scores.npz").write_bytes(b"scores")
+    (tmp_path / "scene" / "points.pnts").write_bytes(b"points")
+    assert scene_cache.geo_key(args) == key
+    (tmp_path / "scene" / "images" / "1.png").write_bytes(b"another image")
+    assert scene_cache.geo_key(args) != key
+
+
+def test_ray_key_follows_the_rays_and_the_model(tmp_path):
+    args = make_args(tmp_path)
+    rays = torch.arange(12, dtype=torch.float32).view(2, 6)
+    model = SimpleNamespace(aabb=torch.tensor([[0.0, 0.0, 0.0], [1.0, 1.0, 1.0]]), units=torch.full([3], 0.1))
+    key = scene_cache.ray_key(args, model, rays)
+    assert scene_cache.ray_key(args, model, rays.clone()) == key
+    assert scene_cache.ray_key(args, model, rays + 1) != key
+    moved = SimpleNamespace(aabb=model.aabb + 0.5, units=model.units)
+    assert scene_cache.ray_key(args, moved, rays) != key
+
+
+def test_cached_round_trip(tmp_path):
+    args = make_args(tmp_path)
+    calls = []
+
+    def build():
+        calls.append(1)
+        return {"points": torch.ones(3), "levels": [torch.zeros(2)]}
+
+    first = scene_cache.cached(args, "geo", "abc", build)
+    second = scene_cache.cached(args, "geo", "abc", build)
+    assert len(calls) == 1
+    assert torch.equal(first["points"], second["points"]) and torch.equal(first["levels"][0], second["levels"][0])
+    assert os.path.exists(scene_cache.cache_path(args, "geo", "abc"))
+
+    # disabled: always rebuilt, nothing written
+    off = make_args(tmp_path, scene_cache=0, basedir=str(tmp_path / "off"))
+    scene_cache.cached(off, "geo", "abc", build)
+    assert len(calls) == 2 and not os.path.exists(str(tmp_path / "off"))
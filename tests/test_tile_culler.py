@@ -0,0 +1,55 @@
+from types import SimpleNamespace
+
+import torch
+
+from models import cpu_kernels
+from models.apparatus import AlphaGridMask, TileCuller
+
+AABB = torch.tensor([[0.0, 0.0, 0.0], [1.0, 1.0, 1.0]])
+UNITS = torch.full([3], 0.25)
+
+
+def scene(cvrg, alpha_volume=None):
+    alphaMask = None if alpha_volume is None else AlphaGridMask("cpu", AABB, alpha_volume.float())
+    return SimpleNamespace(tensoRF_cvrg_filter=cvrg, units=UNITS, aabb=AABB, alphaMask=alphaMask)
+
+
+def tiles(directions, origin=(-1.0, 0.875, 0.875)):
+    # one tile per direction, four slightly spread rays each from a common origin
+    spread = torch.tensor([[0.0, 0.0, 0.0], [0.0, 0.01, 0.0], [0.0, 0.0, 0.01], [0.0, 0.01, 0.01]])
+    rays_d = torch.cat([torch.tensor(d)[None] + spread for d in directions])
+    rays_o = torch.tensor(origin).expand(len(rays_d), 3)
+    tile_id = torch.arange(len(directions)).repeat_interleave(4)
+    return rays_o, rays_d, tile_id
+
+
+def test_culls_tiles_that_miss_the_covered_cells():
+    cvrg = torch.zeros(4, 4, 4, dtype=torch.bool)
+    cvrg[3, 3, 3] = True
+    # toward the covered corner cell, away from the scene, toward the empty far side
+    rays_o, rays_d, tile_id = tiles([(1.0, 0.0, 0.0), (-1.0, 0.0, 0.0), (1.0, -0.8, -0.8)])
+    visible = TileCuller(scene(cvrg)).visible(rays_o, rays_d, tile_id, 4)
+    # tile 3 has no rays
+    assert visible.tolist() == [True, False, False, False]
+
+    sparse = cpu_kernels.SparseCvrg(torch.nonzero(cvrg.view(-1))[..., 0], cvrg.shape)
+    assert torch.equal(TileCuller(scene(sparse)).visible(rays_o, rays_d, tile_id, 4), visible)
+
+
+def test_alpha_mask_culls_covered_but_empty_space():
+    cvrg = torch.ones(4, 4, 4, dtype=torch.bool)
+    alpha = torch.zeros(9, 9, 9, dtype=torch.bool)
+    # only the voxel at (x, y, z) = (0.5, 0.875, 0.875) is occupied
+    alpha[7, 7, 4] = True
+    rays_o, rays_d, tile_id = tiles([(1.0, 0.0, 0.0), (1.0, -0.8, -0.8)])
+    assert TileCuller(scene(cvrg)).visible(rays_o, rays_d, tile_id, 2).tolist() == [True, True]
+    assert TileCuller(scene(cvrg, alpha)).visible(rays_o, rays_d, tile_id, 2).tolist() == [True, False]
+
+
+def test_mixed_origins_are_never_culled():
+    cvrg = torch.zeros(4, 4, 4, dtype=torch.bool)
+    cvrg[0, 0, 0] = True
+    rays_o = torch.tensor([[5.0, 5.0, 5.0], [6.0, 5.0, 5.0]])
+    rays_d = torch.tensor([[1.0, 0.0, 0.0], [1.0, 0.0, 0.0]])
+    visible = TileCuller(scene(cvrg)).visible(rays_o, rays_d, torch.tensor([0, 0]), 1)
+    assert visible.tolist() == [True]
@@ -6,6 +6,7 @@ print(args)
 os.environ["CUDA_VISIBLE_DEVICES"]=args.gpu_ids
 from models.apparatus import *
 from preprocessing.recon_prior_adapt import gen_geo, gen_pnts
+from preprocessing import scene_cache
 import json, random
 from renderer import *
 from utils import *
@@ -20,7 +21,7 @@ import pickle
 device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
 
 renderer = OctreeRender_trilinear_fast
-from dataLoader.ray_utils import SimpleSampler
+from dataLoader.ray_utils import SimpleSampler, ImportanceSampler
 
 @torch.no_grad()
 def export_mesh(args, cluster_dict):
@@ -148,15 +149,20 @@ def reconstruction(args, cluster_dict, train_dataset, test_dataset, pnts):
 
     torch.cuda.empty_cache()
     PSNRs,PSNRs_test = [],[0]
+    # rays left out of the loss and samples dropped by --sample_budget since the last progress print
+    budget_rays, budget_samples = 0, 0
 
     # gather rays
 
     allrays, allrgbs = train_dataset.all_rays, train_dataset.all_rgbs
    
     if args.ray_type != 1: # if 2, inward facing; if 1, outward facing
-        mask_filtered, tensoRF_per_ray = tensorf.filtering_rays(allrays, allrgbs, bbox_only=True)
+        mask_filtered, tensoRF_per_ray = scene_cache.cached(args, "rays", scene_cache.ray_key(args, tensorf, allrays), lambda: tensorf.filtering_rays(allrays, allrgbs, bbox_only=True))
         allrays, allrgbs = allrays[mask_filtered], allrgbs[mask_filtered]
-    trainingSampler = SimpleSampler(allrays.shape[0], args.batch_size)
+    if args.importance_sampling > 0:
+        trainingSampler = ImportanceSampler(allrays.shape[0], args.batch_size, args.importance_tile, args.importance_uniform, args.importance_decay)
+    else:
+        trainingSampler = SimpleSampler(allrays.shape[0], args.batch_size)
 
     # set loss for tensor constraint
     Ortho_reg_weight = args.Ortho_weight
@@ -202,7 +208,22 @@ def reconstruction(args, cluster_dict, train_dataset, test_dataset, pnts):
         # intput ray and do ray marching: get rgb_map, alphas_map, depth_map, weights, uncertainty
         rgb_map, weights, depth_map, rgbpers, ray_ids = renderer(rays_train, tensorf, chunk=args.batch_size, N_samples=-1, white_bg = white_bg, ray_type=ray_type, device=device, is_train=True, tensoRF_per_ray=tensoRF_per_ray_train, rot_step=cur_rot_step)
 
-        loss = torch.mean((rgb_map - rgb_train) ** 2)
+        # rays that lost far samples to --sample_budget render a background biased color: left out of the losses
+        truncated, dropped = tensorf.sample_budget.pop(len(rgb_map)) if getattr(tensorf, "sample_budget", None) is not None else (None, 0)
+        kept = None if truncated is None else ~truncated
+        if kept is None:
+            loss = torch.mean((rgb_map - rgb_train) ** 2)
+        else:
+            n_kept = int(kept.sum())
+            budget_rays, budget_samples = budget_rays + len(kept) - n_kept, budget_samples + dropped
+            # no ray left to train on: a zero loss that still reaches the regularizers
+            loss = torch.mean((rgb_map[kept] - rgb_train[kept]) ** 2) if n_kept > 0 else (rgb_map * 0).sum()
+        if isinstance(trainingSampler, ImportanceSampler):
+            ray_error = ((rgb_map - rgb_train) ** 2).detach().view(len(rgb_map), -1).mean(-1)
+            if kept is None:
+                trainingSampler.update(ray_idx, ray_error)
+            else:
+                trainingSampler.update(ray_idx[kept.cpu()], ray_error[kept])
 
         # loss
         total_loss = loss
@@ -226,7 +247,8 @@ def reconstruction(args, cluster_dict, train_dataset, test_dataset, pnts):
             total_loss = total_loss + loss_tv
             # summary_writer.add_scalar('train/reg_tv_app', loss_tv.detach().item(), global_step=iteration)
         if args.weight_rgbper > 0:
-            total_loss += args.weight_rgbper * ((rgbpers - rgb_train[ray_ids]).pow(2).sum(-1) * weights.detach()).sum() / len(rgb_train)
+            sample_weights = weights.detach() if kept is None else weights.detach() * kept[ray_ids]
+            total_loss += args.weight_rgbper * ((rgbpers - rgb_train[ray_ids]).pow(2).sum(-1) * sample_weights).sum() / len(rgb_train)
             # summary_writer.add_scalar('train/rgbper', loss_reg_L1.detach().item(), global_step=iteration)
         # if not rot_step:
         optimizer.zero_grad(set_to_none=True) if skip_zero_grad else optimizer.zero_grad()
@@ -242,7 +264,8 @@ def reconstruction(args, cluster_dict, train_dataset, test_dataset, pnts):
 
         loss = loss.detach().item()
         
-        PSNRs.append(-10.0 * np.log(loss) / np.log(10.0))
+        if kept is None or n_kept > 0:
+            PSNRs.append(-10.0 * np.log(loss) / np.log(10.0))
         # summary_writer.add_scalar('train/PSNR', PSNRs[-1], global_step=iteration)
         # summary_writer.add_scalar('train/mse', loss, global_step=iteration)
 
@@ -257,6 +280,7 @@ def reconstruction(args, cluster_dict, train_dataset, test_dataset, pnts):
                 + f' train_psnr = {float(np.mean(PSNRs)):.2f}'
                 + f' test_psnr = {float(np.mean(PSNRs_test)):.2f}'
                 + f' mse = {loss:.6f}'
+                + (f' budget_dropped = {budget_rays} rays / {budget_samples} samples' if budget_rays > 0 else "")
                 #+ (f' rotx = {tensorf.pnt_rot[0,0] * 180 / np.pi:.6f}' if args.rotgrad > 0 else "")
                 #+ (f' roty = {tensorf.pnt_rot[0,1] * 180 / np.pi:.6f}' if args.rotgrad > 0 else "")
                 #+ (f' rotz = {tensorf.pnt_rot[0,2] * 180 / np.pi:.6f}' if args.rotgrad > 0 else "")
@@ -265,6 +289,7 @@ def reconstruction(args, cluster_dict, train_dataset, test_dataset, pnts):
                 #+ (f' rotz = {tensorf.pnt_rot[0][0,2].cpu().numpy() * 180 / np.pi:.6f}')
             )
             PSNRs = []
+            budget_rays, budget_samples = 0, 0
 
         # visualize every $vis_every iters
         if iteration % args.vis_every == args.vis_every - 1 and args.N_vis!=0:
@@ -287,7 +312,10 @@ def reconstruction(args, cluster_dict, train_dataset, test_dataset, pnts):
             mask_filtered, tensoRF_per_ray = tensorf.filtering_rays(allrays, allrgbs)
             tensoRF_per_ray = None if tensoRF_per_ray is None else tensoRF_per_ray.to(device)
             allrays, allrgbs = allrays[mask_filtered], allrgbs[mask_filtered]
-            trainingSampler = SimpleSampler(allrgbs.shape[0], args.batch_size)
+            if args.importance_sampling > 0:
+                trainingSampler = ImportanceSampler(allrgbs.shape[0], args.batch_size, args.importance_tile, args.importance_uniform, args.importance_decay)
+            else:
+                trainingSampler = SimpleSampler(allrgbs.shape[0], args.batch_size)
 
         # TODO adaptively adding new tensoRF
         # if args.adapt_list is not None and iteration in args.adapt_list:
@@ -416,19 +444,26 @@ if __name__ == '__main__':
         train_dataset = dataset(args.datadir, split='train', downsample=args.downsample_train, is_stack=False,
                                 rnd_ray=False, args=args)
 
-        pnts = get_density_pnts(args, train_dataset) if args.use_geo < 0 else gen_pnts(
-            args)  # a quickly generate points by a dvgo
-        # coarse
-        # np.savetxt(os.path.dirname(args.ckpt), pnt.cpu().numpy(), delimiter=";")
-
-        # cluster_dict = {
-        #     "cluster_xyz": [],
-        #     "box_length": [],
-        #     "pca_axis": [],
-        #     "stds": []
-        # }
-
-        cluster_dict, pnts = gen_geo(args, pnts=pnts)  if args.use_geo != 0 else [None, None, None]  # generate tensoRFs' position (xyz)
+        geo_key = scene_cache.geo_key(args)
+        cached_geo = scene_cache.load(args, "geo", geo_key, device=device) if args.use_geo != 0 else None
+        if cached_geo is None:
+            pnts = get_density_pnts(args, train_dataset) if args.use_geo < 0 else gen_pnts(
+                args)  # a quickly generate points by a dvgo
+            # coarse
+            # np.savetxt(os.path.dirname(args.ckpt), pnt.cpu().numpy(), delimiter=";")
+
+            # cluster_dict = {
+            #     "cluster_xyz": [],
+            #     "box_length": [],
+            #     "pca_axis": [],
+            #     "stds": []
+            # }
+
+            cluster_dict, pnts = gen_geo(args, pnts=pnts)  if args.use_geo != 0 else [None, None, None]  # generate tensoRFs' position (xyz)
+            if args.use_geo != 0:
+                scene_cache.save(args, "geo", geo_key, (cluster_dict, pnts))
+        else:
+            cluster_dict, pnts = cached_geo
 
         ###########
         ##np.savetxt(args.pointfile[:-4] + "_{}_{}_vox_pnts".format(args.datadir.split("/")[-1], args.vox_range[0][0]) + ".txt", pnts.cpu().numpy(), delimiter=";")
@@ -4,9 +4,12 @@ from tqdm.auto import tqdm
 from opt_hier import config_parser
 args = config_parser()
 print(args)
-os.environ["CUDA_VISIBLE_DEVICES"]=args.gpu_ids
+# torchrun ranks take LOCAL_RANK % device_count in init_distributed, a single pinned id would put them all on one gpu
+if args.distributed <= 0 or len(args.gpu_ids.split(",")) >= int(os.environ.get("LOCAL_WORLD_SIZE", os.environ.get("WORLD_SIZE", 1))):
+    os.environ["CUDA_VISIBLE_DEVICES"]=args.gpu_ids
 from models.apparatus import *
 from preprocessing.recon_prior_hier import gen_geo
+from preprocessing import scene_cache
 
 import json, random
 from renderer import *
@@ -15,12 +18,18 @@ from torch.utils.tensorboard import SummaryWriter
 import datetime
 
 from dataLoader import dataset_dict
+from dataLoader.ray_utils import RayStream, ImportanceSampler
 import sys
 
 from models.masked_adam import MaskedAdam
+from models.parallel import init_distributed, is_main, barrier, ShardedSampler, broadcast_parameters, average_gradients, shared_parameters, seed_all
 
 
-device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
+set_kernel_backend(args.kernel_backend)
+rank, world_size = init_distributed(args)
+# model parallel: every rank owns a spatial brick of the tensoRFs and all ranks render the same rays
+model_parallel = args.model_parallel > 0 and world_size > 1
+device = torch.device("cuda" if torch.cuda.is_available() and args.kernel_backend != "cpu" else "cpu")
 
 renderer = OctreeRender_trilinear_fast
 
@@ -124,7 +133,7 @@ def reconstruction(args, geo):
     # tensorVM, renderer = init_parameters(args, train_dataset.scene_bbox.to(device), reso_list[0])
     aabb = train_dataset.scene_bbox.to(device)
     if args.ckpt is not None:
-        ckpt = torch.load(args.ckpt, map_location=device)
+        ckpt = torch.load(args.ckpt if not model_parallel else args.ckpt.replace(".th", f"_rank{rank}.th"), map_location=device)
         kwargs = ckpt['kwargs']
         kwargs.update({'device':device, "geo": geo, "local_dims":args.local_dims_final})
         tensorf = eval(args.model_name)(**kwargs)
@@ -137,6 +146,11 @@ def reconstruction(args, geo):
             distance_scale=args.distance_scale, pos_pe=args.pos_pe, view_pe=args.view_pe,
             fea_pe=args.fea_pe, featureC=args.featureC, step_ratio=args.step_ratio,
             fea2denseAct=args.fea2denseAct, local_dims=args.local_dims_init, geo=geo, args=args)
+    if model_parallel:
+        broadcast_parameters(shared_parameters(tensorf))
+        seed_all(20211202)
+    else:
+        broadcast_parameters(tensorf.parameters())
 
     skip_zero_grad = args.skip_zero_grad
     grad_vars = tensorf.get_optparam_groups(args.lr_init, args.lr_basis, skip_zero_grad = skip_zero_grad > 0)
@@ -158,7 +172,7 @@ def reconstruction(args, geo):
         assert args.upsamp_list is not None and len(args.upsamp_list) == len(args.local_dims_trend[0]), "args.local_dims_trend and args.upsamp_list mismatch "
         for i in range(len(args.local_dims_trend)):
             level_dim_lst = []
-            trend = torch.as_tensor(args.local_dims_trend[i], device="cuda")
+            trend = torch.as_tensor(args.local_dims_trend[i], device=device)
             for j in range(len(args.local_dims_init[i])):
                 level_dim_lst.append(torch.floor(trend * args.local_dims_final[i][j] / args.local_dims_final[i][0]).long())
             dim_lst.append(torch.stack(level_dim_lst, dim=-1))
@@ -177,17 +191,32 @@ def reconstruction(args, geo):
 
     torch.cuda.empty_cache()
     PSNRs,PSNRs_test = [],[0]
+    # rays left out of the loss and samples dropped by --sample_budget since the last progress print
+    budget_rays, budget_samples = 0, 0
 
     allrays, allrgbs = train_dataset.all_rays, train_dataset.all_rgbs
 
     if args.ray_type != 1:
-        mask_filtered, tensoRF_per_ray = tensorf.filtering_rays(allrays, allrgbs, bbox_only=True)
-        allrays, allrgbs = allrays[mask_filtered], allrgbs[mask_filtered]
-        if args.rnd_ray > 0:
-            allalpha = train_dataset.all_alpha[mask_filtered]
-            allijs = train_dataset.ijs[mask_filtered]
-            allc2ws = train_dataset.c2ws[mask_filtered]
-    trainingSampler = SimpleSampler(allrays.shape[0], args.batch_size)
+        mask_filtered, tensoRF_per_ray = scene_cache.cached(args, "rays", scene_cache.ray_key(args, tensorf, allrays), lambda: tensorf.filtering_rays(allrays, allrgbs, bbox_only=True))
+        if isinstance(allrays, RayStream):
+            allrays = allrays[mask_filtered]
+            allrgbs = allrays.rgbs
+            if args.rnd_ray > 0:
+                allalpha, allijs, allc2ws = allrays.alphas, allrays.ijs, allrays.rots
+        else:
+            allrays, allrgbs = allrays[mask_filtered], allrgbs[mask_filtered]
+            if args.rnd_ray > 0:
+                allalpha = train_dataset.all_alpha[mask_filtered]
+                allijs = train_dataset.ijs[mask_filtered]
+                allc2ws = train_dataset.c2ws[mask_filtered]
+    elif args.rnd_ray > 0:
+        allalpha, allijs, allc2ws = train_dataset.all_alpha, train_dataset.ijs, train_dataset.c2ws
+    if world_size == 1 and args.importance_sampling > 0:
+        trainingSampler = ImportanceSampler(allrays.shape[0], args.batch_size, args.importance_tile, args.importance_uniform, args.importance_decay)
+    elif world_size == 1:
+        trainingSampler = SimpleSampler(allrays.shape[0], args.batch_size)
+    else:
+        trainingSampler = ShardedSampler(allrays.shape[0], args.batch_size, 0 if model_parallel else rank, 1 if model_parallel else world_size)
 
     Ortho_reg_weight = args.Ortho_weight
     print("initial Ortho_reg_weight", Ortho_reg_weight)
@@ -198,7 +227,7 @@ def reconstruction(args, geo):
     tvreg = TVLoss()
     print(f"initial TV_weight density: {TV_weight_density} appearance: {TV_weight_app}")
 
-    pbar = tqdm(range(args.n_iters), miniters=args.progress_refresh_rate, file=sys.stdout)
+    pbar = tqdm(range(args.n_iters), miniters=args.progress_refresh_rate, file=sys.stdout, disable=not is_main())
 
     shrink_list = [update_AlphaMask_list[0]] if args.shrink_list is None else args.shrink_list
     filter_ray_list = [update_AlphaMask_list[1]] if args.filter_ray_list is None else args.filter_ray_list
@@ -208,6 +237,10 @@ def reconstruction(args, geo):
     upsamp_reset_list = args.upsamp_reset_list if args.upsamp_reset_list is not None else [0 for i in range(len(args.upsamp_list))]
 
     for iteration in pbar:
+        if model_parallel:
+            # brick sized draws (upsample_volume_grid(reset_feat=True), ...) move each rank's stream differently,
+            # reseed so the ray jitter and background flag stay the same on every rank
+            seed_all(20211202 + iteration)
 
         ray_idx = trainingSampler.nextids()
         rays_train, rgb_train, tensoRF_per_ray_train = allrays[ray_idx].to(device), allrgbs[ray_idx].to(device), None if tensoRF_per_ray is None else tensoRF_per_ray[ray_idx].to(device)
@@ -232,7 +265,22 @@ def reconstruction(args, geo):
 
         rgb_map, weights, depth_map, rgbpers, ray_ids = renderer(rays_train, tensorf, chunk=args.batch_size, N_samples=-1, white_bg = white_bg, ray_type=ray_type, device=device, is_train=True, tensoRF_per_ray=tensoRF_per_ray_train, rot_step=cur_rot_step)
 
-        loss = torch.mean((rgb_map - rgb_train) ** 2)
+        # rays that lost far samples to --sample_budget render a background biased color: left out of the losses
+        truncated, dropped = tensorf.sample_budget.pop(len(rgb_map)) if getattr(tensorf, "sample_budget", None) is not None else (None, 0)
+        kept = None if truncated is None else ~truncated
+        if kept is None:
+            loss = torch.mean((rgb_map - rgb_train) ** 2)
+        else:
+            n_kept = int(kept.sum())
+            budget_rays, budget_samples = budget_rays + len(kept) - n_kept, budget_samples + dropped
+            # no ray left to train on: a zero loss that still reaches the regularizers
+            loss = torch.mean((rgb_map[kept] - rgb_train[kept]) ** 2) if n_kept > 0 else (rgb_map * 0).sum()
+        if isinstance(trainingSampler, ImportanceSampler):
+            ray_error = ((rgb_map - rgb_train) ** 2).detach().view(len(rgb_map), -1).mean(-1)
+            if kept is None:
+                trainingSampler.update(ray_idx, ray_error)
+            else:
+                trainingSampler.update(ray_idx[kept.cpu()], ray_error[kept])
 
         # loss
         total_loss = loss
@@ -256,13 +304,19 @@ def reconstruction(args, geo):
             total_loss = total_loss + loss_tv
             # summary_writer.add_scalar('train/reg_tv_app', loss_tv.detach().item(), global_step=iteration)
         if args.weight_rgbper > 0:
-            total_loss += args.weight_rgbper * ((rgbpers - rgb_train[ray_ids]).pow(2).sum(-1) * weights.detach()).sum() / len(rgb_train)
+            sample_weights = weights.detach() if kept is None else weights.detach() * kept[ray_ids]
+            total_loss += args.weight_rgbper * ((rgbpers - rgb_train[ray_ids]).pow(2).sum(-1) * sample_weights).sum() / len(rgb_train)
             # summary_writer.add_scalar('train/rgbper', loss_reg_L1.detach().item(), global_step=iteration)
         # if not rot_step:
         optimizer.zero_grad(set_to_none=True) if skip_zero_grad else optimizer.zero_grad()
         if cur_rot_step:
             geo_optimizer.zero_grad()
         total_loss.backward()
+        # model parallel ranks hold different tensoRFs and already the full gradient of the shared ones
+        if not model_parallel:
+            average_gradients([param for group in optimizer.param_groups for param in group['params']])
+        if cur_rot_step and not model_parallel:
+            average_gradients([param for group in geo_optimizer.param_groups for param in group['params']])
         # print("tensorf.basis_mat[0]", cur_rot_step, tensorf.density_line[0].grad)
         # if not rot_step:
         optimizer.step()
@@ -272,7 +326,8 @@ def reconstruction(args, geo):
 
         loss = loss.detach().item()
         
-        PSNRs.append(-10.0 * np.log(loss) / np.log(10.0))
+        if kept is None or n_kept > 0:
+            PSNRs.append(-10.0 * np.log(loss) / np.log(10.0))
         # summary_writer.add_scalar('train/PSNR', PSNRs[-1], global_step=iteration)
         # summary_writer.add_scalar('train/mse', loss, global_step=iteration)
 
@@ -287,16 +342,18 @@ def reconstruction(args, geo):
                 + f' train_psnr = {float(np.mean(PSNRs)):.2f}'
                 + f' test_psnr = {float(np.mean(PSNRs_test)):.2f}'
                 + f' mse = {loss:.6f}'
+                + (f' budget_dropped = {budget_rays} rays / {budget_samples} samples' if budget_rays > 0 else "")
                 + (f' rotx = {tensorf.pnt_rot[0,0] * 180 / np.pi:.6f}' if args.rotgrad > 0 else "")
                 + (f' roty = {tensorf.pnt_rot[0,1] * 180 / np.pi:.6f}' if args.rotgrad > 0 else "")
                 + (f' rotz = {tensorf.pnt_rot[0,2] * 180 / np.pi:.6f}' if args.rotgrad > 0 else "")
             )
             PSNRs = []
+            budget_rays, budget_samples = 0, 0
 
 
-        if iteration % args.vis_every == args.vis_every - 1 and args.N_vis!=0:
-            # test_dataset
-            PSNRs_test = evaluation(test_dataset, tensorf, args, renderer, f'{logfolder}/imgs_vis/', N_vis=args.N_vis, prtx=f'{iteration:06d}_', N_samples=-1, white_bg = white_bg, ray_type=ray_type, compute_extra_metrics=False)
+        if iteration % args.vis_every == args.vis_every - 1 and args.N_vis!=0 and (is_main() or model_parallel):
+            # test_dataset, with model parallel every brick takes part in rendering and only rank 0's images are kept
+            PSNRs_test = evaluation(test_dataset, tensorf, args, renderer, f'{logfolder}/imgs_vis/' if is_main() else f'{logfolder}/rank{rank}/imgs_vis/', N_vis=args.N_vis, prtx=f'{iteration:06d}_', N_samples=-1, white_bg = white_bg, ray_type=ray_type, compute_extra_metrics=False, device=device)
             # summary_writer.add_scalar('test/psnr', np.mean(PSNRs_test), global_step=iteration)
 
 
@@ -314,14 +371,25 @@ def reconstruction(args, geo):
             # filter rays outside the bbox
             mask_filtered, tensoRF_per_ray = tensorf.filtering_rays(allrays, allrgbs)
             tensoRF_per_ray = None if tensoRF_per_ray is None else tensoRF_per_ray.to(device)
-            allrays, allrgbs = allrays[mask_filtered], allrgbs[mask_filtered]
-            if args.rnd_ray > 0:
-                allalpha = allalpha[mask_filtered]
-                allijs = allijs[mask_filtered]
-                allc2ws = allc2ws[mask_filtered]
+            if isinstance(allrays, RayStream):
+                allrays = allrays[mask_filtered]
+                allrgbs = allrays.rgbs
+                if args.rnd_ray > 0:
+                    allalpha, allijs, allc2ws = allrays.alphas, allrays.ijs, allrays.rots
+            else:
+                allrays, allrgbs = allrays[mask_filtered], allrgbs[mask_filtered]
+                if args.rnd_ray > 0:
+                    allalpha = allalpha[mask_filtered]
+                    allijs = allijs[mask_filtered]
+                    allc2ws = allc2ws[mask_filtered]
 
 
-            trainingSampler = SimpleSampler(allrgbs.shape[0], args.batch_size)
+            if world_size == 1 and args.importance_sampling > 0:
+                trainingSampler = ImportanceSampler(allrgbs.shape[0], args.batch_size, args.importance_tile, args.importance_uniform, args.importance_decay)
+            elif world_size == 1:
+                trainingSampler = SimpleSampler(allrgbs.shape[0], args.batch_size)
+            else:
+                trainingSampler = ShardedSampler(allrgbs.shape[0], args.batch_size, 0 if model_parallel else rank, 1 if model_parallel else world_size, seed=iteration)
 
 
         if args.upsamp_list is not None and iteration in args.upsamp_list:
@@ -329,6 +397,10 @@ def reconstruction(args, geo):
             reset = upsamp_reset_list.pop(0) > 0
 
             tensorf.upsample_volume_grid(local_dims, reset_feat=reset)
+            if model_parallel:
+                broadcast_parameters(shared_parameters(tensorf))
+            else:
+                broadcast_parameters(tensorf.parameters())
 
             if args.lr_upsample_reset:
                 print("reset lr to initial")
@@ -339,7 +411,14 @@ def reconstruction(args, geo):
             optimizer = MaskedAdam(grad_vars, betas=(0.9,0.99)) if skip_zero_grad else torch.optim.Adam(grad_vars, betas=(0.9,0.99))
             if args.rotgrad > 0:
                 geo_optimizer = torch.optim.Adam(tensorf.get_geoparam_groups(args.lr_geo_init * lr_scale), betas=(0.9,0.99), weight_decay=0.0)
-    tensorf.save(f'{logfolder}/{args.expname}.th')
+    if model_parallel:
+        # each rank saves its brick, the final renders need all of them
+        tensorf.save(f'{logfolder}/{args.expname}_rank{rank}.th')
+        logfolder = logfolder if is_main() else f'{logfolder}/rank{rank}'
+    elif not is_main():
+        return
+    else:
+        tensorf.save(f'{logfolder}/{args.expname}.th')
 
 
     if args.render_train:
@@ -403,7 +482,14 @@ if __name__ == '__main__':
     np.random.seed(20211202)
     args = comp_revise(args)
 
-    geo = gen_geo(args) if args.use_geo > 0 else None
+    geo = None
+    if args.use_geo > 0:
+        # rank 0 writes the point store and the scene cache, the other ranks read them once it is done
+        if is_main():
+            geo = scene_cache.cached(args, "geo", scene_cache.geo_key(args), lambda: gen_geo(args, device=device), device=device)
+        barrier()
+        if not is_main():
+            geo = scene_cache.cached(args, "geo", scene_cache.geo_key(args), lambda: gen_geo(args, device=device), device=device)
 
     if args.export_mesh:
         export_mesh(args, geo)